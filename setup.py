@@ -15,5 +15,10 @@ setup(
         "moderngl",
         "pytest",
     ],
-    include_package_data=True
+    include_package_data=True,
+    entry_points={
+        "console_scripts": [
+            "textureshop = textureshop.cli:main",
+        ],
+    },
 )
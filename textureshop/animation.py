@@ -0,0 +1,163 @@
+"""
+animation module
+
+renders Raymarch + DeferredLight animations as a pipeline: GPU dispatch
+and uint8 packing on the GL thread, readback a frame late through
+ReadbackQueue, encoding on a background thread behind a bounded queue.
+"""
+
+import math
+import os
+import queue
+import threading
+import time
+
+import imageio as ii
+
+from .op_quantize import Quantize
+from .op_raymarch import CameraInfo
+from .readback import ReadbackQueue
+
+
+def orbit(radius=7.0, height=5.0, target=(0.0, 1.0, 0.0), turns=1.0):
+    """ camera path circling target, path(u) -> CameraInfo for u in [0, 1) """
+
+    def path(u):
+        angle = u * turns * math.pi * 2.0
+        caminfo = CameraInfo()
+        caminfo.u_campos = (math.cos(angle) * radius, height, math.sin(angle) * radius)
+        caminfo.u_camtarget = tuple(target)
+        return caminfo
+    return path
+
+
+class PNGSequenceWriter(object):
+    """ imageio writer look-alike, pattern is formatted with frame index """
+
+    def __init__(self, pattern):
+        super(PNGSequenceWriter, self).__init__()
+
+        self.pattern = pattern
+        self.index = 0
+
+        folder = os.path.dirname(pattern)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def append_data(self, data):
+        ii.imwrite(self.pattern.format(self.index), data)
+        self.index += 1
+
+    def close(self):
+        pass
+
+
+def open_writer(out, fps=30):
+    """ PNG sequence when out has a {} placeholder, e.g. "frames/{:04d}.png", else video """
+    if "{" in out:
+        return PNGSequenceWriter(out)
+    return ii.get_writer(out, fps=fps)
+
+
+class AnimationRenderer(object):
+    """
+    renders frames of light_node, lit from g-buffer of raymarch_node,
+    or of raymarch_node itself when it is a LitRaymarch and light_node is None.
+    queue_size bounds frames waiting for the encoder,
+    readback_depth is the number of frames in flight on GPU.
+    """
+
+    def __init__(self, raymarch_node, light_node=None, fmt="rgba8", queue_size=4, readback_depth=2):
+        super(AnimationRenderer, self).__init__()
+
+        self.raymarch_node = raymarch_node
+        self.light_node = light_node
+        self.queue_size = queue_size
+        self.readback_depth = readback_depth
+
+        # flipped like npappend, packed before readback
+        lit_node = light_node or raymarch_node
+        self.frame_node = Quantize().in_node(lit_node, lit_node, fmt, flip=True)
+
+        self.stats = {}
+
+    def frame(self, t, caminfo):
+        """ dispatch one frame, returns Quantize node to read back """
+        self.raymarch_node.set_caminfo(caminfo)
+        self.raymarch_node.set_time(t)
+        if self.light_node is None:
+            # dispatched by frame_node
+            return self.frame_node
+
+        self.light_node.set_caminfo(caminfo)
+        g_buffer = self.raymarch_node.out_node()
+        self.light_node.set_g_buffer(g_buffer)
+        return self.frame_node
+
+    def render(self, out, time_range=(0.0, 12.0), frames=120, camera_path=None, fps=30):
+        """
+        render frames evenly over time_range into out, a video path or PNG pattern,
+        see open_writer. camera_path(u) -> CameraInfo, u goes from 0 to 1 over frames.
+        returns stats with frames per second.
+        """
+
+        camera_path = camera_path or orbit()
+        writer = open_writer(out, fps) if isinstance(out, str) else out
+
+        frame_queue = queue.Queue(maxsize=self.queue_size)
+        errors = []
+        encode_seconds = [0.0]
+
+        def encode():
+            while True:
+                data = frame_queue.get()
+                if data is None:
+                    return
+
+                # keep draining after a failure, so GL thread never blocks on a full queue
+                if errors:
+                    continue
+
+                start = time.perf_counter()
+                try:
+                    writer.append_data(data)
+                except Exception as e:
+                    errors.append(e)
+                encode_seconds[0] += time.perf_counter() - start
+
+        encoder = threading.Thread(target=encode, name="textureshop-encoder", daemon=True)
+        encoder.start()
+
+        start = time.perf_counter()
+        t0, t1 = time_range
+        try:
+            # callbacks run on GL thread, put blocks while the encoder is behind
+            readbacks = ReadbackQueue(self.frame_node.gl, depth=self.readback_depth, workers=0)
+            for i in range(frames):
+                if errors:
+                    break
+
+                u = i / frames
+                node = self.frame(t0 + (t1 - t0) * u, camera_path(u))
+                readbacks.submit(node, frame_queue.put)
+            readbacks.close()
+
+        finally:
+            frame_queue.put(None)
+            encoder.join()
+            if isinstance(out, str):
+                writer.close()
+
+        if errors:
+            raise errors[0]
+
+        elapsed = time.perf_counter() - start
+        self.stats = {
+            "frames": frames,
+            "seconds": elapsed,
+            "fps": frames / elapsed if elapsed > 0 else float("inf"),
+            "encode_seconds": encode_seconds[0],
+        }
+        print("[Animation] {} frames in {:.2f}s, {:.2f} fps".format(
+            frames, elapsed, self.stats["fps"]))
+        return self.stats
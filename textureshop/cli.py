@@ -0,0 +1,88 @@
+"""
+cli module
+
+textureshop render GRAPH.json [GRAPH.json ...]
+
+renders many graphs in one process, so they share the GL context,
+compiled programs and pooled buffers.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from .graph import Graph
+from .op_base import Base, BufferPool
+from .util import npwrite
+
+
+def output_path(graph_path, out_dir, ext):
+    name = os.path.splitext(os.path.basename(graph_path))[0]
+    return os.path.join(out_dir, "{}.{}".format(name, ext))
+
+
+def render(args):
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    failed = 0
+    gl = None
+    start = time.perf_counter()
+    for graph_path in args.graphs:
+        job_start = time.perf_counter()
+        try:
+            graph = Graph.load(graph_path)
+            init = graph.init(backend=args.backend)
+            gl = init.gl or gl
+            data = graph.render(init)
+
+            if args.npy:
+                path = output_path(graph_path, args.out_dir, "npy")
+                np.save(path, data)
+            else:
+                path = output_path(graph_path, args.out_dir, "png")
+                npwrite(path, data, args.fmt)
+
+        except Exception as e:
+            failed += 1
+            print("[render] {} failed: {}".format(graph_path, e), file=sys.stderr)
+            continue
+
+        print("[render] {} {}x{} {:.1f} ms -> {}".format(
+            graph_path, graph.size[0], graph.size[1],
+            (time.perf_counter() - job_start) * 1000.0, path))
+
+    print("[render] {} graphs, {} failed, {:.2f}s".format(
+        len(args.graphs), failed, time.perf_counter() - start))
+    print("[render] programs: {}".format(Base.PROGRAM_CACHE.stats()))
+    if gl:
+        print("[render] buffers: {}".format(BufferPool.of(gl).stats()))
+    return 1 if failed else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="textureshop")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    render_parser = commands.add_parser("render", help="render graph JSON files")
+    render_parser.add_argument("graphs", nargs="+", help="graph JSON files, see graph module")
+    render_parser.add_argument("-o", "--out-dir", default=".", help="output folder, default: .")
+    render_parser.add_argument("--backend", choices=Base.BACKENDS, default=None,
+                               help="overrides backend of graphs")
+    render_parser.add_argument("--fmt", default="rgba8", help="image format, see op_quantize.FORMATS")
+    render_parser.add_argument("--npy", action="store_true", help="write float32 .npy instead of images")
+    render_parser.set_defaults(run=render)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+context module
+
+pool of GL contexts pinned to threads. a context is current on the thread
+that created it and never moves, since EGL / GLX contexts can't be current
+on two threads and software renderers run one queue per context.
+independent graphs run concurrently with submit / map, each pool worker
+thread owns one context.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import moderngl as mg
+
+
+# context of each thread. shared by all pools, so Init on a pool worker
+# finds the worker's context, and a new thread never inherits a dead one's
+_local = threading.local()
+
+# one context per pool worker and process, debug level keeps CLI output clean
+logger = logging.getLogger(__name__)
+
+
+class ContextPool(object):
+    """
+    size is the number of worker threads, each with its own context.
+    threads outside the pool get their own context on first current() too.
+    capture: use a context already current on the thread (e.g. a host
+    application's window) before creating a standalone one.
+    context_args: passed to moderngl.create_standalone_context, e.g. backend="egl".
+    """
+
+    def __init__(self, size=1, require=440, capture=True, context_args=None):
+        super(ContextPool, self).__init__()
+
+        if size < 1:
+            raise Exception("[ContextPool] size should be at least 1")
+
+        self.size = size
+        self.require = require
+        self.capture = capture
+        self.context_args = context_args or {}
+
+        self.lock = threading.Lock()
+        self.executor = None
+
+        # idents of pool worker threads
+        self.workers = set()
+
+    def create(self):
+        """ new context, current on calling thread """
+        if self.capture:
+            try:
+                return mg.create_context(require=self.require)
+            except Exception:
+                # no context current on this thread, detection errors vary by platform
+                pass
+
+        try:
+            gl = mg.create_standalone_context(require=self.require, **self.context_args)
+        except (mg.Error, RuntimeError) as e:
+            raise Exception("[ContextPool] can't create GL {} context: {}".format(self.require, e))
+
+        logger.debug("GL context with id: %s", id(gl))
+        return gl
+
+    def current(self):
+        """ context of calling thread, created on first call """
+        gl = getattr(_local, "gl", None)
+        if gl is None:
+            gl = self.create()
+            _local.gl = gl
+        return gl
+
+    def submit(self, f, *args, **kargs):
+        """ run f on a pool thread, Init there picks that thread's context. returns Future """
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.size, thread_name_prefix="textureshop-gl")
+        return self.executor.submit(self._run, f, args, kargs)
+
+    def _run(self, f, args, kargs):
+        with self.lock:
+            self.workers.add(threading.get_ident())
+        self.current()
+        return f(*args, **kargs)
+
+    def map(self, f, iterable):
+        """ [f(x) for x in iterable], spread over pool threads """
+        futures = [self.submit(f, x) for x in iterable]
+        return [future.result() for future in futures]
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "workers": len(self.workers),
+        }
+
+    def shutdown(self):
+        """
+        stop worker threads, their contexts go with them. contexts are not
+        released explicitly: on some EGL drivers releasing one tears down
+        the display shared with every other context in the process.
+        """
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is None:
+            return
+
+        executor.shutdown()
+
+        with self.lock:
+            self.workers = set()
@@ -5,16 +5,24 @@
 #define LY 32
 #define PI 3.141592
 
+#define OCTAVES %OCTAVES%
+
 layout(local_size_x=LX, local_size_y=LY) in;
-layout(binding=0) buffer out_buffer
+%OUT_BUFFER%
+
+layout(binding=1) buffer octaves_buffer
 {
-    vec4 o_col[];
+    int octaves_col[];
 };
 
 uniform sampler2D u_noise_tex;
 
 uniform int u_width;
 uniform int u_height;
+
+// tile position inside full image
+uniform vec2 u_offset;
+uniform vec2 u_full_size;
 uniform int u_octaves;
 
 
@@ -43,12 +51,18 @@ void main()
         xy.x = int(gl_LocalInvocationID.x + gl_WorkGroupID.x * LX);
         xy.y = int(gl_LocalInvocationID.y + gl_WorkGroupID.y * LY);
     
-        xy = min(xy, wh);
-        uv = xy / wh;
+        uv = (xy + u_offset) / u_full_size;
+    }
+
+    // out of image threads would write into next batch layer
+    if (xy.x >= wh.x || xy.y >= wh.y)
+    {
+        return;
     }
+    int z = int(gl_GlobalInvocationID.z);
 
     vec2 nuv = uv * 0.01;
-    float n = fbm(nuv, u_octaves);
+    float n = fbm(nuv, OCTAVES);
 
     n = clamp(n, 0.0, 1.0);
 
@@ -56,6 +70,6 @@ void main()
     rgba.xyz = vec3(n);
     rgba.w = 1.0;
 
-    int i = int(xy.x + xy.y * wh.x);
-    o_col[i] = rgba;
+    int i = int(xy.x + xy.y * wh.x) + z * u_width * u_height;
+    store_o(i, rgba);
 }
@@ -0,0 +1,56 @@
+#version 440
+
+#define LX 32
+#define LY 32
+#define PI 3.141592
+
+layout(local_size_x=LX, local_size_y=LY) in;
+%OUT_BUFFER%
+
+%IN_BUFFERS%
+
+uniform int u_width;
+uniform int u_height;
+
+%UNIFORMS%
+
+vec4 _div(vec4 a, vec4 b)
+{
+    float eps = 0.000001;
+    vec4 base;
+    base.x = abs(b.x) - eps < 0.0 ? eps : b.x;
+    base.y = abs(b.x) - eps < 0.0 ? eps : b.y;
+    base.z = abs(b.x) - eps < 0.0 ? eps : b.z;
+    base.w = abs(b.x) - eps < 0.0 ? eps : b.w;
+    return a / base;
+}
+
+// value as loaded back from float16 storage
+vec4 _half(vec4 v)
+{
+    return vec4(unpackHalf2x16(packHalf2x16(v.xy)), unpackHalf2x16(packHalf2x16(v.zw)));
+}
+
+void main()
+{
+    vec2 wh = vec2(u_width, u_height);
+    vec2 xy;
+    vec2 uv;
+    {
+        xy.x = int(gl_LocalInvocationID.x + gl_WorkGroupID.x * LX);
+        xy.y = int(gl_LocalInvocationID.y + gl_WorkGroupID.y * LY);
+    
+        uv = xy / wh;
+    }
+
+    // out of image threads would write into next batch layer
+    if (xy.x >= wh.x || xy.y >= wh.y)
+    {
+        return;
+    }
+
+    int z = int(gl_GlobalInvocationID.z);
+    int i = int(xy.x + xy.y * wh.x) + z * u_width * u_height;
+
+%BODY%
+}
@@ -9,14 +9,20 @@
 #define GRAD_TYPE %TYPE%
 
 layout(local_size_x=LX, local_size_y=LY) in;
-layout(binding=0) buffer out_buffer
+%OUT_BUFFER%
+
+layout(binding=1) buffer type_buffer
 {
-    vec4 o_col[];
+    int type_col[];
 };
 
 uniform int u_width;
 uniform int u_height;
 
+// tile position inside full image
+uniform vec2 u_offset;
+uniform vec2 u_full_size;
+
 vec4 _horizontal_left_grid(vec2 uv)
 {
     float r = uv.x;
@@ -57,6 +63,20 @@ vec4 _radial_out_grid(vec2 uv)
     return vec4(r, r, r, 1.0);
 }
 
+// gradient type of each batch layer, same order as Gradient.GRAD_*
+vec4 _layer_grid(vec2 uv)
+{
+    switch (type_col[gl_GlobalInvocationID.z])
+    {
+        case 0: return _horizontal_left_grid(uv);
+        case 1: return _horizontal_right_grid(uv);
+        case 2: return _vertical_up_grid(uv);
+        case 3: return _vertical_down_grid(uv);
+        case 4: return _radial_in_grid(uv);
+        default: return _radial_out_grid(uv);
+    }
+}
+
 void main()
 {
     vec2 wh = vec2(u_width, u_height);
@@ -66,10 +86,16 @@ void main()
         xy.x = int(gl_LocalInvocationID.x + gl_WorkGroupID.x * LX);
         xy.y = int(gl_LocalInvocationID.y + gl_WorkGroupID.y * LY);
     
-        xy = min(xy, wh);
-        uv = xy / wh;
+        uv = (xy + u_offset) / u_full_size;
+    }
+
+    // out of image threads would write into next batch layer
+    if (xy.x >= wh.x || xy.y >= wh.y)
+    {
+        return;
     }
 
-    int i = int(xy.x + xy.y * wh.x);
-    o_col[i] = GRAD_TYPE(uv);
+    int z = int(gl_GlobalInvocationID.z);
+    int i = int(xy.x + xy.y * wh.x) + z * u_width * u_height;
+    store_o(i, GRAD_TYPE(uv));
 }
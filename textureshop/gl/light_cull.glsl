@@ -0,0 +1,151 @@
+#version 440
+
+// one workgroup per tile, same tiles as raymarch_post.glsl
+#define LX 32
+#define LY 32
+
+// depth of rays that missed, same as raymarch.glsl
+#define FAR 50.0
+
+#define MAX_TILE_LIGHTS %MAX_TILE_LIGHTS%
+
+layout(local_size_x=LX, local_size_y=LY) in;
+
+// bindings 1 to 4, only depth is read
+%G_BUFFER%
+
+// two vec4 per light: (position, radius), (color, 0)
+layout(binding=6) buffer in_lights
+{
+    vec4 i_lights[];
+};
+
+// per tile: number of lights touching it, then up to MAX_TILE_LIGHTS light indices
+layout(binding=7) buffer out_tiles
+{
+    uint o_tiles[];
+};
+
+uniform int u_width;
+uniform int u_height;
+uniform int u_num_lights;
+
+// camera position and lookat() of raymarch.glsl
+uniform vec3 u_campos;
+uniform mat3 u_look;
+
+// positive floats order like their bits
+shared uint s_near;
+shared uint s_far;
+shared uint s_count;
+
+// bit per 32th of [near, far] holding a surface of the tile
+shared uint s_slices;
+
+
+vec3 ray_dir(vec2 xy)
+{
+    vec2 uv = xy / vec2(u_width, u_height);
+    return u_look * normalize(vec3((uv - 0.5) * 2.0, 1.0));
+}
+
+void main()
+{
+    uint local = gl_LocalInvocationIndex;
+    if (local == 0u)
+    {
+        s_near = floatBitsToUint(FAR);
+        s_far = 0u;
+        s_count = 0u;
+        s_slices = 0u;
+    }
+    barrier();
+
+    ivec2 p = ivec2(gl_GlobalInvocationID.xy);
+    float depth = FAR;
+    if (p.x < u_width && p.y < u_height)
+    {
+        depth = load_i_depth(p.x + p.y * u_width);
+        if (depth < FAR)
+        {
+            atomicMin(s_near, floatBitsToUint(max(depth, 0.0)));
+            atomicMax(s_far, floatBitsToUint(depth));
+        }
+    }
+    barrier();
+
+    int base = int(gl_WorkGroupID.x + gl_WorkGroupID.y * gl_NumWorkGroups.x) * (MAX_TILE_LIGHTS + 1);
+
+    // only background in tile
+    if (s_far == 0u)
+    {
+        if (local == 0u)
+        {
+            o_tiles[base] = 0u;
+        }
+        return;
+    }
+
+    // pixel rays of the tile are spanned by its corner rays, depth is ray travel
+    float near = uintBitsToFloat(s_near);
+    float far = uintBitsToFloat(s_far);
+    float slice_scale = 32.0 / max(far - near, 1e-6);
+    if (depth < FAR)
+    {
+        atomicOr(s_slices, 1u << min(int((depth - near) * slice_scale), 31));
+    }
+    barrier();
+
+    vec2 lo = vec2(gl_WorkGroupID.xy * uvec2(LX, LY));
+    vec2 hi = min(lo + vec2(LX, LY), vec2(u_width, u_height));
+    vec3 corners[4];
+    corners[0] = ray_dir(lo);
+    corners[1] = ray_dir(vec2(hi.x, lo.y));
+    corners[2] = ray_dir(hi);
+    corners[3] = ray_dir(vec2(lo.x, hi.y));
+    vec3 center = ray_dir((lo + hi) * 0.5);
+
+    // inward normals of the side planes through the camera
+    vec3 planes[4];
+    for (int c = 0; c < 4; c++)
+    {
+        vec3 n = normalize(cross(corners[c], corners[(c + 1) & 3]));
+        planes[c] = dot(n, center) < 0.0 ? -n : n;
+    }
+
+    for (int k = int(local); k < u_num_lights; k += LX * LY)
+    {
+        vec4 light = i_lights[k * 2];
+        vec3 v = light.xyz - u_campos;
+        float d = length(v);
+        bool touches = d + light.w > near && d - light.w < far;
+        if (touches)
+        {
+            // surfaces within radius have depth within radius of d
+            int first = clamp(int((d - light.w - near) * slice_scale), 0, 31);
+            int last = clamp(int((d + light.w - near) * slice_scale), 0, 31);
+            uint span = (0xffffffffu >> (31 - last + first)) << first;
+            touches = (span & s_slices) != 0u;
+        }
+        for (int c = 0; c < 4; c++)
+        {
+            touches = touches && dot(planes[c], v) > -light.w;
+        }
+
+        if (touches)
+        {
+            uint slot = atomicAdd(s_count, 1u);
+            if (slot < uint(MAX_TILE_LIGHTS))
+            {
+                o_tiles[base + 1 + int(slot)] = uint(k);
+            }
+        }
+    }
+    barrier();
+
+    // may be above MAX_TILE_LIGHTS, see DeferredLight.tile_stats
+    if (local == 0u)
+    {
+        o_tiles[base] = s_count;
+    }
+}
@@ -6,25 +6,18 @@
 #define PI 3.141592
 
 #define OPERATION %CALC%
+#define IN_A %IN_A%
+#define IN_B %IN_B%
 
 layout(local_size_x=LX, local_size_y=LY) in;
-layout(binding=0) buffer out_buffer
-{
-    vec4 o_col[];
-};
-
-layout(binding=1) buffer a_buffer
-{
-    vec4 a_col[];
-};
+%OUT_BUFFER%
 
-layout(binding=2) buffer b_buffer
-{
-    vec4 b_col[];
-};
+%IN_BUFFERS%
 
 uniform int u_width;
 uniform int u_height;
+uniform vec4 u_a;
+uniform vec4 u_b;
 uniform float u_clamp_min_value;
 uniform float u_clamp_max_value;
 
@@ -128,10 +121,16 @@ void main()
         xy.x = int(gl_LocalInvocationID.x + gl_WorkGroupID.x * LX);
         xy.y = int(gl_LocalInvocationID.y + gl_WorkGroupID.y * LY);
     
-        xy = min(xy, wh);
         uv = xy / wh;
     }
 
-    int i = int(xy.x + xy.y * wh.x);
-    o_col[i] = OPERATION(a_col[i], b_col[i]);
+    // out of image threads would write into next batch layer
+    if (xy.x >= wh.x || xy.y >= wh.y)
+    {
+        return;
+    }
+
+    int z = int(gl_GlobalInvocationID.z);
+    int i = int(xy.x + xy.y * wh.x) + z * u_width * u_height;
+    store_o(i, OPERATION(IN_A, IN_B));
 }
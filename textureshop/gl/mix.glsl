@@ -6,31 +6,22 @@
 #define PI 3.141592
 
 #define OPERATION %CALC%
+#define IN_A %IN_A%
+#define IN_B %IN_B%
+#define IN_C %IN_C%
 
 layout(local_size_x=LX, local_size_y=LY) in;
-layout(binding=0) buffer out_buffer
-{
-    vec4 o_col[];
-};
-
-layout(binding=1) buffer a_buffer
-{
-    vec4 a_col[];
-};
-
-layout(binding=2) buffer b_buffer
-{
-    vec4 b_col[];
-};
+%OUT_BUFFER%
 
-layout(binding=3) buffer c_buffer
-{
-    vec4 c_col[];
-};
+%IN_BUFFERS%
 
 uniform int u_width;
 uniform int u_height;
 
+uniform vec4 u_a;
+uniform vec4 u_b;
+uniform vec4 u_c;
+
 uniform mat2 u_rot_z;
 
 
@@ -53,8 +44,11 @@ vec4 _rotate(vec4 a, vec4 b, vec4 c)
     xy = u_rot_z * xy;
     xy.x = mod(xy.x, wh.x);
     xy.y = mod(xy.y, wh.y);
-    int i = int(xy.x + xy.y * wh.x);
-    return a_col[i];
+    // mod() may return wh itself, keep index inside this layer
+    int layer_size = u_width * u_height;
+    int z = int(gl_GlobalInvocationID.z);
+    int i = min(int(xy.x + xy.y * wh.x), layer_size - 1) + z * layer_size;
+    return load_a(i);
 }
 
 void main()
@@ -66,10 +60,16 @@ void main()
         xy.x = int(gl_LocalInvocationID.x + gl_WorkGroupID.x * LX);
         xy.y = int(gl_LocalInvocationID.y + gl_WorkGroupID.y * LY);
     
-        xy = min(xy, wh);
         uv = xy / wh;
     }
 
-    int i = int(xy.x + xy.y * wh.x);
-    o_col[i] = OPERATION(a_col[i], b_col[i], c_col[i]);
+    // out of image threads would write into next batch layer
+    if (xy.x >= wh.x || xy.y >= wh.y)
+    {
+        return;
+    }
+
+    int z = int(gl_GlobalInvocationID.z);
+    int i = int(xy.x + xy.y * wh.x) + z * u_width * u_height;
+    store_o(i, OPERATION(IN_A, IN_B, IN_C));
 }
@@ -0,0 +1,66 @@
+
+#version 440
+
+#define LX 64
+#define BITS %BITS%
+#define CHANNELS %CHANNELS%
+
+layout(local_size_x=LX) in;
+layout(binding=0) buffer out_buffer
+{
+    uint o_words[];
+};
+
+%IN_BUFFERS%
+
+uniform int u_width;
+uniform int u_height;
+uniform int u_layers;
+uniform int u_flip;
+
+// source channel of each output channel
+uniform ivec4 u_channels;
+
+const int PER_WORD = 32 / BITS;
+const float MAX_VALUE = float((1 << BITS) - 1);
+
+// v-th value of the packed stream, pixel by pixel, CHANNELS values each
+float stream_value(int v)
+{
+    int layer_size = u_width * u_height;
+    int pixel = v / CHANNELS;
+    int layer = pixel / layer_size;
+    int p = pixel - layer * layer_size;
+
+    if (u_flip != 0)
+    {
+        // same as data[::-1] of (W, H, 4) array
+        int row = p / u_height;
+        int col = p - row * u_height;
+        p = (u_width - 1 - row) * u_height + col;
+    }
+
+    vec4 rgba = load_a(p + layer * layer_size);
+    return rgba[u_channels[v % CHANNELS]];
+}
+
+void main()
+{
+    int stride = int(gl_NumWorkGroups.x) * LX;
+    int word = int(gl_GlobalInvocationID.x) + int(gl_GlobalInvocationID.y) * stride;
+
+    int total = u_width * u_height * u_layers * CHANNELS;
+    int first = word * PER_WORD;
+    if (first >= total)
+    {
+        return;
+    }
+
+    uint word_bits = 0u;
+    for (int j = 0; j < PER_WORD && first + j < total; ++j)
+    {
+        float x = clamp(stream_value(first + j), 0.0, 1.0);
+        word_bits |= uint(x * MAX_VALUE) << uint(j * BITS);
+    }
+    o_words[word] = word_bits;
+}
@@ -9,39 +9,98 @@
 #define FAR 50.0
 #define SURFACE %SURFACE%
 
+// world() samples per normal: 4 (tetrahedron) or 6 (central differences)
+#define NORMAL_SAMPLES %NORMAL_SAMPLES%
+
+// 1: rays start and stop at bounds, 1: per pixel march steps in o_steps
+#define BOUNDS %BOUNDS%
+#define COUNT_STEPS %COUNT_STEPS%
+
+// traced subset of pixels each frame, see raymarch_resolve.glsl
+#define TRACE_STEP %TRACE_STEP%
+#define CHECKERBOARD %CHECKERBOARD%
+
+// 1: main() samples world() into o_volume instead of tracing, see BakeSDF.
+// BAKE_BRICK: cells per brick edge of a brick atlas, 0 for a dense grid
+#define BAKE %BAKE%
+#define BAKE_BRICK %BAKE_BRICK%
+
 layout(local_size_x=LX, local_size_y=LY) in;
-layout(binding=0) buffer out_depth
+
+#if BAKE
+// (distance, color) per sample, x fastest
+layout(binding=0) buffer out_volume
 {
-    float o_dep[];
+    vec4 o_volume[];
 };
 
-layout(binding=1) buffer out_basecolor
+#if BAKE_BRICK
+// grid coordinates of the brick in each atlas slot
+layout(binding=1) buffer in_slots
 {
-    vec4 o_col[];
+    ivec4 i_slots[];
 };
 
-layout(binding=2) buffer out_normal
+uniform int u_num_slots;
+uniform ivec3 u_bake_slots;
+#endif
+
+// texel is sampled at u_bake_min + (texel * u_bake_stride + u_bake_offset) * u_bake_cell
+uniform ivec3 u_bake_size;
+uniform vec3 u_bake_min;
+uniform vec3 u_bake_cell;
+uniform float u_bake_stride = 1.0;
+uniform float u_bake_offset = 0.0;
+#endif
+
+#if COUNT_STEPS
+// primary march steps, top bit set when the ray ran out of steps
+layout(binding=4) buffer out_steps
 {
-    vec4 o_nrm[];
+    uint o_steps[];
 };
+#endif
 
-layout(binding=3) buffer out_shadow
+#if BOUNDS
+// two vec4 per bound, sphere: (center, radius), (0) box: (min, 0), (max, 1)
+layout(binding=5) buffer in_bounds
 {
-    vec4 o_shw[];
+    vec4 i_bounds[];
 };
+#endif
 
 uniform int u_width;
 uniform int u_height;
 uniform int u_maxsteps;
+uniform int u_shadow_steps;
 uniform float u_time;
+uniform ivec2 u_phase;
 
 uniform vec3 u_campos = vec3(0.0, 0.5, -5.0);
 uniform vec3 u_camtarget = vec3(0.0, 0.0, 0.0);
 uniform vec3 u_lightpos = vec3(1.0, 1.0, 0.0);
 
+// step factor of over-relaxed sphere tracing, 1.0 is plain sphere tracing
+uniform float u_relaxation = 1.0;
+uniform int u_num_bounds;
+
+// store_o(i, depth, color, normal, shadow) writing bindings 0 to 3,
+// see op_raymarch.g_buffer_glsl, or lighting them, see LitRaymarch
+%G_BUFFER%
+
 bool w_need_color = false;
 vec3 w_color;
 
+// bounds hit by primary ray, every bound on other rays
+uint w_bound_mask = 0xffffffffu;
+int w_steps = 0;
+bool w_capped = false;
+
+bool bound_hit(int k)
+{
+    return (w_bound_mask & (1u << uint(k))) != 0u;
+}
+
 
 mat3 rot_x(float e)
 {
@@ -106,38 +165,123 @@ float blend(float a, float b, float k)
     return t - k * h * (1.0 - h);
 }
 
+// volume_at(p) of a baked distance field, see SDFVolume.glsl
+%VOLUME%
+
 float world(vec3 p)
 {
 %DIST_FIELD%
 }
 
+#if BOUNDS
+vec2 sphere_span(vec3 o, vec3 r, vec4 s)
+{
+    vec3 oc = o - s.xyz;
+    float b = dot(oc, r);
+    float h = b * b - dot(oc, oc) + s.w * s.w;
+    if (h < 0.0)
+    {
+        return vec2(FAR, -FAR);
+    }
+    h = sqrt(h);
+    return vec2(-b - h, -b + h);
+}
+
+vec2 box_span(vec3 o, vec3 r, vec3 lo, vec3 hi)
+{
+    vec3 t0 = (lo - o) / r;
+    vec3 t1 = (hi - o) / r;
+    vec3 near = min(t0, t1);
+    vec3 far = max(t0, t1);
+    return vec2(max(max(near.x, near.y), near.z), min(min(far.x, far.y), far.z));
+}
+
+// [enter, exit] of ray over all bounds, empty when enter > exit
+vec2 bounds_span(vec3 o, vec3 r)
+{
+    vec2 span = vec2(FAR, -FAR);
+    w_bound_mask = 0u;
+    for (int k = 0; k < u_num_bounds; k++)
+    {
+        vec4 a = i_bounds[k * 2];
+        vec4 b = i_bounds[k * 2 + 1];
+        vec2 s = b.w > 0.5 ? box_span(o, r, a.xyz, b.xyz) : sphere_span(o, r, a);
+        if (s.x <= s.y && s.y > 0.0)
+        {
+            w_bound_mask |= 1u << uint(k);
+            span = vec2(min(span.x, s.x), max(span.y, s.y));
+        }
+    }
+    return span;
+}
+#endif
+
 float raymarch(vec3 o, vec3 r)
 {
     float t = NEAR;
+    float t_max = FAR;
+#if BOUNDS
+    vec2 span = bounds_span(o, r);
+    if (span.x > span.y)
+    {
+        return FAR;
+    }
+    t = max(t, span.x);
+    t_max = min(FAR, span.y);
+#endif
+
+    float omega = u_relaxation;
+    float prev_d = 0.0;
+    float step = 0.0;
     float d;
     int i;
     for (i = u_maxsteps; i > 0; i--)
     {
+        w_steps++;
         vec3 p = o + r * t;
         d = world(p);
+        if (omega > 1.0 && d + prev_d < step)
+        {
+            // relaxed step left the unbounding sphere, step back and trace plainly
+            t += prev_d - step;
+            step = prev_d;
+            omega = 1.0;
+            continue;
+        }
         if (d < SURFACE)
         {
             return t;
         }
-        t += d;
+        step = d * omega;
+        prev_d = d;
+        t += step;
+
+        // missed, past bounds or FAR
+        if (t > t_max)
+        {
+            return FAR;
+        }
     }
 
+    w_capped = true;
     return t;
 }
 
 vec3 normal_at(vec3 p)
 {
+#if NORMAL_SAMPLES == 4
+    vec2 k = vec2(1.0, -1.0) * 0.001;
+    return normalize(
+        k.xyy * world(p + k.xyy) + k.yyx * world(p + k.yyx) +
+        k.yxy * world(p + k.yxy) + k.xxx * world(p + k.xxx));
+#else
     vec2 e = vec2(0.001, 0.0);
     return normalize(vec3(
         world(p + e.xyy) - world(p - e.xyy),
         world(p + e.yxy) - world(p - e.yxy),
         world(p + e.yyx) - world(p - e.yyx)
     ));
+#endif
 }
 
 float soft_shadow(vec3 o, vec3 r)
@@ -148,7 +292,7 @@ float soft_shadow(vec3 o, vec3 r)
     float res = 1.0;
     float ph = 1e+8;
 
-    for (int i = 0; i < u_maxsteps; i++)
+    for (int i = 0; i < u_shadow_steps; i++)
     {
         float h = world(o + r * t);
         if (h < SURFACE)
@@ -165,19 +309,60 @@ float soft_shadow(vec3 o, vec3 r)
     return res;
 }
 
+#if BAKE
+void main()
+{
+    ivec3 texel = ivec3(gl_GlobalInvocationID.xy, gl_WorkGroupID.z);
+    if (texel.x >= u_bake_size.x || texel.y >= u_bake_size.y)
+    {
+        return;
+    }
+
+#if BAKE_BRICK
+    // bricks of BAKE_BRICK + 1 samples per edge, neighbours repeat the shared face
+    ivec3 slot = texel / (BAKE_BRICK + 1);
+    int n = slot.x + u_bake_slots.x * (slot.y + u_bake_slots.y * slot.z);
+    if (n >= u_num_slots)
+    {
+        return;
+    }
+    vec3 g = vec3(i_slots[n].xyz * BAKE_BRICK + texel - slot * (BAKE_BRICK + 1));
+#else
+    vec3 g = vec3(texel) * u_bake_stride + u_bake_offset;
+#endif
+
+    w_need_color = true;
+    w_color = vec3(1.0);
+    float d = world(u_bake_min + g * u_bake_cell);
+    o_volume[texel.x + u_bake_size.x * (texel.y + u_bake_size.y * texel.z)] = vec4(d, w_color);
+}
+#else
 void main()
 {
     vec2 wh = vec2(u_width, u_height);
     vec2 xy;
     vec2 uv;
     {
+#if CHECKERBOARD || TRACE_STEP > 1
+        ivec2 gid = ivec2(gl_GlobalInvocationID.xy);
+#if CHECKERBOARD
+        xy = vec2(gid.x * 2 + ((gid.y + u_phase.x) & 1), gid.y);
+#else
+        xy = vec2(gid * TRACE_STEP + u_phase);
+#endif
+#else
         xy.x = int(gl_LocalInvocationID.x + gl_WorkGroupID.x * LX);
         xy.y = int(gl_LocalInvocationID.y + gl_WorkGroupID.y * LY);
-    
-        xy = min(xy, wh);
+#endif
         uv = xy / wh;
     }
 
+    // threads past the image edge would write pixels of the next row
+    if (xy.x >= wh.x || xy.y >= wh.y)
+    {
+        return;
+    }
+
     mat3 _look = lookat(u_campos, u_camtarget, 0.0);
     vec3 o = u_campos;
     vec3 r = normalize(vec3((uv - 0.5) * 2.0, 1.0));
@@ -186,6 +371,7 @@ void main()
     w_need_color = true;
     float travel = raymarch(o, r);
     w_need_color = false;
+    w_bound_mask = 0xffffffffu;
 
     vec3 rgb = vec3(0.2, 0.2, 0.4);
     vec3 normal = vec3(0.5, 0.5, 1.0);
@@ -199,13 +385,10 @@ void main()
     }
 
     int i = int(xy.x + xy.y * wh.x);
-    o_dep[i].x = travel;
-
-    o_col[i].xyz = rgb;
-    o_col[i].w = 1.0;
-
-    o_nrm[i].xyz = normal.xyz;
-    o_nrm[i].w = 1.0;
+    store_o(i, travel, rgb, normal, shadow);
 
-    o_shw[i].x = shadow;
+#if COUNT_STEPS
+    o_steps[i] = uint(w_steps) | (w_capped ? 0x80000000u : 0u);
+#endif
 }
+#endif
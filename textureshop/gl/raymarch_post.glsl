@@ -9,26 +9,18 @@
 #define FAR 100.0
 #define SURFACE 0.0001
 
-layout(local_size_x=LX, local_size_y=LY) in;
-layout(binding=1) buffer in_depth
-{
-    float i_dep[];
-};
+// depth of rays that missed, same as raymarch.glsl
+#define RAY_FAR 50.0
 
-layout(binding=2) buffer in_color
-{
-    vec4 i_col[];
-};
+// point lights besides u_lightpos, culled per tile by light_cull.glsl when CULL
+#define LIGHTS %LIGHTS%
+#define CULL %CULL%
+#define MAX_TILE_LIGHTS %MAX_TILE_LIGHTS%
 
-layout(binding=3) buffer in_normal
-{
-    vec4 i_nrm[];
-};
+layout(local_size_x=LX, local_size_y=LY) in;
 
-layout(binding=3) buffer in_shadow
-{
-    vec4 i_shw[];
-};
+// bindings 1 to 4, see op_raymarch.g_buffer_glsl
+%G_BUFFER%
 
 layout(binding=0) buffer out_color
 {
@@ -43,12 +35,52 @@ uniform vec3 u_camtarget = vec3(0.0, 0.0, 0.0);
 uniform vec3 u_lightpos;
 uniform float u_shadow_intensity;
 
+#if LIGHTS
+// two vec4 per light: (position, radius), (color, 0)
+layout(binding=6) buffer in_lights
+{
+    vec4 i_lights[];
+};
+
+// per tile: number of lights, then their indices, see light_cull.glsl
+layout(binding=7) buffer in_tiles
+{
+    uint i_tiles[];
+};
+
+uniform int u_num_lights;
+uniform mat3 u_look;
+
+// light BXDF is called for: u_lightpos, and from surface to the point light,
+// w_light is -1 for u_lightpos, else index of point light
+vec3 w_lightpos;
+int w_light;
+
+#define u_lightpos w_lightpos
+#endif
 
 vec3 BXDF(float depth, vec3 color, vec3 normal, float shadow)
 {
 %BXDF%
 }
 
+#if LIGHTS
+#undef u_lightpos
+
+// windowed inverse square, zero from radius on
+vec3 point_light(int k, vec3 P, float depth, vec3 color, vec3 normal)
+{
+    vec4 light = i_lights[k * 2];
+    vec3 to_light = light.xyz - P;
+    float d = length(to_light);
+    float window = clamp(1.0 - pow(d / light.w, 4.0), 0.0, 1.0);
+
+    w_lightpos = to_light;
+    w_light = k;
+    return BXDF(depth, color, normal, 1.0) * i_lights[k * 2 + 1].xyz * (window * window / (d * d + 1.0));
+}
+#endif
+
 void main()
 {
     vec2 wh = vec2(u_width, u_height);
@@ -58,18 +90,47 @@ void main()
         xy.x = int(gl_LocalInvocationID.x + gl_WorkGroupID.x * LX);
         xy.y = int(gl_LocalInvocationID.y + gl_WorkGroupID.y * LY);
     
-        xy = min(xy, wh);
         uv = xy / wh;
     }
 
+    // threads past the image edge would write pixels of the next row
+    if (xy.x >= wh.x || xy.y >= wh.y)
+    {
+        return;
+    }
+
     int i = int(xy.x + xy.y * wh.x);
 
-    float depth = i_dep[i].x;
-    vec3 color = i_col[i].xyz;
-    vec3 normal = i_nrm[i].xyz;
-    float shadow = i_shw[i].x;
+    float depth = load_i_depth(i);
+    vec3 color = load_i_color(i);
+    vec3 normal = load_i_normal(i);
+    float shadow = load_i_shadow(i);
+#if LIGHTS
+    w_lightpos = u_lightpos;
+    w_light = -1;
+#endif
     vec3 rgb = BXDF(depth, color, normal, shadow);
 
+#if LIGHTS
+    if (depth < RAY_FAR)
+    {
+        vec3 P = u_campos + u_look * normalize(vec3((uv - 0.5) * 2.0, 1.0)) * depth;
+#if CULL
+        int base = int(gl_WorkGroupID.x + gl_WorkGroupID.y * gl_NumWorkGroups.x) * (MAX_TILE_LIGHTS + 1);
+        int count = min(int(i_tiles[base]), MAX_TILE_LIGHTS);
+        for (int n = 0; n < count; n++)
+        {
+            rgb += point_light(int(i_tiles[base + 1 + n]), P, depth, color, normal);
+        }
+#else
+        for (int k = 0; k < u_num_lights; k++)
+        {
+            rgb += point_light(k, P, depth, color, normal);
+        }
+#endif
+    }
+#endif
+
     o_col[i].xyz = rgb;
     o_col[i].w = 1.0;
 }
@@ -0,0 +1,231 @@
+#version 440
+
+#define LX 32
+#define LY 32
+
+// same as raymarch.glsl
+#define FAR 50.0
+
+// pixels traced this frame: one of each TRACE_STEP x TRACE_STEP block at
+// u_phase, or every other pixel when CHECKERBOARD
+#define TRACE_STEP %TRACE_STEP%
+#define CHECKERBOARD %CHECKERBOARD%
+
+layout(local_size_x=LX, local_size_y=LY) in;
+
+// g-buffer of this frame at bindings 0 to 3, traced pixels are written already
+%G_BUFFER%
+
+// resolved g-buffer of previous frame at bindings 4 to 7
+%HISTORY%
+
+uniform int u_width;
+uniform int u_height;
+uniform ivec2 u_phase;
+
+// camera position and lookat() of raymarch.glsl, now and last frame
+uniform vec3 u_campos;
+uniform mat3 u_look;
+uniform vec3 u_prev_campos;
+uniform mat3 u_prev_look;
+
+// 0 until a previous frame was resolved
+uniform int u_history;
+
+// relative depth slack of history against traced neighbours
+uniform float u_depth_tolerance = 0.05;
+
+
+vec3 ray_dir(vec2 xy, mat3 look)
+{
+    vec2 uv = xy / vec2(u_width, u_height);
+    return look * normalize(vec3((uv - 0.5) * 2.0, 1.0));
+}
+
+// pixel of world position P seen from campos, (-1, -1) when behind camera
+ivec2 project(vec3 P, vec3 campos, mat3 look)
+{
+    // look is orthonormal
+    vec3 local = (P - campos) * look;
+    if (local.z <= 0.0)
+    {
+        return ivec2(-1);
+    }
+    vec2 uv = local.xy / local.z * 0.5 + 0.5;
+    return ivec2(floor(uv * vec2(u_width, u_height) + 0.5));
+}
+
+bool inside(ivec2 p)
+{
+    return p.x >= 0 && p.y >= 0 && p.x < u_width && p.y < u_height;
+}
+
+bool traced(ivec2 p)
+{
+#if CHECKERBOARD
+    return ((p.x + p.y + u_phase.x) & 1) == 0;
+#else
+    ivec2 q = p - u_phase;
+    return q.x >= 0 && q.y >= 0 && q.x % TRACE_STEP == 0 && q.y % TRACE_STEP == 0;
+#endif
+}
+
+int index_of(ivec2 p)
+{
+    return p.x + p.y * u_width;
+}
+
+void main()
+{
+    ivec2 p = ivec2(gl_GlobalInvocationID.xy);
+    if (!inside(p) || traced(p))
+    {
+        return;
+    }
+
+    // traced neighbours and their bilinear weights
+    ivec2 nb[4];
+    float bilinear[4];
+#if CHECKERBOARD
+    nb[0] = p + ivec2(-1, 0);
+    nb[1] = p + ivec2(1, 0);
+    nb[2] = p + ivec2(0, -1);
+    nb[3] = p + ivec2(0, 1);
+    for (int k = 0; k < 4; k++)
+    {
+        bilinear[k] = 0.25;
+    }
+#else
+    ivec2 base = u_phase + TRACE_STEP * ivec2(floor(vec2(p - u_phase) / float(TRACE_STEP)));
+    vec2 f = vec2(p - base) / float(TRACE_STEP);
+    nb[0] = base;
+    nb[1] = base + ivec2(TRACE_STEP, 0);
+    nb[2] = base + ivec2(0, TRACE_STEP);
+    nb[3] = base + ivec2(TRACE_STEP);
+    bilinear[0] = (1.0 - f.x) * (1.0 - f.y);
+    bilinear[1] = f.x * (1.0 - f.y);
+    bilinear[2] = (1.0 - f.x) * f.y;
+    bilinear[3] = f.x * f.y;
+#endif
+
+    float nd[4];
+    float d_min = FAR * 2.0;
+    float d_max = 0.0;
+    int nearest = -1;
+    for (int k = 0; k < 4; k++)
+    {
+        if (!inside(nb[k]))
+        {
+            bilinear[k] = 0.0;
+            continue;
+        }
+        float d = load_o_depth(index_of(nb[k]));
+        nd[k] = d;
+        d_max = max(d_max, d);
+        if (d < d_min)
+        {
+            d_min = d;
+            nearest = k;
+        }
+    }
+
+    int i = index_of(p);
+    vec3 r = ray_dir(vec2(p), u_look);
+
+    // temporal reprojection: history sample close to this pixel's ray,
+    // at a depth within the traced neighbourhood
+    if (u_history != 0)
+    {
+        // one pixel footprint at unit distance
+        float footprint = 2.0 / float(min(u_width, u_height));
+        float best = footprint;
+        int found = -1;
+        float found_depth = 0.0;
+        for (int k = 0; k < 4; k++)
+        {
+            if (bilinear[k] == 0.0)
+            {
+                continue;
+            }
+            float d = min(nd[k], FAR);
+            ivec2 h = project(u_campos + r * d, u_prev_campos, u_prev_look);
+            if (!inside(h))
+            {
+                continue;
+            }
+
+            float hd = load_h_depth(index_of(h));
+            if (hd >= FAR)
+            {
+                if (d_max >= FAR)
+                {
+                    found = index_of(h);
+                    found_depth = hd;
+                    best = 0.0;
+                }
+                continue;
+            }
+
+            vec3 P = u_prev_campos + ray_dir(vec2(h), u_prev_look) * hd;
+            float depth = distance(P, u_campos);
+            if (depth < d_min * (1.0 - u_depth_tolerance) || depth > d_max * (1.0 + u_depth_tolerance))
+            {
+                continue;
+            }
+
+            float offset = length(cross(P - u_campos, r)) / depth;
+            if (offset <= best)
+            {
+                best = offset;
+                found = index_of(h);
+                found_depth = depth;
+            }
+
+            // well within the pixel, other candidates can't do much better
+            if (best < footprint * 0.25)
+            {
+                break;
+            }
+        }
+
+        if (found >= 0)
+        {
+            store_o(i, found_depth, load_h_color(found), load_h_normal(found), load_h_shadow(found));
+            return;
+        }
+    }
+
+    // disoccluded: depth and normal aware upsampling, biased to the nearest surface
+    vec3 n_ref = load_o_normal(index_of(nb[nearest]));
+    float total = 0.0;
+    float heaviest = 0.0;
+    float depth = d_min;
+    vec3 color = vec3(0.0);
+    vec3 normal = vec3(0.0);
+    float shadow = 0.0;
+    for (int k = 0; k < 4; k++)
+    {
+        if (bilinear[k] == 0.0)
+        {
+            continue;
+        }
+        int j = index_of(nb[k]);
+        float d = nd[k];
+        float w = bilinear[k] + 1e-3;
+        w /= 1e-3 + abs(d - d_min) / max(d_min, 1e-3);
+        vec3 n = load_o_normal(j);
+        w *= max(dot(n, n_ref), 0.0) + 1e-3;
+
+        total += w;
+        color += load_o_color(j) * w;
+        normal += n * w;
+        shadow += load_o_shadow(j) * w;
+        if (w > heaviest)
+        {
+            heaviest = w;
+            depth = d;
+        }
+    }
+
+    store_o(i, depth, color / total, normal / total, shadow / total);
+}
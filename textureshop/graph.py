@@ -0,0 +1,224 @@
+"""
+graph module
+
+declarative node graphs, serializable as JSON:
+
+{
+    "size": [512, 512],
+    "nodes": {
+        "grad": {"op": "Gradient", "args": {"grad_type": 4}},
+        "noise": {"op": "FBMNoise", "args": {"num_octaves": 6}},
+        "out": {"op": "Mix", "args": [{"node": "grad"}, {"node": "noise"}, 0.5]}
+    },
+    "output": "out"
+}
+
+args are in_node arguments after in_node itself, as a list or by name.
+values are numbers, lists, strings (e.g. Raymarch distance field source) or
+    {"node": name}      output of another node
+    {"g_buffer": name}  g-buffer of a Raymarch node, for DeferredLight
+    {"light": {...}}    LightInfo attributes, {"camera": {...}} CameraInfo
+    {"point_lights": [{...}, ...]}  PointLight attributes, DeferredLight lights
+    {"sdf": name}       volume baked by a BakeSDF node, Raymarch distance_field
+    {"sdf_volume": path}  SDFVolume file saved by a bake with cache_dir
+    {"image": path}     8 bit image file as (W, H, 4) floats, like npwrite wrote it
+    {"npy": path}       numpy array file
+relative paths are resolved from the graph file's folder.
+optional keys: backend, batch, channels, precision of Init.
+"""
+
+import copy
+import json
+import os
+
+import imageio as ii
+import numpy as np
+
+from .op_base import Base, Init
+from .op_fusion import Fused
+from .op_math import (
+    Num, Add, Multiply, Divide, Clamp, OneMinus, Sin, Cos, Tan, Asin, Acos, Atan2,
+    SinH, CosH, TanH, Power, Log_Natural, Log_2)
+from .op_mix import Mix, Smoothstep, Rotate
+from .op_noise import CPURandom, FBMNoise, Gradient
+from .op_quantize import Quantize
+from .op_raymarch import (
+    Raymarch, LitRaymarch, DeferredLight, BakeSDF, SDFVolume, LightInfo, CameraInfo, PointLight)
+
+
+OPS = {op.__name__: op for op in (
+    Num, Add, Multiply, Divide, Clamp, OneMinus, Sin, Cos, Tan, Asin, Acos, Atan2,
+    SinH, CosH, TanH, Power, Log_Natural, Log_2,
+    Mix, Smoothstep, Rotate,
+    CPURandom, FBMNoise, Gradient,
+    Quantize, Fused,
+    Raymarch, LitRaymarch, DeferredLight, BakeSDF,
+)}
+
+INIT_KEYS = ("backend", "batch", "channels", "precision")
+
+
+def _info(info_type, values):
+    info = info_type()
+    for k, v in values.items():
+        if not hasattr(info_type, k):
+            raise Exception("[Graph] {} has no attribute {}".format(info_type.__name__, k))
+        setattr(info, k, tuple(v) if isinstance(v, list) else v)
+    return info
+
+
+def load_image(path):
+    """ (W, H, 4) float32 of 8 bit image, rows flipped back like npwrite """
+    data = np.asarray(ii.imread(path), dtype=np.float32) / 255.0
+    if data.ndim == 2:
+        data = data[..., np.newaxis]
+
+    ones = np.ones(data.shape[:-1] + (1,), dtype=np.float32)
+    if data.shape[-1] in (1, 2):
+        # gray, gray + alpha
+        alpha = data[..., 1:2] if data.shape[-1] == 2 else ones
+        data = np.concatenate((data[..., :1],) * 3 + (alpha,), axis=-1)
+    elif data.shape[-1] == 3:
+        data = np.concatenate((data, ones), axis=-1)
+    return np.ascontiguousarray(data[::-1])
+
+
+class Graph(object):
+    """ description of a node graph, see module docstring for the format """
+
+    def __init__(self, description=None, base_dir="."):
+        super(Graph, self).__init__()
+
+        self.description = copy.deepcopy(description) if description else {}
+        self.description.setdefault("size", [512, 512])
+        self.description.setdefault("nodes", {})
+        self.base_dir = base_dir
+
+    @staticmethod
+    def load(path) -> 'Graph':
+        with open(path) as fp:
+            return Graph(json.load(fp), os.path.dirname(os.path.abspath(path)))
+
+    @staticmethod
+    def from_json(text, base_dir=".") -> 'Graph':
+        return Graph(json.loads(text), base_dir)
+
+    def to_json(self, indent=4):
+        return json.dumps(self.description, indent=indent)
+
+    def save(self, path):
+        with open(path, "w") as fp:
+            fp.write(self.to_json())
+
+    @property
+    def nodes(self):
+        return self.description["nodes"]
+
+    @property
+    def size(self):
+        return tuple(self.description["size"])
+
+    def add(self, name, op, *args, **kargs):
+        """ add node, returns reference to use as argument of later nodes """
+        if op not in OPS:
+            raise Exception("[Graph] unknown op {}, should be one of {}".format(op, sorted(OPS)))
+        if args and kargs:
+            raise Exception("[Graph] give args of {} as a list or by name, not both".format(name))
+
+        self.nodes[name] = {"op": op, "args": list(args) if args else kargs}
+        self.description["output"] = name
+        return Graph.ref(name)
+
+    @staticmethod
+    def ref(name):
+        return {"node": name}
+
+    def init(self, **overrides) -> Init:
+        """ Init of graph's size and settings, overrides win over the description """
+        kargs = {k: self.description[k] for k in INIT_KEYS if k in self.description}
+        kargs.update({k: v for k, v in overrides.items() if v is not None})
+        return Init(size=self.size, **kargs)
+
+    def build(self, init=None):
+        """ {name: node} of every node, inputs built first """
+        init = init or self.init()
+        built = {}
+        for name in self.nodes:
+            self._build(name, init, built, [])
+        return built
+
+    def _build(self, name, init, built, path):
+        if name in built:
+            return built[name]
+        if name not in self.nodes:
+            raise Exception("[Graph] unknown node {}".format(name))
+        if name in path:
+            raise Exception("[Graph] cycle through {}".format(" -> ".join(path + [name])))
+
+        spec = self.nodes[name]
+        op = OPS.get(spec.get("op"))
+        if op is None:
+            raise Exception("[Graph] node {} has unknown op {}".format(name, spec.get("op")))
+
+        path = path + [name]
+        args, kargs = spec.get("args", []), {}
+        if isinstance(args, dict):
+            args, kargs = [], args
+
+        args = [self._value(v, init, built, path) for v in args]
+        kargs = {k: self._value(v, init, built, path) for k, v in kargs.items()}
+        built[name] = op().in_node(init, *args, **kargs)
+        return built[name]
+
+    def _value(self, value, init, built, path):
+        if not isinstance(value, dict):
+            return value
+
+        if "node" in value:
+            return self._build(value["node"], init, built, path)
+        if "g_buffer" in value:
+            node = self._build(value["g_buffer"], init, built, path)
+            if not isinstance(node, Raymarch):
+                raise Exception("[Graph] g_buffer {} is not a Raymarch node".format(value["g_buffer"]))
+            return node.out_node()
+        if "sdf" in value:
+            node = self._build(value["sdf"], init, built, path)
+            if not isinstance(node, BakeSDF):
+                raise Exception("[Graph] sdf {} is not a BakeSDF node".format(value["sdf"]))
+            return node.out_node()
+        if "sdf_volume" in value:
+            return SDFVolume.load(init.gl, os.path.join(self.base_dir, value["sdf_volume"]))
+        if "light" in value:
+            return _info(LightInfo, value["light"])
+        if "camera" in value:
+            return _info(CameraInfo, value["camera"])
+        if "point_lights" in value:
+            return [_info(PointLight, light) for light in value["point_lights"]]
+        if "image" in value:
+            return load_image(os.path.join(self.base_dir, value["image"]))
+        if "npy" in value:
+            return np.load(os.path.join(self.base_dir, value["npy"])).astype(np.float32)
+
+        raise Exception("[Graph] can't read argument {}".format(value))
+
+    def output(self, built):
+        name = self.description.get("output")
+        if name not in built:
+            raise Exception("[Graph] output node {} is not in graph".format(name))
+        return built[name]
+
+    def render(self, init=None):
+        """ output node's out_node, pooled buffers of all nodes are released after """
+        built = self.build(init)
+        try:
+            output = self.output(built)
+            if isinstance(output, (Raymarch, BakeSDF)) and not isinstance(output, LitRaymarch):
+                # g-buffers and SDF volumes are no image
+                raise ValueError(
+                    "[Graph] output node {} is a {}, light it with DeferredLight "
+                    "or use LitRaymarch".format(self.description["output"], type(output).__name__))
+            return np.asarray(output.out_node())
+        finally:
+            for node in built.values():
+                if isinstance(node, Base) and node.gl:
+                    node.release()
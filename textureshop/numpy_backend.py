@@ -0,0 +1,241 @@
+"""
+numpy_backend module
+
+vectorized CPU versions of the compute shaders, mirroring gl/*.glsl.
+kernels write into given out array with in-place ufuncs.
+
+data layout matches the GL buffers: arrays are (W, H, 4) reshapes of
+flat buffers indexed by i = x + y * W, batched graphs add a leading
+layer axis, (N, W, H, 4).
+"""
+
+import math
+
+import numpy as np
+
+
+ROOT2 = 1.4142135623731
+
+
+def pixel_xy(w, h):
+    """ x, y pixel coords of each element of a (w, h) array """
+    i = np.arange(w * h).reshape((w, h))
+    return (i % w).astype(np.float32), (i // w).astype(np.float32)
+
+
+# math.glsl
+
+def _div(a, b, out):
+    # mirrors math.glsl: every channel is guarded by b.x
+    eps = 0.000001
+    b = np.broadcast_to(b, out.shape)
+    guard = (np.abs(b[..., 0:1]) - eps) < 0.0
+    np.divide(a, np.where(guard, eps, b), out=out)
+    return out
+
+
+def _clamp(a, b, out, u_clamp_min_value=0.0, u_clamp_max_value=1.0):
+    return np.clip(a, u_clamp_min_value, u_clamp_max_value, out=out)
+
+
+def _oneminus(a, b, out):
+    return np.subtract(1.0, a, out=out)
+
+
+MATH_CALC = {
+    "_add": lambda a, b, out: np.add(a, b, out=out),
+    "_mul": lambda a, b, out: np.multiply(a, b, out=out),
+    "_div": _div,
+    "_clamp": _clamp,
+    "_oneminus": _oneminus,
+    "_sin": lambda a, b, out: np.sin(a, out=out),
+    "_cos": lambda a, b, out: np.cos(a, out=out),
+    "_tan": lambda a, b, out: np.tan(a, out=out),
+    "_asin": lambda a, b, out: np.arcsin(a, out=out),
+    "_acos": lambda a, b, out: np.arccos(a, out=out),
+    "_atan2": lambda a, b, out: np.arctan2(a, b, out=out),
+    "_sinh": lambda a, b, out: np.sinh(a, out=out),
+    "_cosh": lambda a, b, out: np.cosh(a, out=out),
+    "_tanh": lambda a, b, out: np.tanh(a, out=out),
+    "_pow": lambda a, b, out: np.power(a, b, out=out),
+    "_log": lambda a, b, out: np.log(a, out=out),
+    "_log2": lambda a, b, out: np.log2(a, out=out),
+}
+
+
+def run_math(calc, a, b, out, uniforms={}):
+    with np.errstate(all="ignore"):
+        if calc == "_clamp":
+            return _clamp(
+                a, b, out, uniforms["u_clamp_min_value"], uniforms["u_clamp_max_value"])
+        return MATH_CALC[calc](a, b, out)
+
+
+# mix.glsl
+
+def _mix(a, b, c, out):
+    # a * (1 - c) + b * c, without temporaries of full size
+    np.subtract(b, a, out=out)
+    np.multiply(out, c, out=out)
+    np.add(out, a, out=out)
+    return out
+
+
+def _smoothstep(a, b, c, out):
+    with np.errstate(all="ignore"):
+        np.subtract(c, a, out=out)
+        np.divide(out, np.subtract(b, a), out=out)
+    np.clip(out, 0.0, 1.0, out=out)
+
+    # t * t * (3 - 2t)
+    t = out.copy()
+    np.multiply(out, -2.0, out=out)
+    np.add(out, 3.0, out=out)
+    np.multiply(out, t, out=out)
+    np.multiply(out, t, out=out)
+    return out
+
+
+def rotate(a, rot_z, out):
+    """ mirrors mix.glsl _rotate, gathers from a with mat2 rot_z (column major) """
+    w, h = out.shape[-3], out.shape[-2]
+    x, y = pixel_xy(w, h)
+
+    # float32 like the shader, so indices round the same way
+    m00, m01, m10, m11 = np.asarray(rot_z, dtype=np.float32)
+    rx = np.mod(m00 * x + m10 * y, np.float32(w))
+    ry = np.mod(m01 * x + m11 * y, np.float32(h))
+
+    i = (rx + ry * np.float32(w)).astype(np.int64)
+    i = np.clip(i, 0, w * h - 1)
+
+    a = np.broadcast_to(a, out.shape).reshape((-1, w * h, 4))
+    out.reshape((-1, w * h, 4))[:] = a[:, i.reshape(-1)]
+    return out
+
+
+MIX_CALC = {
+    "_mix": _mix,
+    "_smoothstep": _smoothstep,
+}
+
+
+# gradient.glsl
+
+def _uv(w, h, offset=(0, 0), full_size=None):
+    # uv over the full image when out is a tile of it
+    fw, fh = full_size or (w, h)
+    x, y = pixel_xy(w, h)
+    return (x + offset[0]) / fw, (y + offset[1]) / fh
+
+
+def gradient(grad, out, offset=(0, 0), full_size=None):
+    w, h = out.shape[-3], out.shape[-2]
+    u, v = _uv(w, h, offset, full_size)
+
+    if grad == "_horizontal_left_grid":
+        r = u
+    elif grad == "_horizontal_right_grid":
+        r = 1.0 - u
+    elif grad == "_vertical_up_grid":
+        r = v
+    elif grad == "_vertical_down_grid":
+        r = 1.0 - v
+    elif grad in ("_radial_in_grid", "_radial_out_grid"):
+        u = u * 2.0 - 1.0
+        v = v * 2.0 - 1.0
+        r = np.sqrt(u * u + v * v) / ROOT2
+        if grad == "_radial_out_grid":
+            r = 1.0 - r
+    else:
+        raise Exception("gradient type: {} is not implemented".format(grad))
+
+    out[..., 0] = r
+    out[..., 1] = r
+    out[..., 2] = r
+    out[..., 3] = 1.0
+    return out
+
+
+# fbm_noise.glsl
+
+def sample_bilinear(tex, u, v):
+    """ texture() with LINEAR filter and repeat wrap, channel x only """
+    tw, th = tex.shape[0], tex.shape[1]
+    texels = tex.reshape((-1, tex.shape[-1]))[:, 0]
+
+    fx = u * tw - 0.5
+    fy = v * th - 0.5
+    x0 = np.floor(fx)
+    y0 = np.floor(fy)
+    tx = fx - x0
+    ty = fy - y0
+
+    x0 = np.mod(x0, tw).astype(np.int64)
+    y0 = np.mod(y0, th).astype(np.int64)
+    x1 = (x0 + 1) % tw
+    y1 = (y0 + 1) % th
+
+    top = texels[x0 + y0 * tw] * (1.0 - tx) + texels[x1 + y0 * tw] * tx
+    bottom = texels[x0 + y1 * tw] * (1.0 - tx) + texels[x1 + y1 * tw] * tx
+    return top * (1.0 - ty) + bottom * ty
+
+
+def fbm(noise_tex, octaves, out, offset=(0, 0), full_size=None):
+    w, h = out.shape[-3], out.shape[-2]
+    u, v = _uv(w, h, offset, full_size)
+    u = u * 0.01
+    v = v * 0.01
+
+    cr, sr = math.cos(0.5), math.sin(0.5)
+    n = np.zeros((w, h), dtype=np.float64)
+    amplitude = 0.5
+    for _ in range(octaves):
+        n += amplitude * sample_bilinear(noise_tex, u, v)
+        u, v = (cr * u - sr * v) * 2.0 + 100.0, (sr * u + cr * v) * 2.0 + 100.0
+        amplitude *= 0.5
+
+    np.clip(n, 0.0, 1.0, out=n)
+    out[..., 0] = n
+    out[..., 1] = n
+    out[..., 2] = n
+    out[..., 3] = 1.0
+    return out
+
+
+# raymarch_post.glsl
+
+def _channel(data):
+    # (W, H) scalar fields may come in as (W, H, 4)
+    data = np.asarray(data)
+    return data[..., 0] if data.ndim == 3 else data
+
+
+def deferred_light(bxdf, depth, color, normal, shadow, uniforms, out):
+    """
+    bxdf is a python callable here:
+    bxdf(depth, color, normal, shadow, uniforms) -> rgb of shape (W, H, 3)
+    """
+
+    depth = _channel(depth)
+    color = np.asarray(color)[..., :3]
+    normal = np.asarray(normal)[..., :3]
+    shadow = _channel(shadow)
+
+    out[..., :3] = bxdf(depth, color, normal, shadow, uniforms)
+    out[..., 3] = 1.0
+    return out
+
+
+# quantize.glsl
+
+def quantize(data, bits, channels, flip=False):
+    """ clamp, quantize to uint8 / uint16 and select channels of (..., W, H, 4) data """
+    data = np.asarray(data, dtype=np.float32)
+    if flip:
+        data = data[..., ::-1, :, :]
+
+    dtype = np.uint8 if bits == 8 else np.uint16
+    selected = np.clip(data[..., list(channels)], 0.0, 1.0)
+    np.multiply(selected, float((1 << bits) - 1), out=selected)
+    return selected.astype(dtype)
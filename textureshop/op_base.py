@@ -4,50 +4,352 @@ op_base module
 author: minu jeong
 """
 
+import hashlib
+import math
 import os
+import threading
+import weakref
+from collections import OrderedDict
 from functools import wraps
 
 import numpy as np
-import moderngl as mg
+
+from . import storage
+from .context import ContextPool
+from .util import _value_to_ndarray, _value_to_constant
+
+
+class BufferPool(object):
+    """ size-classed pool of reserved, uninitialized GL buffers per context """
+
+    # smallest size class, in bytes
+    MIN_SIZE = 256
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, gl):
+        super(BufferPool, self).__init__()
+
+        self.gl = gl
+        self.free = {}
+        self.lock = threading.Lock()
+
+        self.allocations = 0
+        self.reuses = 0
+        self.releases = 0
+        self.in_use = 0
+        self.bytes_allocated = 0
+
+    @staticmethod
+    def of(gl) -> 'BufferPool':
+        with BufferPool._pools_lock:
+            pool = BufferPool._pools.get(gl)
+            if pool is None:
+                pool = BufferPool(gl)
+                BufferPool._pools[gl] = pool
+            return pool
+
+    @staticmethod
+    def size_class(nbytes):
+        # 4 classes per power of two, wastes at most 25%
+        if nbytes <= BufferPool.MIN_SIZE:
+            return BufferPool.MIN_SIZE
+        step = (1 << (nbytes - 1).bit_length()) // 8
+        return ((nbytes + step - 1) // step) * step
+
+    def acquire(self, nbytes):
+        size = BufferPool.size_class(nbytes)
+        with self.lock:
+            self.in_use += 1
+            free = self.free.get(size)
+            if free:
+                self.reuses += 1
+                return free.pop()
+
+            self.allocations += 1
+            self.bytes_allocated += size
+        return self.gl.buffer(reserve=size)
+
+    def release(self, buffer):
+        with self.lock:
+            self.in_use -= 1
+            self.releases += 1
+            self.free.setdefault(buffer.size, []).append(buffer)
+
+    def release_all(self, buffers):
+        while buffers:
+            _, buffer = buffers.popitem()
+            self.release(buffer)
+
+    def trim(self):
+        """ free every idle buffer """
+        with self.lock:
+            for buffers in self.free.values():
+                for buffer in buffers:
+                    self.bytes_allocated -= buffer.size
+                    buffer.release()
+            self.free.clear()
+
+    def stats(self):
+        with self.lock:
+            free_count = sum(len(x) for x in self.free.values())
+            free_bytes = sum(k * len(x) for k, x in self.free.items())
+            return {
+                "allocations": self.allocations,
+                "reuses": self.reuses,
+                "releases": self.releases,
+                "in_use": self.in_use,
+                "free": free_count,
+                "bytes_allocated": self.bytes_allocated,
+                "bytes_free": free_bytes,
+            }
+
+
+class TextureHandle(object):
+    """ GPU resident node output, read back only when numpy data is requested """
+
+    # one vec4 per batch layer instead of one per pixel, see Stack
+    per_layer = False
+
+    # content hash of uploaded data, keys result cache entries of nodes reading it
+    digest = None
+
+    def __init__(self, gl, buffer, size=(512, 512), owner=None, layers=1,
+                 channels=4, precision="f32"):
+        super(TextureHandle, self).__init__()
+
+        self.gl = gl
+        self.buffer = buffer
+        self.W, self.H = size[0], size[1]
+        self.layers = layers
+        self.channels, self.precision = channels, precision
+
+        # keeps the node (or pool finalizer) owning the buffer alive
+        self.owner = owner
+
+    @staticmethod
+    def upload(gl, data, size, layers=1, precision="f32") -> 'TextureHandle':
+        """
+        upload numpy data into pooled buffer, recycled with the handle.
+        channel count is the last axis of data.
+        """
+
+        data = np.asarray(data, dtype=np.float32)
+        channels = data.shape[-1]
+        storage.check_format(channels, precision)
+
+        pool = BufferPool.of(gl)
+        buffer = pool.acquire(storage.buffer_nbytes(data.size // channels, channels, precision))
+        buffer.write(storage.to_bytes(data, precision))
+
+        handle = TextureHandle(gl, buffer, size, layers=layers, channels=channels, precision=precision)
+        weakref.finalize(handle, pool.release, buffer)
+        if Base.RESULT_CACHE is not None:
+            handle.digest = storage.digest(data, precision)
+        return handle
+
+    @property
+    def shape(self):
+        if self.layers > 1:
+            return (self.layers, self.W, self.H, self.channels)
+        return (self.W, self.H, self.channels)
+
+    @property
+    def nbytes(self):
+        pixels = self.layers * self.W * self.H
+        return storage.buffer_nbytes(pixels, self.channels, self.precision)
+
+    def read(self) -> np.ndarray:
+        """ float32 pixels, (W, H, channels) """
+        data = self.buffer.read(size=self.nbytes)
+        return storage.from_bytes(data, self.shape, self.precision)
+
+    def __array__(self, dtype=None, copy=None):
+        data = self.read()
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def __getitem__(self, key):
+        return self.read()[key]
+
+
+class Stack(object):
+    """
+    per batch layer constants of a node input, one scalar or vec4 for each layer.
+    read as <name>_col[z] in shaders, z being the batch layer.
+    """
+
+    def __init__(self, values):
+        super(Stack, self).__init__()
+
+        constants = [_value_to_constant(x) for x in values]
+        if None in constants:
+            raise Exception("[Stack] values should be scalars or vec4s")
+        self.values = np.array(constants, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.values)
+
+
+def preprocess_cs(cs_path, inject={}):
+    """ resolve shader path and apply inject, returns (path, source) """
+    if not os.path.isabs(cs_path):
+        dirpath = os.path.dirname(__file__)
+        cs_path = "{}/{}".format(dirpath, cs_path.replace("./", ""))
+    cs_path = os.path.realpath(cs_path)
+
+    with open(cs_path, 'r') as fp:
+        context = fp.read()
+
+    for k, v in inject.items():
+        context = context.replace(k, v)
+
+    return cs_path, context
+
+
+class ProgramCache(object):
+    """ LRU cache of compiled compute shaders """
+
+    def __init__(self, capacity=128):
+        super(ProgramCache, self).__init__()
+
+        self.capacity = capacity
+        self.programs = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.releases = 0
+
+        # (context, weakref, native program) of evicted programs nodes may still hold
+        self.retired = []
+
+    @staticmethod
+    def make_key(gl, cs_path, inject):
+        mtime = os.path.getmtime(cs_path)
+        return (gl, cs_path, tuple(sorted(inject.items())), mtime)
+
+    def get(self, key):
+        with self.lock:
+            cs = self.programs.get(key)
+            if cs is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.programs.move_to_end(key)
+            return cs
+
+    def put(self, key, cs):
+        with self.lock:
+            self.programs[key] = cs
+            self.programs.move_to_end(key)
+
+            while len(self.programs) > self.capacity:
+                self.retire(self.programs.popitem(last=False)[1])
+                self.evictions += 1
+            self.sweep(getattr(cs, "ctx", None))
+
+    def retire(self, cs):
+        # evicted programs may still be held by nodes, released once none is left
+        if hasattr(cs, "mglo"):
+            self.retired.append((cs.ctx, weakref.ref(cs), cs.mglo))
+
+    def sweep(self, gl):
+        """ release retired programs of gl no node holds anymore, from the thread owning gl """
+        alive = []
+        for entry in self.retired:
+            ctx, ref, mglo = entry
+            if ctx is gl and ref() is None:
+                mglo.release()
+                self.releases += 1
+            else:
+                alive.append(entry)
+        self.retired = alive
+
+    def clear(self):
+        with self.lock:
+            for cs in self.programs.values():
+                self.retire(cs)
+            self.programs.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.programs),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "releases": self.releases,
+            "retired": len(self.retired),
+        }
 
 
 class Base(object):
 
-    GL = None
+    # Init takes the context of its thread from here
+    CONTEXTS = ContextPool()
+    PROGRAM_CACHE = ProgramCache()
+    DISK_CACHE = None
+
+    # content addressed node outputs, see result_cache module
+    RESULT_CACHE = None
+
+    # "gl": compute shaders, "numpy": vectorized CPU fallback
+    BACKENDS = ("gl", "numpy")
+
+    # pixels of input needed around each output pixel when rendering tiles,
+    # None when the whole image is needed
+    HALO = 0
 
-    def __init__(self, size=(512, 512), gl=None):
+    # output depends only on op, shader, uniforms, cache_params and inputs
+    CACHEABLE = False
+
+    # last output is out of date, see mark_dirty. nodes that aren't
+    # CACHEABLE never get clean, so nodes reading them always run
+    dirty = True
+
+    def __init__(self, size=(512, 512), gl=None, backend="gl", batch=1,
+                 channels=None, precision=None):
         super(Base, self).__init__()
 
         self.W, self.H = size[0], size[1]
 
-        # assign given context if given
-        if gl:
-            self.gl = gl
-        else:
-            # try to fetch static cache context
-            if Base.GL:
-                self.gl = Base.GL
-            else:
-                try:
-                    # try to capture existing context
-                    self.gl = mg.create_context(require=440)
-                except:
-                    # for the last choice: create standalone context
-                    self.gl = mg.create_standalone_context(require=440)
-                print("GL context with id: {}".format(id(self.gl)))
+        # storage of node output, see storage module.
+        # taken from in_node when not given
+        self.channels, self.precision = channels, precision
 
-        if not self.gl:
-            raise Exception("Can't fetch, capture, create GL context in this machine.")
+        # number of layers evaluated per dispatch, workgroup z in shaders
+        self.batch = batch
 
-        # cache context
-        Base.GL = self.gl
+        # part of a larger image this node covers, see set_region
+        self.offset = (0, 0)
+        self.full_size = (self.W, self.H)
+
+        if backend not in Base.BACKENDS:
+            raise Exception("backend {} is not one of {}".format(backend, Base.BACKENDS))
+        self.backend = backend
+
+        # nodes take context from their in_node, Init from Base.CONTEXTS when missing
+        self.gl = gl
 
     @staticmethod
     def in_node_wrapper(f):
         @wraps(f)
         def _(self, in_node, *args, **kargs):
             self.W, self.H = in_node.W, in_node.H
+            self.gl, self.backend = in_node.gl, in_node.backend
+            self.batch = in_node.batch
+            self.offset, self.full_size = in_node.offset, in_node.full_size
+            if self.channels is None:
+                self.channels = in_node.channels
+            if self.precision is None:
+                self.precision = in_node.precision
+            storage.check_format(self.channels, self.precision)
             f(self, in_node, *args, **kargs)
+            self.mark_dirty()
             return self
         return _
 
@@ -55,32 +357,427 @@ class Base(object):
     def out_node_wrapper(f):
         @wraps(f)
         def _(self):
+            if self.backend == "numpy" and hasattr(self, "out_numpy"):
+                # out_numpy reuses its output array, hand out a copy
+                return np.array(self.to_storage(self.out_numpy()), dtype=np.float32)
+
+            result = self.result()
+            if result is not None:
+                return result.read()
+
+            cache, key = Base.RESULT_CACHE, None
+            if cache is not None:
+                key = self.cache_key()
+                handle = cache.get(self, key) if key else None
+                if handle is not None:
+                    return handle.read()
+
             data = f(self)
+            if isinstance(data, TextureHandle):
+                if key:
+                    cache.put(self, key, data)
+                self.set_result(data)
+                return data.read()
+
             data = np.frombuffer(data, dtype="f4")
-            data = data.reshape((self.W, self.H, 4))
-            return data
+            data = data.reshape(self.shape[:-1] + (4,))
+            return self.to_storage(data)
         return _
 
+    @property
+    def shape(self):
+        """ (W, H, channels), or (batch, W, H, channels) for batched graphs """
+        shape = (self.W, self.H, self.channels or 4)
+        if self.batch > 1:
+            return (self.batch,) + shape
+        return shape
+
+    def to_storage(self, data):
+        """ (..., 4) numpy data as stored in this node's format """
+        if storage.format_of(self) == storage.DEFAULT_FORMAT:
+            return data
+        return storage.compact(data, self.channels, self.precision)
+
+    def set_region(self, offset, full_size):
+        """ render only W x H pixels at offset of a full_size image """
+        self.offset = (int(offset[0]), int(offset[1]))
+        self.full_size = (int(full_size[0]), int(full_size[1]))
+
+    def crop(self, data):
+        """
+        part of full size (W, H, 4) input covered by this node's region,
+        edge pixels are repeated where region runs out of the image.
+        only covered rows are read, so data may be a np.memmap.
+        """
+
+        fw, fh = self.full_size
+        rows = np.reshape(data, (fh, fw, 4))
+
+        x0, y0 = self.offset
+        xs = np.clip(np.arange(x0, x0 + self.W), 0, fw - 1)
+        ys = np.clip(np.arange(y0, y0 + self.H), 0, fh - 1)
+
+        region = rows[ys][:, xs]
+        return np.asarray(region, dtype=np.float32).reshape((self.W, self.H, 4))
+
+    def inputs(self):
+        """ node inputs, used to walk graphs """
+        return ()
+
+    def cache_params(self):
+        """ state not covered by shader, uniforms and inputs, None if it can't be hashed """
+        return ()
+
+    def cache_key(self):
+        """ content hash of this node's output, None when it can't be cached """
+        if not self.CACHEABLE or self.backend != "gl":
+            return None
+
+        params = self.cache_params()
+        if params is None:
+            return None
+
+        parts = [
+            type(self).__module__, type(self).__name__,
+            self.W, self.H, self.batch, self.offset, self.full_size,
+            self.channels, self.precision,
+            sorted(self.__dict__.get("cs_specs", {}).items()),
+            sorted(getattr(self, "uniforms", {}).items()),
+            params,
+        ]
+        for in_x in self.inputs():
+            if isinstance(in_x, Base):
+                in_key = in_x.cache_key()
+            elif isinstance(in_x, TextureHandle):
+                in_key = in_x.digest
+            else:
+                # constants and missing inputs
+                in_key = repr(in_x)
+
+            if in_key is None:
+                return None
+            parts.append(in_key)
+
+        return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+    def texture(self):
+        """ out_texture, skipped while clean, through Base.RESULT_CACHE when enabled """
+        result = self.result()
+        if result is not None:
+            return result
+
+        cache = Base.RESULT_CACHE
+        key = self.cache_key() if cache is not None else None
+        if not key:
+            handle = self.out_texture()
+        else:
+            handle = cache.get(self, key)
+            if handle is None:
+                handle = self.out_texture()
+                cache.put(self, key, handle)
+
+        self.set_result(handle)
+        return handle
+
+    def set_result(self, handle):
+        """ keep output of evaluation, node is clean until something upstream changes """
+        if not self.CACHEABLE or self.backend != "gl":
+            return
+
+        # own buffer is wrapped again on use, a handle owned by self would be a cycle
+        self._result = handle.buffer if handle.owner is self else handle
+
+        # inputs that didn't get clean (volatile nodes) keep this one dirty
+        self.dirty = any(isinstance(x, Base) and x.dirty for x in self.inputs())
+
+    def result(self):
+        """ TextureHandle of last evaluation while clean, None otherwise """
+        if self.dirty:
+            return None
+
+        result = self.__dict__.get("_result")
+        if result is None or isinstance(result, TextureHandle):
+            return result
+        return self.as_texture(result)
+
+    def mark_dirty(self):
+        """ output has to be computed again, and so do nodes reading it """
+        self.dirty = True
+        for consumer in list(self.__dict__.get("_consumers", ())):
+            # consumers of a dirty node are dirty already
+            if not consumer.dirty:
+                consumer.mark_dirty()
+
+    def set_input(self, name, value):
+        """
+        replace input in_<name> of ops built by set_inputs(in_a, ...).
+        a constant replacing a constant only updates its uniform, anything else
+        respecializes the shader, which comes from the program cache when seen before.
+        """
+
+        names = "abc"[:len(self.inputs())]
+        if name not in names:
+            raise Exception("[{}] has no input {}".format(type(self).__name__, name))
+
+        old = getattr(self, "in_" + name)
+        new = self.as_input(value, getattr(self, "CONSTANT_INPUTS", True))
+        if isinstance(old, tuple) and isinstance(new, tuple):
+            setattr(self, "in_" + name, new)
+            self.uniforms["u_" + name] = new
+        else:
+            # op parameters set after set_inputs, e.g. clamp range
+            params = {k: v for k, v in self.uniforms.items() if k not in ("u_a", "u_b", "u_c")}
+            self.set_inputs(*[new if x == name else getattr(self, "in_" + x) for x in names])
+            self.uniforms.update(params)
+        self.mark_dirty()
+
     def get_cs(self, cs_path, inject={}):
-        context = None
+        # no GL resources on numpy backend
+        if self.backend == "numpy":
+            return None
+
         if not os.path.isabs(cs_path):
             dirpath = os.path.dirname(__file__)
             cs_path = "{}/{}".format(dirpath, cs_path.replace("./", ""))
+        cs_path = os.path.realpath(cs_path)
 
-        with open(cs_path, 'r') as fp:
-            context = fp.read()
+        # programs are shared between nodes, so size uniforms are set on dispatch
+        key = ProgramCache.make_key(self.gl, cs_path, inject)
 
-        for k, v in inject.items():
-            context = context.replace(k, v)
+        # specialization part of result cache key, stable across processes
+        self.__dict__.setdefault("cs_specs", {})[os.path.basename(cs_path)] = repr(key[2:])
 
+        cs = Base.PROGRAM_CACHE.get(key)
+        if cs is not None:
+            return cs
+
+        cs_path, context = preprocess_cs(cs_path, inject)
         cs = self.gl.compute_shader(context)
+        Base.PROGRAM_CACHE.put(key, cs)
+
+        if Base.DISK_CACHE:
+            Base.DISK_CACHE.store(self.gl, cs_path, inject, context)
+        return cs
+
+    def constant(self):
+        """ vec4 value if this node is a constant, None otherwise """
+        return None
+
+    def as_input(self, value, allow_constant=True):
+        """
+        keep node/texture inputs on GPU, upload numpy inputs once.
+        scalar, vec4 and constant node inputs become vec4 tuples,
+        which are passed as uniforms instead of full images.
+        """
+
+        if value is None:
+            return None
+
+        if isinstance(value, Stack):
+            return self.stack_input(value)
+
+        if allow_constant:
+            constant = _value_to_constant(value)
+            if constant is not None:
+                return constant
+
+        if isinstance(value, Base):
+            # marked dirty with value from now on
+            value.__dict__.setdefault("_consumers", weakref.WeakSet()).add(self)
+            return value
+
+        if isinstance(value, TextureHandle):
+            return value
+
+        data = _value_to_ndarray(value, self.W, self.H)
+        if np.ndim(data) == 2:
+            # (W, H) single channel mask
+            data = np.reshape(data, np.shape(data) + (1,))
+
+        if self.batch > 1 and np.ndim(data) == 3:
+            # one image shared by every layer
+            data = np.broadcast_to(data, self.shape[:-1] + (np.shape(data)[-1],))
+
+        if self.backend == "numpy":
+            return storage.expand(data)
+        return TextureHandle.upload(self.gl, data, (self.W, self.H), self.batch)
+
+    def stack_input(self, stack):
+        """ upload per layer constants, (batch, 1, 1, 4) array on numpy backend """
+        if len(stack) != self.batch:
+            raise Exception(
+                "[Stack] {} values given for batch of {}".format(len(stack), self.batch))
+
+        if self.backend == "numpy":
+            return stack.values.reshape((self.batch, 1, 1, 4))
+
+        handle = TextureHandle.upload(self.gl, stack.values, (1, 1), self.batch)
+        handle.per_layer = True
+        return handle
+
+    def resolve_input(self, value):
+        if self.backend == "numpy":
+            return self.resolve_numpy_input(value)
+
+        if isinstance(value, Base):
+            return value.texture()
+        return value
+
+    @staticmethod
+    def resolve_numpy_input(value):
+        """ ndarray of any input, constants broadcast from shape (4,) """
+        if value is None:
+            return np.zeros(4, dtype=np.float32)
+
+        if isinstance(value, tuple):
+            return np.array(value, dtype=np.float32)
+
+        if isinstance(value, Base):
+            # as a shader would load it back from node's storage
+            if hasattr(value, "out_numpy"):
+                return storage.expand(value.to_storage(value.out_numpy()))
+            return storage.expand(value.out_node())
+
+        return np.asarray(value, dtype=np.float32)
+
+    def input_inject(self, inputs, names="abc", first_binding=1):
+        """
+        shader specialization reading each input:
+        u_<name> uniform for constants, load_<name>(z) for stacks,
+        load_<name>(i) from buffer in input's storage format otherwise
+        """
+
+        inject = {}
+        buffers = []
+        for binding, (name, value) in enumerate(zip(names, inputs), first_binding):
+            key = "%IN_{}%".format(name.upper())
+            if value is None:
+                inject[key] = "vec4(0.0)"
+            elif isinstance(value, tuple):
+                inject[key] = "u_{}".format(name)
+                self.uniforms["u_{}".format(name)] = value
+            elif getattr(value, "per_layer", False):
+                inject[key] = "load_{}(z)".format(name)
+            else:
+                inject[key] = "load_{}(i)".format(name)
+
+            # declared for every name, shader functions may refer to them
+            buffers.append(storage.buffer_glsl(name, binding, *storage.format_of(value)))
+
+        inject["%IN_BUFFERS%"] = "\n".join(buffers)
+        return inject
+
+    def output_inject(self, name="o", binding=0):
+        """ output buffer declaration in this node's storage format """
+        return {"%OUT_BUFFER%": storage.buffer_glsl(name, binding, *storage.format_of(self))}
+
+    def bind_inputs(self, inputs, first_binding=1):
+        """ run upstream nodes first, then bind buffer inputs in order """
+        inputs = [self.resolve_input(x) for x in inputs]
+        for binding, in_x in enumerate(inputs, first_binding):
+            if isinstance(in_x, TextureHandle):
+                in_x.buffer.bind_to_storage_buffer(binding)
+
+    def alloc_buffer(self, name="cs_out", nbytes=None):
+        """
+        reserve uninitialized pooled buffer owned by this node under name.
+        previous buffer of same name is reused or recycled, all owned
+        buffers go back to the pool on release() or when node is collected.
+        """
+
+        if self.backend == "numpy":
+            return None
+
+        if nbytes is None:
+            pixels = self.batch * self.W * self.H
+            nbytes = storage.buffer_nbytes(pixels, *storage.format_of(self))
+        pool = BufferPool.of(self.gl)
+
+        owned = self.__dict__.get("_owned_buffers")
+        if owned is None:
+            owned = self._owned_buffers = {}
+            weakref.finalize(self, pool.release_all, owned)
+
+        buffer = owned.pop(name, None)
+        if buffer is not None:
+            if buffer.size == BufferPool.size_class(nbytes):
+                owned[name] = buffer
+                return buffer
+            pool.release(buffer)
+
+        buffer = pool.acquire(nbytes)
+        owned[name] = buffer
+        return buffer
+
+    def layer_ints(self, name, values):
+        """
+        one int per batch layer, in a node owned buffer of given name.
+        plain int array on numpy backend.
+        """
+
+        values = np.asarray(values, dtype=np.int32)
+        if values.shape != (self.batch,):
+            raise Exception(
+                "[{}] {} values given for batch of {}".format(name, len(values), self.batch))
+
+        if self.backend == "numpy":
+            return values
+
+        buffer = self.alloc_buffer(name, values.nbytes)
+        buffer.write(values.tobytes())
+        return buffer
+
+    def alloc_array(self, name="np_out"):
+        """ numpy backend counterpart of alloc_buffer, reused between runs """
+        # numpy kernels work on 4 channels, see to_storage
+        shape = self.shape[:-1] + (4,)
+        data = self.__dict__.get(name)
+        if data is None or data.shape != shape:
+            data = np.empty(shape, dtype=np.float32)
+            setattr(self, name, data)
+        return data
+
+    def release(self):
+        """ return pooled buffers of this node """
+        self.__dict__.pop("_result", None)
+        self.mark_dirty()
+
+        owned = self.__dict__.get("_owned_buffers")
+        if owned:
+            BufferPool.of(self.gl).release_all(owned)
+
+    def as_texture(self, buffer) -> TextureHandle:
+        channels, precision = storage.format_of(self)
+        return TextureHandle(
+            self.gl, buffer, (self.W, self.H), owner=self, layers=self.batch,
+            channels=channels, precision=precision)
+
+    def dispatch(self, cs=None, uniforms=None, size=None):
+        """ run cs over size (width, height) invocations, node size by default """
+        cs = cs or self.cs
 
         if "u_width" in cs:
             cs["u_width"].value = self.W
         if "u_height" in cs:
             cs["u_height"].value = self.H
+        if "u_offset" in cs:
+            cs["u_offset"].value = self.offset
+        if "u_full_size" in cs:
+            cs["u_full_size"].value = self.full_size
 
-        return cs
+        for k, v in (uniforms or {}).items():
+            if k in cs:
+                cs[k].value = v
+
+        width, height = size or (self.W, self.H)
+        gx, gy = math.ceil(width / 32), math.ceil(height / 32)
+        cs.run(gx, gy, self.batch)
+
+    def out_texture(self) -> TextureHandle:
+        """ run node and keep result on GPU """
+        data = self.out_node()
+        precision = storage.format_of(self)[1]
+        return TextureHandle.upload(self.gl, data, (self.W, self.H), self.batch, precision)
 
     def in_node(self, in_node: 'Base'):
         raise NotImplementedError("Do not use Base node directly")
@@ -91,11 +788,20 @@ class Base(object):
 
 class Init(Base):
 
-    def __init__(self, size=(512, 512), gl=None):
-        super(Init, self).__init__(size, gl)
+    def __init__(self, size=(512, 512), gl=None, backend="gl", batch=1,
+                 channels=4, precision="f32"):
+        super(Init, self).__init__(size, gl, backend, batch, channels, precision)
+        storage.check_format(channels, precision)
+
+        if self.backend == "numpy":
+            self.gl = None
+            return
+
+        if not self.gl:
+            self.gl = Base.CONTEXTS.current()
 
     def get_gl(self):
         return self.gl
 
     def out_node(self):
-        return np.zeros((self.W, self.H, 4))
+        return np.zeros(self.shape)
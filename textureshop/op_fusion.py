@@ -0,0 +1,208 @@
+"""
+op_fusion module
+
+fuses chains / small DAGs of elementwise math and mix nodes
+into a single compute shader dispatch.
+"""
+
+from . import storage
+from .op_base import Base
+from .op_math import MathOp
+from .op_mix import MixOp
+
+
+# GLSL expression of each fusable CALC,
+# uniform names are replaced with per-node unique names
+FUSE_CALC = {
+    "_add": "{a} + {b}",
+    "_mul": "{a} * {b}",
+    "_div": "_div({a}, {b})",
+    "_clamp": "clamp({a}, {u_clamp_min_value}, {u_clamp_max_value})",
+    "_oneminus": "1.0 - {a}",
+    "_sin": "sin({a})",
+    "_cos": "cos({a})",
+    "_tan": "tan({a})",
+    "_asin": "asin({a})",
+    "_acos": "acos({a})",
+    "_atan2": "atan({a}, {b})",
+    "_sinh": "sinh({a})",
+    "_cosh": "cosh({a})",
+    "_tanh": "tanh({a})",
+    "_pow": "pow({a}, {b})",
+    "_log": "log({a})",
+    "_log2": "log2({a})",
+    "_mix": "mix({a}, {b}, {c})",
+    "_smoothstep": "smoothstep({a}, {b}, {c})",
+}
+
+# leave binding 0 for output
+MAX_FUSED_INPUTS = 15
+
+
+def is_fusable(node):
+    if not isinstance(node, (MathOp, MixOp)):
+        return False
+    return node.CALC in FUSE_CALC
+
+
+class FusedProgram(object):
+    """ generated GLSL for one fused DAG """
+
+    def __init__(self, root):
+        super(FusedProgram, self).__init__()
+
+        if not is_fusable(root):
+            raise Exception("[Fused] root node {} can't be fused".format(type(root).__name__))
+
+        # leaf inputs, bound to binding 1..N
+        self.leaves = []
+        # (node, uniform name, value) of fused nodes
+        self.uniforms = []
+        self.nodes = []
+
+        self._names = {}
+        self._lines = []
+
+        self.root = root
+        result = self._visit(root)
+        self._lines.append("    store_o(i, {});".format(result))
+
+        if len(self.leaves) > MAX_FUSED_INPUTS:
+            raise Exception(
+                "[Fused] {} inputs exceed {} storage buffers".format(
+                    len(self.leaves), MAX_FUSED_INPUTS))
+
+    def _leaf(self, value):
+        for n, leaf in enumerate(self.leaves):
+            if leaf is value:
+                return "l{}".format(n)
+
+        n = len(self.leaves)
+        self.leaves.append(value)
+        index = "z" if getattr(value, "per_layer", False) else "i"
+        self._lines.append("    vec4 l{0} = load_l{0}({1});".format(n, index))
+        return "l{}".format(n)
+
+    def _visit(self, node):
+        if id(node) in self._names:
+            return self._names[id(node)]
+
+        args = {}
+        for k, value in zip("abc", node.inputs()):
+            if value is None or isinstance(value, tuple):
+                # constants are already among node uniforms
+                continue
+            if is_fusable(value):
+                args[k] = self._visit(value)
+            else:
+                args[k] = self._leaf(value)
+
+        n = len(self.nodes)
+        self.nodes.append(node)
+        for u, v in node.uniforms.items():
+            name = "{}_{}".format(u, n)
+            self.uniforms.append((name, v))
+            args[u] = name
+
+        for k, value in zip("abc", node.inputs()):
+            if isinstance(value, tuple):
+                args[k] = args["u_{}".format(k)]
+
+        name = "t{}".format(n)
+        expr = FUSE_CALC[node.CALC].format(**args)
+        self._lines.append("    vec4 {} = {};".format(name, expr))
+
+        # results match unfused graph, where values go through node's storage
+        channels, precision = storage.format_of(node)
+        if node is not self.root and (channels, precision) != storage.DEFAULT_FORMAT:
+            self._lines.append("    {0} = {1};".format(
+                name, storage.roundtrip_glsl(name, channels, precision)))
+        self._names[id(node)] = name
+        return name
+
+    @property
+    def inject(self):
+        inputs = []
+        for n, leaf in enumerate(self.leaves):
+            name = "l{}".format(n)
+            inputs.append(storage.buffer_glsl(name, n + 1, *storage.format_of(leaf)))
+
+        uniforms = []
+        for name, value in self.uniforms:
+            glsl_type = "vec4" if isinstance(value, tuple) else "float"
+            uniforms.append("uniform {} {};".format(glsl_type, name))
+
+        return {
+            "%IN_BUFFERS%": "\n".join(inputs),
+            "%UNIFORMS%": "\n".join(uniforms),
+            "%BODY%": "\n".join(self._lines),
+        }
+
+
+class Fused(Base):
+    """ single dispatch of elementwise math/mix DAG ending at given node """
+
+    CACHEABLE = True
+
+    @Base.in_node_wrapper
+    def in_node(self, in_node, root):
+        self.root = root
+        self.build()
+
+    def build(self):
+        """ generate program from fused nodes as they are now """
+        self.program = FusedProgram(self.root)
+
+        # stands in for root, so output is stored like root's
+        self.channels, self.precision = storage.format_of(self.root)
+        self.uniforms = dict(self.program.uniforms)
+
+        cs_path = "./gl/fused.glsl"
+        inject = self.output_inject()
+        inject.update(self.program.inject)
+        self.cs = self.get_cs(cs_path, inject)
+        self.cs_out = self.alloc_buffer()
+
+        # changes to any fused node or leaf mark this node dirty
+        for node in self.program.nodes + self.program.leaves:
+            if isinstance(node, Base):
+                self.as_input(node, allow_constant=False)
+
+        # built since last dispatch
+        self.built = True
+
+    def refresh(self):
+        """ build again when fused nodes may have changed since last dispatch """
+        if self.dirty and not self.built:
+            self.build()
+
+    def cache_key(self):
+        self.refresh()
+        return Base.cache_key(self)
+
+    def inputs(self):
+        return tuple(self.program.leaves)
+
+    @property
+    def num_fused(self):
+        return len(self.program.nodes)
+
+    def out_texture(self):
+        self.refresh()
+        self.built = False
+        leaves = [self.resolve_input(x) for x in self.program.leaves]
+
+        for binding, leaf in enumerate(leaves, 1):
+            leaf.buffer.bind_to_storage_buffer(binding)
+        self.cs_out.bind_to_storage_buffer(0)
+
+        self.dispatch(self.cs, self.uniforms)
+        return self.as_texture(self.cs_out)
+
+    @Base.out_node_wrapper
+    def out_node(self):
+        return self.out_texture()
+
+    def out_numpy(self):
+        # nothing to fuse on CPU, run nodes one by one
+        return self.resolve_input(self.root)
@@ -1,13 +1,12 @@
-import math
-
 import numpy as np
 
+from . import numpy_backend, storage
 from .op_base import Base
-from .util import _value_to_ndarray
+from .util import _value_to_constant
 
 
 class Num(Base):
-    """ simple number """
+    """ simple number, lazy constant passed to other nodes as uniform """
 
     def __init__(self, size=(512, 512), gl=None, value=0.0):
         super(Num, self).__init__()
@@ -19,501 +18,251 @@ class Num(Base):
         if value is not None:
             self.value = value
 
+    def constant(self):
+        return _value_to_constant(self.value)
+
     @Base.out_node_wrapper
     def out_node(self):
-        data = np.ones((self.W, self.H, 4))
-        data = data.astype(np.float32)
-        data = np.multiply(data, self.value)
+        data = np.empty((self.W, self.H, 4), dtype=np.float32)
+        data[:] = self.constant()
         return data
 
 
-class Add(Base):
-    """ simple Add """
-
-    @Base.in_node_wrapper
-    def in_node(self, in_node, in_a, in_b):
-        self.in_a = _value_to_ndarray(in_a, self.W, self.H)
-        self.in_b = _value_to_ndarray(in_b, self.W, self.H)
+class MathOp(Base):
+    """ shared body of math.glsl operations, o = CALC(a, b) """
+
+    CS_PATH = "./gl/math.glsl"
+    CALC = None
+    ARITY = 1
+
+    CACHEABLE = True
+
+    @classmethod
+    def cs_spec(cls):
+        """ (cs_path, inject) with every input read from buffers """
+        inject = {"%CALC%": cls.CALC}
+        for n, name in enumerate("ab"):
+            source = "load_{}(i)".format(name) if n < cls.ARITY else "vec4(0.0)"
+            inject["%IN_{}%".format(name.upper())] = source
+        inject["%IN_BUFFERS%"] = "\n".join(
+            storage.buffer_glsl(name, n) for n, name in enumerate("ab", 1))
+        inject["%OUT_BUFFER%"] = storage.buffer_glsl("o", 0)
+        return (cls.CS_PATH, inject)
+
+    def set_inputs(self, in_a, in_b=None):
+        self.in_a = self.as_input(in_a)
+        self.in_b = self.as_input(in_b)
+        self.uniforms = {}
+
+        inject = {"%CALC%": self.CALC}
+        inject.update(self.output_inject())
+        inject.update(self.input_inject((self.in_a, self.in_b)))
+        self.cs = self.get_cs(self.CS_PATH, inject)
+        self.cs_out = self.alloc_buffer()
+        self.mark_dirty()
+
+    def inputs(self):
+        return (self.in_a, self.in_b)
+
+    def out_texture(self):
+        self.bind_inputs((self.in_a, self.in_b))
+        self.cs_out.bind_to_storage_buffer(0)
 
-        cs_path = "./gl/math.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_add"})
+        self.dispatch(self.cs, self.uniforms)
+        return self.as_texture(self.cs_out)
 
     @Base.out_node_wrapper
     def out_node(self):
-        a_buffer = self.in_a.astype(np.float32)
-        b_buffer = self.in_b.astype(np.float32)
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-
-        self.cs_in_a = self.gl.buffer(a_buffer.tobytes())
-        self.cs_in_a.bind_to_storage_buffer(1)
-        self.cs_in_b = self.gl.buffer(b_buffer.tobytes())
-        self.cs_in_b.bind_to_storage_buffer(2)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
+        return self.out_texture()
 
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-        self.cs.run(gx, gy)
+    def out_numpy(self):
+        in_a = self.resolve_input(self.in_a)
+        in_b = self.resolve_input(self.in_b)
+        out = self.alloc_array()
+        return numpy_backend.run_math(self.CALC, in_a, in_b, out, self.uniforms)
 
-        return self.cs_out.read()
 
+class Add(MathOp):
+    """ simple Add """
 
-class Multiply(Base):
-    """ simple Multiply """
+    CALC = "_add"
+    ARITY = 2
 
     @Base.in_node_wrapper
     def in_node(self, in_node, in_a, in_b):
-        self.in_a = _value_to_ndarray(in_a, self.W, self.H)
-        self.in_b = _value_to_ndarray(in_b, self.W, self.H)
+        self.set_inputs(in_a, in_b)
 
-        cs_path = "./gl/math.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_mul"})
-
-    @Base.out_node_wrapper
-    def out_node(self):
-        a_buffer = self.in_a.astype(np.float32)
-        b_buffer = self.in_b.astype(np.float32)
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-
-        self.cs_in_a = self.gl.buffer(a_buffer.tobytes())
-        self.cs_in_a.bind_to_storage_buffer(1)
-        self.cs_in_b = self.gl.buffer(b_buffer.tobytes())
-        self.cs_in_b.bind_to_storage_buffer(2)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
-
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-        self.cs.run(gx, gy)
-
-        return self.cs_out.read()
 
+class Multiply(MathOp):
+    """ simple Multiply """
 
-class Divide(Base):
-    """ simple Divide """
+    CALC = "_mul"
+    ARITY = 2
 
     @Base.in_node_wrapper
     def in_node(self, in_node, in_a, in_b):
-        self.in_a = _value_to_ndarray(in_a, self.W, self.H)
-        self.in_b = _value_to_ndarray(in_b, self.W, self.H)
+        self.set_inputs(in_a, in_b)
 
-        cs_path = "./gl/math.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_div"})
 
-    @Base.out_node_wrapper
-    def out_node(self):
-        a_buffer = self.in_a.astype(np.float32)
-        b_buffer = self.in_b.astype(np.float32)
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-
-        self.cs_in_a = self.gl.buffer(a_buffer.tobytes())
-        self.cs_in_a.bind_to_storage_buffer(1)
-        self.cs_in_b = self.gl.buffer(b_buffer.tobytes())
-        self.cs_in_b.bind_to_storage_buffer(2)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
+class Divide(MathOp):
+    """ simple Divide """
 
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-        self.cs.run(gx, gy)
+    CALC = "_div"
+    ARITY = 2
 
-        return self.cs_out.read()
+    @Base.in_node_wrapper
+    def in_node(self, in_node, in_a, in_b):
+        self.set_inputs(in_a, in_b)
 
 
-class Clamp(Base):
+class Clamp(MathOp):
     """ x = max(min(x, MAX), MIN) """
 
+    CALC = "_clamp"
+
     @Base.in_node_wrapper
     def in_node(self, in_node, value, min_value=0.0, max_value=1.0):
-        self.value = _value_to_ndarray(value, self.W, self.H)
+        self.set_inputs(value)
+        self.set_range(min_value, max_value)
 
-        self.min_value = min_value
-        self.max_value = max_value
-
-        cs_path = "./gl/math.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_clamp"})
-
-    @Base.out_node_wrapper
-    def out_node(self):
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
+    def set_range(self, min_value=None, max_value=None):
+        """ uniforms only, None keeps current value """
+        if min_value is not None:
+            self.min_value = min_value
+            self.uniforms["u_clamp_min_value"] = min_value
+        if max_value is not None:
+            self.max_value = max_value
+            self.uniforms["u_clamp_max_value"] = max_value
+        self.mark_dirty()
 
-        in_buffer = self.value.astype(np.float32)
-        in_buffer = self.gl.buffer(in_buffer.tobytes())
-        in_buffer.bind_to_storage_buffer(1)
 
-        self.cs["u_clamp_min_value"].value = self.min_value
-        self.cs["u_clamp_max_value"].value = self.max_value
-
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-        self.cs.run(gx, gy)
-
-        return self.cs_out.read()
-
-
-class OneMinus(Base):
+class OneMinus(MathOp):
     """ 1.0 - x """
 
+    CALC = "_oneminus"
+
     @Base.in_node_wrapper
     def in_node(self, in_node, value):
-        self.value = _value_to_ndarray(value, self.W, self.H)
-
-        cs_path = "./gl/math.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_oneminus"})
-
-    @Base.out_node_wrapper
-    def out_node(self):
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
-
-        in_buffer = self.value.astype(np.float32)
-        in_buffer = self.gl.buffer(in_buffer.tobytes())
-        in_buffer.bind_to_storage_buffer(1)
-
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-        self.cs.run(gx, gy)
+        self.set_inputs(value)
 
-        return self.cs_out.read()
 
-
-class Sin(Base):
+class Sin(MathOp):
     """ sin(x) """
 
+    CALC = "_sin"
+
     @Base.in_node_wrapper
     def in_node(self, in_node, value):
-        self.value = _value_to_ndarray(value, self.W, self.H)
-
-        cs_path = "./gl/math.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_sin"})
-
-    @Base.out_node_wrapper
-    def out_node(self):
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
+        self.set_inputs(value)
 
-        in_buffer = self.value.astype(np.float32)
-        in_buffer = self.gl.buffer(in_buffer.tobytes())
-        in_buffer.bind_to_storage_buffer(1)
 
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-
-        self.cs.run(gx, gy)
-
-        return self.cs_out.read()
-
-
-class Cos(Base):
+class Cos(MathOp):
     """ cos(x) """
 
+    CALC = "_cos"
+
     @Base.in_node_wrapper
     def in_node(self, in_node, value):
-        self.value = _value_to_ndarray(value, self.W, self.H)
-
-        cs_path = "./gl/math.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_cos"})
-
-    @Base.out_node_wrapper
-    def out_node(self):
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
+        self.set_inputs(value)
 
-        in_buffer = self.value.astype(np.float32)
-        in_buffer = self.gl.buffer(in_buffer.tobytes())
-        in_buffer.bind_to_storage_buffer(1)
 
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-
-        self.cs.run(gx, gy)
-
-        return self.cs_out.read()
-
-
-class Tan(Base):
+class Tan(MathOp):
     """ tan(x) """
 
+    CALC = "_tan"
+
     @Base.in_node_wrapper
     def in_node(self, in_node, value):
-        self.value = _value_to_ndarray(value, self.W, self.H)
-
-        cs_path = "./gl/math.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_tan"})
-
-    @Base.out_node_wrapper
-    def out_node(self):
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
+        self.set_inputs(value)
 
-        in_buffer = self.value.astype(np.float32)
-        in_buffer = self.gl.buffer(in_buffer.tobytes())
-        in_buffer.bind_to_storage_buffer(1)
 
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-
-        self.cs.run(gx, gy)
-
-        return self.cs_out.read()
-
-
-class Asin(Base):
+class Asin(MathOp):
     """ asin(x) """
 
+    CALC = "_asin"
+
     @Base.in_node_wrapper
     def in_node(self, in_node, value):
-        self.value = _value_to_ndarray(value, self.W, self.H)
-
-        cs_path = "./gl/math.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_asin"})
-
-    @Base.out_node_wrapper
-    def out_node(self):
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
-
-        in_buffer = self.value.astype(np.float32)
-        in_buffer = self.gl.buffer(in_buffer.tobytes())
-        in_buffer.bind_to_storage_buffer(1)
-
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-
-        self.cs.run(gx, gy)
-
-        return self.cs_out.read()
+        self.set_inputs(value)
 
 
-class Acos(Base):
+class Acos(MathOp):
     """ acos(x) """
 
+    CALC = "_acos"
+
     @Base.in_node_wrapper
     def in_node(self, in_node, value):
-        self.value = _value_to_ndarray(value, self.W, self.H)
-
-        cs_path = "./gl/math.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_acos"})
-
-    @Base.out_node_wrapper
-    def out_node(self):
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
-
-        in_buffer = self.value.astype(np.float32)
-        in_buffer = self.gl.buffer(in_buffer.tobytes())
-        in_buffer.bind_to_storage_buffer(1)
-
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-        self.cs.run(gx, gy)
+        self.set_inputs(value)
 
-        return self.cs_out.read()
 
-
-class Atan2(Base):
+class Atan2(MathOp):
     """ atan2(y, x) """
 
+    CALC = "_atan2"
+    ARITY = 2
+
     @Base.in_node_wrapper
     def in_node(self, in_node, in_a, in_b):
-        self.in_a = _value_to_ndarray(in_a, self.W, self.H)
-        self.in_b = _value_to_ndarray(in_b, self.W, self.H)
-
-        cs_path = "./gl/math.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_atan2"})
-
-    @Base.out_node_wrapper
-    def out_node(self):
-        a_buffer = self.in_a.astype(np.float32)
-        b_buffer = self.in_b.astype(np.float32)
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-
-        self.cs_in_a = self.gl.buffer(a_buffer.tobytes())
-        self.cs_in_a.bind_to_storage_buffer(1)
-        self.cs_in_b = self.gl.buffer(b_buffer.tobytes())
-        self.cs_in_b.bind_to_storage_buffer(2)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
+        self.set_inputs(in_a, in_b)
 
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-        self.cs.run(gx, gy)
 
-        return self.cs_out.read()
-
-
-class SinH(Base):
+class SinH(MathOp):
     """ acos(x) """
 
+    CALC = "_sinh"
+
     @Base.in_node_wrapper
     def in_node(self, in_node, value):
-        self.value = _value_to_ndarray(value, self.W, self.H)
-
-        cs_path = "./gl/math.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_sinh"})
-
-    @Base.out_node_wrapper
-    def out_node(self):
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
-
-        in_buffer = self.value.astype(np.float32)
-        in_buffer = self.gl.buffer(in_buffer.tobytes())
-        in_buffer.bind_to_storage_buffer(1)
-
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
+        self.set_inputs(value)
 
-        self.cs.run(gx, gy)
 
-        return self.cs_out.read()
-
-
-class CosH(Base):
+class CosH(MathOp):
     """ acos(x) """
 
+    CALC = "_cosh"
+
     @Base.in_node_wrapper
     def in_node(self, in_node, value):
-        self.value = _value_to_ndarray(value, self.W, self.H)
-
-        cs_path = "./gl/math.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_cosh"})
-
-    @Base.out_node_wrapper
-    def out_node(self):
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
-
-        in_buffer = self.value.astype(np.float32)
-        in_buffer = self.gl.buffer(in_buffer.tobytes())
-        in_buffer.bind_to_storage_buffer(1)
+        self.set_inputs(value)
 
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
 
-        self.cs.run(gx, gy)
-
-        return self.cs_out.read()
-
-
-class TanH(Base):
+class TanH(MathOp):
     """ acos(x) """
 
+    CALC = "_tanh"
+
     @Base.in_node_wrapper
     def in_node(self, in_node, value):
-        self.value = _value_to_ndarray(value, self.W, self.H)
-
-        cs_path = "./gl/math.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_tanh"})
-
-    @Base.out_node_wrapper
-    def out_node(self):
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
-
-        in_buffer = self.value.astype(np.float32)
-        in_buffer = self.gl.buffer(in_buffer.tobytes())
-        in_buffer.bind_to_storage_buffer(1)
+        self.set_inputs(value)
 
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
 
-        self.cs.run(gx, gy)
-
-        return self.cs_out.read()
-
-
-class Power(Base):
+class Power(MathOp):
     """ pow(a, b) """
 
+    CALC = "_pow"
+    ARITY = 2
+
     @Base.in_node_wrapper
     def in_node(self, in_node, in_a, in_b):
-        self.in_a = _value_to_ndarray(in_a, self.W, self.H)
-        self.in_b = _value_to_ndarray(in_b, self.W, self.H)
-
-        cs_path = "./gl/math.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_pow"})
-
-    @Base.out_node_wrapper
-    def out_node(self):
-        a_buffer = self.in_a.astype(np.float32)
-        b_buffer = self.in_b.astype(np.float32)
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-
-        self.cs_in_a = self.gl.buffer(a_buffer.tobytes())
-        self.cs_in_a.bind_to_storage_buffer(1)
-        self.cs_in_b = self.gl.buffer(b_buffer.tobytes())
-        self.cs_in_b.bind_to_storage_buffer(2)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
-
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-        self.cs.run(gx, gy)
+        self.set_inputs(in_a, in_b)
 
-        return self.cs_out.read()
 
-
-class Log_Natural(Base):
+class Log_Natural(MathOp):
     """ log(a) """
 
+    CALC = "_log"
+
     @Base.in_node_wrapper
     def in_node(self, in_node, in_a):
-        self.in_a = _value_to_ndarray(in_a, self.W, self.H)
-
-        cs_path = "./gl/math.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_log"})
-
-    @Base.out_node_wrapper
-    def out_node(self):
-        a_buffer = self.in_a.astype(np.float32)
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-
-        self.cs_in_a = self.gl.buffer(a_buffer.tobytes())
-        self.cs_in_a.bind_to_storage_buffer(1)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
-
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-        self.cs.run(gx, gy)
-
-        return self.cs_out.read()
+        self.set_inputs(in_a)
 
 
-class Log_2(Base):
+class Log_2(MathOp):
     """ log(a) """
 
+    CALC = "_log2"
+
     @Base.in_node_wrapper
     def in_node(self, in_node, in_a):
-        self.in_a = _value_to_ndarray(in_a, self.W, self.H)
-
-        cs_path = "./gl/math.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_log2"})
-
-    @Base.out_node_wrapper
-    def out_node(self):
-        a_buffer = self.in_a.astype(np.float32)
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-
-        self.cs_in_a = self.gl.buffer(a_buffer.tobytes())
-        self.cs_in_a.bind_to_storage_buffer(1)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
-
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-        self.cs.run(gx, gy)
-
-        return self.cs_out.read()
+        self.set_inputs(in_a)
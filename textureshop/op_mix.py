@@ -1,114 +1,110 @@
 import math
 
-import numpy as np
-
+from . import numpy_backend, storage
 from .op_base import Base
-from .util import _value_to_ndarray
-
 
-class Mix(Base):
-    """ mix(a, b, k) """
 
-    @Base.in_node_wrapper
-    def in_node(self, in_node, in_a, in_b, in_c):
-        self.in_a = _value_to_ndarray(in_a, self.W, self.H)
-        self.in_b = _value_to_ndarray(in_b, self.W, self.H)
-        self.in_c = _value_to_ndarray(in_c, self.W, self.H)
+class MixOp(Base):
+    """ shared body of mix.glsl operations, o = CALC(a, b, c) """
+
+    CS_PATH = "./gl/mix.glsl"
+    CALC = None
+    ARITY = 3
+
+    CACHEABLE = True
+
+    # False for ops reading neighbour pixels, which need a buffer input
+    CONSTANT_INPUTS = True
+
+    @classmethod
+    def cs_spec(cls):
+        """ (cs_path, inject) with every input read from buffers """
+        inject = {"%CALC%": cls.CALC}
+        for n, name in enumerate("abc"):
+            source = "load_{}(i)".format(name) if n < cls.ARITY else "vec4(0.0)"
+            inject["%IN_{}%".format(name.upper())] = source
+        inject["%IN_BUFFERS%"] = "\n".join(
+            storage.buffer_glsl(name, n) for n, name in enumerate("abc", 1))
+        inject["%OUT_BUFFER%"] = storage.buffer_glsl("o", 0)
+        return (cls.CS_PATH, inject)
+
+    def set_inputs(self, in_a, in_b=None, in_c=None):
+        inputs = (in_a, in_b, in_c)
+        inputs = [self.as_input(x, self.CONSTANT_INPUTS) for x in inputs]
+        self.in_a, self.in_b, self.in_c = inputs
+        self.uniforms = {}
+
+        inject = {"%CALC%": self.CALC}
+        inject.update(self.output_inject())
+        inject.update(self.input_inject(inputs))
+        self.cs = self.get_cs(self.CS_PATH, inject)
+        self.cs_out = self.alloc_buffer()
+        self.mark_dirty()
+
+    def inputs(self):
+        return (self.in_a, self.in_b, self.in_c)
+
+    def out_texture(self):
+        self.bind_inputs((self.in_a, self.in_b, self.in_c))
+        self.cs_out.bind_to_storage_buffer(0)
 
-        cs_path = "./gl/mix.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_mix"})
+        self.dispatch(self.cs, self.uniforms)
+        return self.as_texture(self.cs_out)
 
     @Base.out_node_wrapper
     def out_node(self):
-        a_buffer = self.in_a.astype(np.float32)
-        b_buffer = self.in_b.astype(np.float32)
-        c_buffer = self.in_c.astype(np.float32)
+        return self.out_texture()
 
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
+    def out_numpy(self):
+        inputs = (self.in_a, self.in_b, self.in_c)
+        in_a, in_b, in_c = [self.resolve_input(x) for x in inputs]
+        out = self.alloc_array()
+        return numpy_backend.MIX_CALC[self.CALC](in_a, in_b, in_c, out)
 
-        self.cs_in_a = self.gl.buffer(a_buffer.tobytes())
-        self.cs_in_a.bind_to_storage_buffer(1)
-        self.cs_in_b = self.gl.buffer(b_buffer.tobytes())
-        self.cs_in_b.bind_to_storage_buffer(2)
-        self.cs_in_c = self.gl.buffer(c_buffer.tobytes())
-        self.cs_in_c.bind_to_storage_buffer(3)
-
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
-
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-        self.cs.run(gx, gy)
-
-        return self.cs_out.read()
 
+class Mix(MixOp):
+    """ mix(a, b, k) """
 
-class Smoothstep(Base):
-    """ smoothstep(a, b, x) """
+    CALC = "_mix"
 
     @Base.in_node_wrapper
     def in_node(self, in_node, in_a, in_b, in_c):
-        self.in_a = _value_to_ndarray(in_a, self.W, self.H)
-        self.in_b = _value_to_ndarray(in_b, self.W, self.H)
-        self.in_c = _value_to_ndarray(in_c, self.W, self.H)
+        self.set_inputs(in_a, in_b, in_c)
 
-        cs_path = "./gl/mix.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_smoothstep"})
-
-    @Base.out_node_wrapper
-    def out_node(self):
-        a_buffer = self.in_a.astype(np.float32)
-        b_buffer = self.in_b.astype(np.float32)
-        c_buffer = self.in_c.astype(np.float32)
 
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
+class Smoothstep(MixOp):
+    """ smoothstep(a, b, x) """
 
-        self.cs_in_a = self.gl.buffer(a_buffer.tobytes())
-        self.cs_in_a.bind_to_storage_buffer(1)
-        self.cs_in_b = self.gl.buffer(b_buffer.tobytes())
-        self.cs_in_b.bind_to_storage_buffer(2)
-        self.cs_in_c = self.gl.buffer(c_buffer.tobytes())
-        self.cs_in_c.bind_to_storage_buffer(3)
+    CALC = "_smoothstep"
 
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
+    @Base.in_node_wrapper
+    def in_node(self, in_node, in_a, in_b, in_c):
+        self.set_inputs(in_a, in_b, in_c)
 
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-        self.cs.run(gx, gy)
 
-        return self.cs_out.read()
+class Rotate(MixOp):
 
+    CALC = "_rotate"
+    ARITY = 1
+    CONSTANT_INPUTS = False
 
-class Rotate(Base):
+    # gathers from anywhere in the image
+    HALO = None
 
     @Base.in_node_wrapper
     def in_node(self, in_node, in_a, z=0):
-        self.in_a = _value_to_ndarray(in_a, self.W, self.H)
-
-        cs_path = "./gl/mix.glsl"
-        self.cs = self.get_cs(cs_path, {"%CALC%": "_rotate"})
-
-        if "u_rot_z" in self.cs:
-            cz = math.cos(z)
-            sz = math.sin(z)
-            matrix_z = (cz, -sz, sz,  cz)
-            self.cs["u_rot_z"].value = matrix_z
-
-    @Base.out_node_wrapper
-    def out_node(self):
-        a_buffer = self.in_a.astype(np.float32)
-
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-
-        self.cs_in_a = self.gl.buffer(a_buffer.tobytes())
-        self.cs_in_a.bind_to_storage_buffer(1)
-
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
-        self.cs_out.bind_to_storage_buffer(0)
-
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-        self.cs.run(gx, gy)
-
-        return self.cs_out.read()
+        self.set_inputs(in_a)
+        self.set_angle(z)
+
+    def set_angle(self, z):
+        """ rotation around z in radians, uniforms only """
+        cz = math.cos(z)
+        sz = math.sin(z)
+        matrix_z = (cz, -sz, sz,  cz)
+        self.uniforms["u_rot_z"] = matrix_z
+        self.mark_dirty()
+
+    def out_numpy(self):
+        in_a = self.resolve_input(self.in_a)
+        out = self.alloc_array()
+        return numpy_backend.rotate(in_a, self.uniforms["u_rot_z"], out)
@@ -1,9 +1,8 @@
-import math
-
 import moderngl as mg
 import numpy as np
 
-from .op_base import Base
+from . import numpy_backend, storage
+from .op_base import Base, TextureHandle
 from .util import cpu_noise
 
 
@@ -17,7 +16,7 @@ class CPURandom(Base):
     @Base.out_node_wrapper
     def out_node(self):
         min_v, max_v = self.min_value, self.max_value
-        size = (self.W, self.H, 4)
+        size = self.shape
         data = np.random.uniform(min_v, max_v, size)
         data = data.astype(np.float32)
         return data
@@ -26,11 +25,48 @@ class CPURandom(Base):
 class FBMNoise(Base):
     """ fractional brownian motion noise """
 
+    CS_PATH = "./gl/fbm_noise.glsl"
+
+    CACHEABLE = True
+
+    @classmethod
+    def cs_spec(cls):
+        return (cls.CS_PATH, {
+            "%OCTAVES%": "u_octaves",
+            "%OUT_BUFFER%": storage.buffer_glsl("o", 0),
+        })
+
     def set_noisetex(self, noise_tex, bytes_size=None):
-        if isinstance(noise_tex, type(mg.texture)):
+        # content of noise for result cache, unknown for textures made elsewhere
+        self.noise_key = None
+        self.mark_dirty()
+
+        if self.backend == "numpy":
+            self.u_noise_tex = self.noisetex_to_ndarray(noise_tex, bytes_size)
+            return
+
+        if isinstance(noise_tex, mg.Texture):
+            # caller keeps ownership of given textures
+            self.release_noisetex()
             self.u_noise_tex = noise_tex
             return
 
+        if isinstance(noise_tex, Base):
+            self.noise_key = noise_tex.cache_key()
+            noise_tex = noise_tex.texture()
+        elif isinstance(noise_tex, TextureHandle):
+            self.noise_key = noise_tex.digest
+
+        if isinstance(noise_tex, TextureHandle):
+            size = (noise_tex.W, noise_tex.H)
+            if noise_tex.precision == "f32":
+                # copy buffer into texture without leaving GPU
+                self.owned_noisetex(size, noise_tex.channels).write(noise_tex.buffer)
+            else:
+                # f16 texels don't fit a f4 texture, read back as float32
+                self.owned_noisetex(size, noise_tex.channels).write(noise_tex.read().tobytes())
+            return
+
         if isinstance(noise_tex, (np.ndarray)):
             s = noise_tex.shape
             size = (s[0], s[1])
@@ -38,48 +74,122 @@ class FBMNoise(Base):
             if len(s) > 2:
                 channels = s[2]
 
-            data = noise_tex.astype(np.float32).tobytes()
-            self.u_noise_tex = self.gl.texture(size, channels, data, dtype="f4")
+            data = noise_tex.astype(np.float32)
+            self.noise_key = storage.digest(data)
+            self.owned_noisetex(size, channels).write(data.tobytes())
             return
 
         if isinstance(noise_tex, (bytes, bytearray)):
             if not bytes_size:
                 raise Exception("[FBM Noise] noise_tex coming in with bytes, but size not specified")
                 return
-            self.u_noise_tex = self.gl.texture(bytes_size, 4, noise_tex, dtype="f4")
+            self.noise_key = storage.digest(np.frombuffer(noise_tex, dtype="f4"))
+            self.owned_noisetex(bytes_size, 4).write(noise_tex)
             return
 
         raise NotImplementedError(
             "setting noise from {} is not implemented".format(type(noise_tex)))
 
+    def owned_noisetex(self, size, components):
+        """ texture made by this node, reused when size and components match """
+        owned = self.__dict__.get("own_noise_tex")
+        if owned is not None and owned.size == tuple(size) and owned.components == components:
+            self.u_noise_tex = owned
+            return owned
+
+        self.release_noisetex()
+        self.own_noise_tex = self.gl.texture(size, components, dtype="f4")
+        self.u_noise_tex = self.own_noise_tex
+        return self.own_noise_tex
+
+    def release_noisetex(self):
+        """ release texture made by this node, if any """
+        owned = self.__dict__.pop("own_noise_tex", None)
+        if owned is not None:
+            owned.release()
+
+    def noisetex_to_ndarray(self, noise_tex, bytes_size=None):
+        """ (width, height, channels) float32 texels, for numpy backend """
+        if isinstance(noise_tex, mg.Texture):
+            data = np.frombuffer(noise_tex.read(), dtype="f4")
+            return data.reshape((noise_tex.width, noise_tex.height, noise_tex.components))
+
+        if isinstance(noise_tex, (bytes, bytearray)):
+            if not bytes_size:
+                raise Exception("[FBM Noise] noise_tex coming in with bytes, but size not specified")
+            data = np.frombuffer(noise_tex, dtype="f4")
+            return data.reshape((bytes_size[0], bytes_size[1], 4))
+
+        data = np.asarray(self.resolve_input(noise_tex), dtype=np.float32)
+        if data.ndim == 2:
+            data = data.reshape(data.shape + (1,))
+        return data
+
     @Base.in_node_wrapper
     def in_node(self, in_node, noise_tex=None, num_octaves=5):
-        cs_path = "./gl/fbm_noise.glsl"
-        self.cs = self.get_cs(cs_path)
-        self.cs["u_octaves"].value = num_octaves
+        """ num_octaves may be a sequence, one octave count per batch layer """
+
+        self.uniforms = {}
+        self.octaves = None
+        self.set_octaves(num_octaves)
 
         if noise_tex is not None:
             self.set_noisetex(noise_tex)
 
         if not hasattr(self, "u_noise_tex"):
             print("[FBM] gen cpu noise as base..")
+            # random per node, pass a shared noise_tex when rendering tiles
             cpu_noise_data = cpu_noise(self.W, self.H)
             self.set_noisetex(cpu_noise_data, (self.W, self.H))
 
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
+        self.cs_out = self.alloc_buffer()
 
-    @Base.out_node_wrapper
-    def out_node(self):
-        self.u_noise_tex.use(0)
+    def set_octaves(self, num_octaves):
+        """ a count replacing a count only updates u_octaves, per layer counts respecialize """
+        self.num_octaves = num_octaves if np.ndim(num_octaves) == 0 else tuple(num_octaves)
+        if np.ndim(num_octaves) == 0 and self.octaves is None and "u_octaves" in self.uniforms:
+            self.uniforms["u_octaves"] = num_octaves
+            self.mark_dirty()
+            return
 
+        inject = self.output_inject()
+        if np.ndim(num_octaves) == 0:
+            self.octaves = None
+            self.uniforms["u_octaves"] = num_octaves
+            inject["%OCTAVES%"] = "u_octaves"
+        else:
+            self.uniforms.pop("u_octaves", None)
+            self.octaves = self.layer_ints("octaves", num_octaves)
+            inject["%OCTAVES%"] = "octaves_col[z]"
+        self.cs = self.get_cs(self.CS_PATH, inject)
+        self.mark_dirty()
+
+    def cache_params(self):
+        if self.noise_key is None:
+            return None
+        return (self.noise_key, self.num_octaves)
+
+    def out_texture(self):
+        self.u_noise_tex.use(0)
         self.cs_out.bind_to_storage_buffer(0)
+        if self.octaves is not None:
+            self.octaves.bind_to_storage_buffer(1)
+        self.dispatch(self.cs, self.uniforms)
+        return self.as_texture(self.cs_out)
 
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-        self.cs.run(gx, gy)
+    @Base.out_node_wrapper
+    def out_node(self):
+        return self.out_texture()
+
+    def out_numpy(self):
+        out = self.alloc_array()
+        region = (self.offset, self.full_size)
+        if self.octaves is None:
+            return numpy_backend.fbm(self.u_noise_tex, self.uniforms["u_octaves"], out, *region)
 
-        return self.cs_out.read()
+        for layer, octaves in zip(out, self.octaves):
+            numpy_backend.fbm(self.u_noise_tex, octaves, layer, *region)
+        return out
 
 
 class GaussianBlur(Base):
@@ -101,20 +211,14 @@ class SumSineWave(Base):
     def in_node(self, in_node, octaves=12):
         cs_path = "./gl/sumsinewave.glsl"
         self.cs = self.get_cs(cs_path)
+        self.uniforms = {"u_octaves": octaves}
 
-        if "u_octaves" in self.cs:
-            self.cs["u_octaves"].value = octaves
-
-        self.out_height = np.zeros((self.W, self.H, 4))
-        self.out_height = self.out_height.astype(np.float32)
-        self.out_height = self.gl.buffer(self.out_height.tobytes())
+        self.out_height = self.alloc_buffer("out_height")
 
     @Base.out_node_wrapper
     def out_node(self):
 
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-        self.cs.run(gx, gy)
-
+        self.dispatch(self.cs, self.uniforms)
         return self.out_height.read()
 
 
@@ -129,8 +233,31 @@ class Gradient(Base):
     GRAD_RAD_IN = 4
     GRAD_RAD_OUT = 5
 
+    CACHEABLE = True
+
     @Base.in_node_wrapper
     def in_node(self, in_node, grad_type=GRAD_HOR_LEFT):
+        """ grad_type may be a sequence, one gradient type per batch layer """
+
+        cs_path = "./gl/gradient.glsl"
+        self.grad_types = None
+        inject = self.output_inject()
+        if np.ndim(grad_type) == 0:
+            self.grad = self.grad_name(grad_type)
+            inject["%TYPE%"] = self.grad
+        else:
+            self.grad = [self.grad_name(x) for x in grad_type]
+            self.grad_types = self.layer_ints("grad_types", grad_type)
+            inject["%TYPE%"] = "_layer_grid"
+        self.cs = self.get_cs(cs_path, inject)
+        self.cs_out = self.alloc_buffer()
+
+    def cache_params(self):
+        # per layer types live in a buffer
+        return self.grad
+
+    @staticmethod
+    def grad_name(grad_type):
         _grad = None
 
         if grad_type == Gradient.GRAD_HOR_LEFT:
@@ -154,16 +281,25 @@ class Gradient(Base):
         else:
             raise Exception("gradient type: {} is not implemented".format(grad_type))
 
-        cs_path = "./gl/gradient.glsl"
-        self.cs = self.get_cs(cs_path, {"%TYPE%": _grad})
+        return _grad
 
-        out_buffer = np.zeros((self.W, self.H, 4))
-        out_buffer = out_buffer.astype(np.float32)
-        self.cs_out = self.gl.buffer(out_buffer.tobytes())
+    def out_texture(self):
+        self.cs_out.bind_to_storage_buffer(0)
+        if self.grad_types is not None:
+            self.grad_types.bind_to_storage_buffer(1)
+        self.dispatch(self.cs)
+        return self.as_texture(self.cs_out)
 
     @Base.out_node_wrapper
     def out_node(self):
-        self.cs_out.bind_to_storage_buffer(0)
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-        self.cs.run(gx, gy)
-        return self.cs_out.read()
+        return self.out_texture()
+
+    def out_numpy(self):
+        out = self.alloc_array()
+        region = (self.offset, self.full_size)
+        if self.grad_types is None:
+            return numpy_backend.gradient(self.grad, out, *region)
+
+        for layer, grad in zip(out, self.grad):
+            numpy_backend.gradient(grad, layer, *region)
+        return out
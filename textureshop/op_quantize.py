@@ -0,0 +1,169 @@
+"""
+op_quantize module
+
+flip, clamp, quantize and select channels on GPU before readback,
+so only packed bytes are read back.
+"""
+
+import math
+
+import numpy as np
+
+from . import numpy_backend, storage
+from .op_base import Base, TextureHandle
+
+
+# channel count, bits per channel
+FORMATS = {
+    "rgba8": (4, 8),
+    "rgb8": (3, 8),
+    "rg8": (2, 8),
+    "r8": (1, 8),
+    "rgba16": (4, 16),
+    "rg16": (2, 16),
+    "r16": (1, 16),
+}
+
+
+def parse_format(fmt, channels=None):
+    """
+    (bits, source channel indices) of fmt, one of FORMATS.
+    channels picks source channels, e.g. fmt="r8", channels="a" for alpha only.
+    """
+
+    if fmt not in FORMATS:
+        raise Exception("[Quantize] format {} is not one of {}".format(fmt, sorted(FORMATS)))
+
+    count, bits = FORMATS[fmt]
+    channels = channels or fmt.rstrip("0123456789")
+    if len(channels) != count or set(channels) - set("rgba"):
+        raise Exception("[Quantize] channels {} don't fit format {}".format(channels, fmt))
+    return bits, ["rgba".index(x) for x in channels]
+
+
+class Quantize(Base):
+    """ packed uint8 / uint16 pixels of value, (W, H, channels) """
+
+    CS_PATH = "./gl/quantize.glsl"
+
+    # threads per workgroup, LX in quantize.glsl
+    GROUP_SIZE = 64
+
+    # max workgroups in one dispatch dimension
+    MAX_GROUPS = 65535
+
+    @classmethod
+    def cs_spec(cls, fmt="rgba8"):
+        channels, bits = FORMATS[fmt]
+        return (cls.CS_PATH, {
+            "%BITS%": str(bits),
+            "%CHANNELS%": str(channels),
+            "%IN_A%": "load_a(i)",
+            "%IN_BUFFERS%": storage.buffer_glsl("a", 1),
+        })
+
+    @Base.in_node_wrapper
+    def in_node(self, in_node, value, fmt="rgba8", channels=None, flip=False):
+        self.set_inputs(value, fmt, channels, flip)
+
+    def set_inputs(self, value, fmt="rgba8", channels=None, flip=False):
+        """ see parse_format for fmt and channels, flip mirrors rows like npwrite """
+
+        self.fmt = fmt
+        # source channel indices, self.channels stays the storage format of Base
+        self.bits, self.select = parse_format(fmt, channels)
+        self.dtype = np.uint8 if self.bits == 8 else np.uint16
+        self.flip = flip
+
+        self.in_value = self.as_input(value, allow_constant=False)
+        self.uniforms = {}
+
+        cs_path, inject = self.cs_spec(fmt)
+        inject.update(self.input_inject((self.in_value,), "a"))
+        self.cs = self.get_cs(cs_path, inject)
+
+        self.nbytes = self.batch * self.W * self.H * len(self.select) * self.bits // 8
+        self.words = math.ceil(self.nbytes / 4)
+        self.packed = self.alloc_buffer("packed", self.words * 4)
+
+    def inputs(self):
+        return (self.in_value,)
+
+    @property
+    def shape(self):
+        shape = (self.W, self.H, len(self.select))
+        if self.batch > 1:
+            return (self.batch,) + shape
+        return shape
+
+    def dispatch(self, cs=None, uniforms=None):
+        cs = cs or self.cs
+        cs["u_width"].value = self.W
+        cs["u_height"].value = self.H
+        cs["u_layers"].value = self.batch
+        cs["u_flip"].value = int(self.flip)
+        cs["u_channels"].value = tuple(self.select + [0] * (4 - len(self.select)))
+
+        # one thread per packed word, wrapped into y past group limit
+        groups = math.ceil(self.words / Quantize.GROUP_SIZE)
+        gx = min(groups, Quantize.MAX_GROUPS)
+        gy = math.ceil(groups / gx)
+        cs.run(gx, gy)
+
+    def out_buffer(self):
+        """ runs the pass, buffer of packed pixels stays on GPU """
+        in_value = self.resolve_input(self.in_value)
+        in_value.buffer.bind_to_storage_buffer(1)
+        self.packed.bind_to_storage_buffer(0)
+
+        self.dispatch()
+        return self.packed
+
+    def out_bytes(self) -> bytes:
+        """ packed pixels, the only data read back from GPU """
+        return self.out_buffer().read(size=self.nbytes)
+
+    def decode(self, data):
+        """ (W, H, C) array from packed bytes """
+        return np.frombuffer(data, dtype=self.dtype, count=int(np.prod(self.shape))).reshape(self.shape)
+
+    def out_numpy(self):
+        shape = super(Quantize, self).shape[:-1] + (4,)
+        in_value = np.broadcast_to(self.resolve_input(self.in_value), shape)
+        return numpy_backend.quantize(in_value, self.bits, self.select, self.flip)
+
+    def out_node(self):
+        if self.backend == "numpy":
+            return self.out_numpy()
+
+        return self.decode(self.out_bytes())
+
+
+def quantize(data, fmt="rgba8", channels=None, flip=False):
+    """
+    quantized pixels of a node, TextureHandle or numpy array.
+    nodes and handles are packed on GPU, arrays on CPU.
+    """
+
+    if isinstance(data, TextureHandle):
+        node = Quantize((data.W, data.H), data.gl, batch=data.layers)
+        node.set_inputs(data, fmt, channels, flip)
+        return node.out_node()
+
+    if isinstance(data, Base):
+        return Quantize().in_node(data, data, fmt, channels, flip).out_node()
+
+    bits, channels = parse_format(fmt, channels)
+    return numpy_backend.quantize(as_rgba(data), bits, channels, flip)
+
+
+def as_rgba(data):
+    """ (W, H), (..., 1 | 2 | 3) or (..., 4) array as (..., 4), 3 channels get opaque alpha """
+    data = np.asarray(data, dtype=np.float32)
+    if data.ndim == 2:
+        data = data[..., np.newaxis]
+
+    if data.shape[-1] == 3:
+        ones = np.ones(data.shape[:-1] + (1,), dtype=np.float32)
+        return np.concatenate((data, ones), axis=-1)
+    return storage.expand(data)
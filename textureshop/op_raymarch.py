@@ -1,7 +1,12 @@
+import hashlib
 import math
+import os
+import tempfile
 
+import moderngl as mg
 import numpy as np
 
+from . import numpy_backend, storage
 from .op_base import Base
 
 
@@ -10,146 +15,1011 @@ class LightInfo(object):
     u_shadow_intensity = 0.35
 
 
+class PointLight(object):
+    """ entry of DeferredLight lights, nothing is lit from radius on """
+    position = (0.0, 1.0, 0.0)
+    color = (1.0, 1.0, 1.0)
+    radius = 2.0
+
+    def __init__(self, position=None, color=None, radius=None):
+        super(PointLight, self).__init__()
+
+        if position is not None:
+            self.position = tuple(position)
+        if color is not None:
+            self.color = tuple(color)
+        if radius is not None:
+            self.radius = radius
+
+
+# g-buffer buffers in binding order with their bytes per pixel.
+# packed: rgba8 albedo with shadow in alpha, octahedral snorm16 normal
+G_BUFFER_LAYOUTS = {
+    "float": (("depth", 4), ("color", 16), ("normal", 16), ("shadow", 4)),
+    "packed": (("depth", 4), ("color", 4), ("normal", 4)),
+}
+
+_OCTAHEDRAL_GLSL = """
+#ifndef G_BUFFER_OCTAHEDRAL
+#define G_BUFFER_OCTAHEDRAL
+uint encode_normal(vec3 n)
+{
+    n /= abs(n.x) + abs(n.y) + abs(n.z);
+    vec2 e = n.xy;
+    if (n.z < 0.0)
+    {
+        e = (1.0 - abs(n.yx)) * vec2(n.x >= 0.0 ? 1.0 : -1.0, n.y >= 0.0 ? 1.0 : -1.0);
+    }
+    return packSnorm2x16(e);
+}
+
+vec3 decode_normal(uint u)
+{
+    vec2 e = unpackSnorm2x16(u);
+    vec3 n = vec3(e, 1.0 - abs(e.x) - abs(e.y));
+    float t = max(-n.z, 0.0);
+    n.xy += vec2(n.x >= 0.0 ? -t : t, n.y >= 0.0 ? -t : t);
+    return normalize(n);
+}
+#endif
+"""
+
+
+def g_buffer_glsl(name, binding, layout="float"):
+    """
+    SSBOs of a g-buffer from binding on, with load_<name>_depth / _color /
+    _normal / _shadow(i) and store_<name>(i, depth, color, normal, shadow)
+    """
+
+    if layout not in G_BUFFER_LAYOUTS:
+        raise Exception("[GBuffer] layout should be one of {}, got {}".format(
+            tuple(G_BUFFER_LAYOUTS), layout))
+
+    if layout == "float":
+        elements = ("float", "vec4", "vec4", "float")
+        functions = (
+            "float load_{0}_depth(int i) {{ return {0}_depth[i]; }}",
+            "vec3 load_{0}_color(int i) {{ return {0}_color[i].xyz; }}",
+            "vec3 load_{0}_normal(int i) {{ return {0}_normal[i].xyz; }}",
+            "float load_{0}_shadow(int i) {{ return {0}_shadow[i]; }}",
+            "void store_{0}(int i, float depth, vec3 color, vec3 normal, float shadow) {{ "
+            "{0}_depth[i] = depth; {0}_color[i] = vec4(color, 1.0); "
+            "{0}_normal[i] = vec4(normal, 1.0); {0}_shadow[i] = shadow; }}",
+        )
+    else:
+        elements = ("float", "uint", "uint")
+        functions = (
+            _OCTAHEDRAL_GLSL,
+            "float load_{0}_depth(int i) {{ return {0}_depth[i]; }}",
+            "vec3 load_{0}_color(int i) {{ return unpackUnorm4x8({0}_color[i]).xyz; }}",
+            "vec3 load_{0}_normal(int i) {{ return decode_normal({0}_normal[i]); }}",
+            "float load_{0}_shadow(int i) {{ return unpackUnorm4x8({0}_color[i]).w; }}",
+            "void store_{0}(int i, float depth, vec3 color, vec3 normal, float shadow) {{ "
+            "{0}_depth[i] = depth; {0}_color[i] = packUnorm4x8(vec4(color, shadow)); "
+            "{0}_normal[i] = encode_normal(normal); }}",
+        )
+
+    lines = []
+    for n, ((part, _), element) in enumerate(zip(G_BUFFER_LAYOUTS[layout], elements)):
+        lines.extend((
+            "layout(binding={}) buffer {}_{}_buffer".format(binding + n, name, part),
+            "{",
+            "    {} {}_{}[];".format(element, name, part),
+            "};",
+            "",
+        ))
+    lines.extend(f if f is _OCTAHEDRAL_GLSL else f.format(name) for f in functions)
+    lines.append("")
+    return "\n".join(lines)
+
+
+def decode_normals(data):
+    """ octahedral snorm16 words to (..., 3) unit normals, like decode_normal """
+    data = np.asarray(data, dtype=np.uint32)
+    e = np.stack((data & 0xffff, data >> 16), axis=-1).astype(np.uint16).view(np.int16)
+    e = np.maximum(e.astype(np.float32) / 32767.0, -1.0)
+    n = np.concatenate((e, 1.0 - np.abs(e).sum(-1, keepdims=True)), axis=-1)
+    t = np.maximum(-n[..., 2:], 0.0)
+    n[..., :2] += np.where(n[..., :2] >= 0.0, -t, t)
+    return n / np.linalg.norm(n, axis=-1, keepdims=True)
+
+
 class GBuffer(object):
     depth = None
     color = None
     normal = None
     shadow = None
 
+    # see G_BUFFER_LAYOUTS, shadow is part of color when packed
+    layout = "float"
+
+    # node owning the buffers
+    owner = None
+
+    def buffers(self):
+        """ buffers in binding order """
+        return tuple(getattr(self, part) for part, _ in G_BUFFER_LAYOUTS[self.layout])
+
+    def read(self):
+        """ {depth, color, normal, shadow} float32 arrays of owner's size, decoded """
+        W, H = self.owner.W, self.owner.H
+        words = [
+            np.frombuffer(buffer.read(size=W * H * nbytes), dtype=np.uint32 if nbytes == 4 else np.float32)
+            for buffer, (_, nbytes) in zip(self.buffers(), G_BUFFER_LAYOUTS[self.layout])]
+
+        if self.layout == "float":
+            return {
+                "depth": words[0].view(np.float32).reshape((W, H)),
+                "color": words[1].reshape((W, H, 4))[..., :3],
+                "normal": words[2].reshape((W, H, 4))[..., :3],
+                "shadow": words[3].view(np.float32).reshape((W, H)),
+            }
+
+        rgba = words[1].view(np.uint8).reshape((W, H, 4)).astype(np.float32) / 255.0
+        return {
+            "depth": words[0].view(np.float32).reshape((W, H)),
+            "color": rgba[..., :3],
+            "normal": decode_normals(words[2]).reshape((W, H, 3)),
+            "shadow": rgba[..., 3],
+        }
+
 
 class CameraInfo(object):
     u_campos = (0.0, 0.5, -5.0)
     u_camtarget = (0.0, 0.0, 0.0)
 
 
+def look_matrix(campos, camtarget):
+    """ lookat() of raymarch.glsl, column major mat3 uniform value """
+    forward = np.subtract(camtarget, campos)
+    forward = forward / np.linalg.norm(forward)
+    side = np.cross(forward, (0.0, 1.0, 0.0))
+    side = side / np.linalg.norm(side)
+    up = np.cross(side, forward)
+    up = up / np.linalg.norm(up)
+    return tuple(float(x) for x in np.concatenate((side, up, forward)))
+
+
+class SDFVolume(object):
+    """
+    distance field sampled on a grid of samples (x, y, z) whose corners are
+    box_min and box_max, as a linearly filtered RGBA float 3D texture of
+    (distance, color). with brick_size, only bricks of brick_size cells
+    near the surface are sampled, into an atlas of bricks of brick_size + 1
+    samples, other bricks keep the distance at their center.
+    """
+
+    # world() of Raymarch tracing the volume
+    DIST_FIELD = """
+vec4 v = volume_at(p);
+if (w_need_color) { w_color = v.yzw; }
+return v.x;
+"""
+
+    GLSL = """
+#define VOLUME_BRICK %VOLUME_BRICK%
+
+layout(binding=0) uniform sampler3D u_volume;
+
+uniform vec3 u_volume_min;
+uniform vec3 u_volume_max;
+uniform vec3 u_volume_samples;
+
+#if VOLUME_BRICK
+// per brick, x fastest: (atlas texel, 0) or (-1, center distance)
+layout(binding=6) buffer in_bricks
+{
+    vec4 i_bricks[];
+};
+
+uniform ivec3 u_volume_bricks;
+uniform vec3 u_volume_atlas;
+#endif
+
+vec4 volume_at(vec3 p)
+{
+    vec3 q = clamp(p, u_volume_min, u_volume_max);
+    vec3 g = (q - u_volume_min) / (u_volume_max - u_volume_min) * (u_volume_samples - 1.0);
+#if VOLUME_BRICK
+    ivec3 b = min(ivec3(g) / VOLUME_BRICK, u_volume_bricks - 1);
+    vec4 brick = i_bricks[b.x + u_volume_bricks.x * (b.y + u_volume_bricks.y * b.z)];
+    vec4 v;
+    if (brick.x < 0.0)
+    {
+        // no surface in brick, bound from its center distance
+        vec3 center = u_volume_min + (vec3(b) + 0.5) * VOLUME_BRICK
+            * (u_volume_max - u_volume_min) / (u_volume_samples - 1.0);
+        v = vec4(brick.w - sign(brick.w) * distance(q, center), vec3(1.0));
+    }
+    else
+    {
+        v = texture(u_volume, (brick.xyz + g - vec3(b * VOLUME_BRICK) + 0.5) / u_volume_atlas);
+    }
+#else
+    vec4 v = texture(u_volume, (g + 0.5) / u_volume_samples);
+#endif
+
+    // outside the box: no closer than the box, nor than its nearest sample allows
+    float outside = distance(p, q);
+    if (outside > 0.0)
+    {
+        v.x = max(outside, v.x - outside);
+    }
+    return v;
+}
+"""
+
+    def __init__(self, box_min, box_max, samples, texture, brick_size=0, bricks=None, num_bricks=None):
+        super(SDFVolume, self).__init__()
+
+        self.box_min = tuple(float(x) for x in box_min)
+        self.box_max = tuple(float(x) for x in box_max)
+        self.samples = tuple(int(x) for x in samples)
+        self.brick_size = brick_size
+
+        # RGBA f4 3D texture, dense grid or brick atlas
+        self.texture = texture
+        self.texture.filter = (mg.LINEAR, mg.LINEAR)
+        self.texture.repeat_x = self.texture.repeat_y = self.texture.repeat_z = False
+
+        # brick table buffer and bricks per axis
+        self.bricks = bricks
+        self.num_bricks = num_bricks
+
+    @property
+    def nbytes(self):
+        """ GPU bytes of texture and brick table """
+        nbytes = int(np.prod(self.texture.size)) * 16
+        if self.bricks is not None:
+            nbytes += int(np.prod(self.num_bricks)) * 16
+        return nbytes
+
+    def glsl(self):
+        return SDFVolume.GLSL.replace("%VOLUME_BRICK%", str(self.brick_size))
+
+    def uniforms(self):
+        uniforms = {
+            "u_volume_min": self.box_min,
+            "u_volume_max": self.box_max,
+            "u_volume_samples": tuple(float(x) for x in self.samples),
+        }
+        if self.brick_size:
+            uniforms["u_volume_bricks"] = self.num_bricks
+            uniforms["u_volume_atlas"] = tuple(float(x) for x in self.texture.size)
+        return uniforms
+
+    def use(self):
+        self.texture.use(0)
+        if self.bricks is not None:
+            self.bricks.bind_to_storage_buffer(6)
+
+    def save(self, path):
+        """ write .npz readable by load, replaced whole so other jobs never read it partly """
+        w, h, d = self.texture.size
+        arrays = {
+            "box": np.array((self.box_min, self.box_max), dtype=np.float32),
+            "samples": np.array(self.samples + (self.brick_size,), dtype=np.int32),
+            "texture": np.frombuffer(self.texture.read(), dtype=np.float32).reshape((d, h, w, 4)),
+        }
+        if self.bricks is not None:
+            arrays["num_bricks"] = np.array(self.num_bricks, dtype=np.int32)
+            count = int(np.prod(self.num_bricks))
+            arrays["bricks"] = np.frombuffer(self.bricks.read(size=count * 16), dtype=np.float32)
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fp:
+            np.savez(fp, **arrays)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(gl, path):
+        with np.load(path) as data:
+            texture = data["texture"]
+            d, h, w, _ = texture.shape
+            bricks, num_bricks = None, None
+            if "bricks" in data:
+                bricks = gl.buffer(data["bricks"].tobytes())
+                num_bricks = tuple(int(x) for x in data["num_bricks"])
+            samples = tuple(int(x) for x in data["samples"])
+            texture = gl.texture3d((w, h, d), 4, texture.tobytes(), dtype="f4")
+            return SDFVolume(data["box"][0], data["box"][1], samples[:3], texture, samples[3], bricks, num_bricks)
+
+    def release(self):
+        self.texture.release()
+        if self.bricks is not None:
+            self.bricks.release()
+
+
 class Raymarch(Base):
     """ raymarch node """
 
+    # camera covers the whole image
+    HALO = None
+
+    # bounds are a bit mask in raymarch.glsl
+    MAX_BOUNDS = 32
+
+    # march steps, NEAR and SURFACE of raymarch.glsl, shadow march steps (None: same as steps)
+    # and world() samples per normal, 4 or 6
+    DEFAULT_QUALITY = {"steps": 32, "near": 0.001, "surface": 0.0001, "shadow_steps": None, "normal_samples": 6}
+    QUALITY = {
+        "draft": {"steps": 24, "near": 0.01, "surface": 0.002, "shadow_steps": 8, "normal_samples": 4},
+        "preview": {"steps": 48, "near": 0.005, "surface": 0.0005, "shadow_steps": 24, "normal_samples": 4},
+        "final": {"steps": 128, "near": 0.001, "surface": 0.0001, "shadow_steps": 64, "normal_samples": 6},
+    }
+
+    # top bit of o_steps in raymarch.glsl
+    CAPPED_BIT = 0x80000000
+
     @Base.in_node_wrapper
-    def in_node(self, in_node, distance_field, lightinfo=None, caminfo=None, steps=32):
+    def in_node(self, in_node, distance_field, lightinfo=None, caminfo=None, steps=None,
+                relaxation=1.0, bounds=None, count_steps=False, subsample=1, checkerboard=False,
+                g_buffer_layout="float", quality=None):
+        """
+        distance_field: GLSL body of float world(vec3 p), or an SDFVolume traced instead, see BakeSDF
+        steps: march steps per ray, overrides quality
+        relaxation: step factor of over-relaxed sphere tracing in [1, 2), 1.0 is plain sphere tracing
+        bounds: [("sphere", center, radius) or ("box", min, max)] enclosing all geometry.
+            rays start and stop at them, distance fields may skip primitive k when !bound_hit(k)
+        count_steps: keep march steps per pixel, see step_counts
+        subsample: trace one pixel of each subsample x subsample block per frame,
+            the others are reprojected from the previous frame or upsampled
+        checkerboard: trace every other pixel per frame instead
+        g_buffer_layout: "float" or "packed" (12 instead of 40 bytes per pixel), see G_BUFFER_LAYOUTS
+        quality: name of a Raymarch.QUALITY preset, DEFAULT_QUALITY otherwise
+        """
+
+        if self.backend == "numpy":
+            raise ValueError("[Raymarch] GLSL distance field needs gl backend")
+        if self.batch > 1:
+            raise ValueError("[Raymarch] batched raymarch is not implemented")
+        if not 1.0 <= relaxation < 2.0:
+            raise Exception("[Raymarch] relaxation {} should be in [1, 2)".format(relaxation))
+        if subsample < 1 or (checkerboard and subsample > 1):
+            raise Exception("[Raymarch] subsample {} should be >= 1, and 1 with checkerboard".format(
+                subsample))
+        if quality is not None and quality not in Raymarch.QUALITY:
+            raise Exception("[Raymarch] quality should be one of {}, got {}".format(
+                tuple(Raymarch.QUALITY), quality))
+
+        self.quality = dict(Raymarch.DEFAULT_QUALITY, **Raymarch.QUALITY.get(quality, {}))
+        if steps is not None:
+            self.quality["steps"] = steps
+        steps = self.quality["steps"]
+        if self.quality["normal_samples"] not in (4, 6):
+            raise Exception("[Raymarch] normal_samples should be 4 or 6, got {}".format(
+                self.quality["normal_samples"]))
+
+        # g-buffer layout is fixed in raymarch.glsl
+        self.channels, self.precision = storage.DEFAULT_FORMAT
+
+        self.volume = None
+        if isinstance(distance_field, SDFVolume):
+            self.volume = distance_field
+            distance_field = SDFVolume.DIST_FIELD
+
         cs_path = "./gl/raymarch.glsl"
         self.cs = self.get_cs(cs_path, {
             "%DIST_FIELD%": distance_field,
-            "%NEAR%": "0.001",
-            "%SURFACE%": "0.0001"
+            "%VOLUME%": self.volume.glsl() if self.volume else "",
+            "%BAKE%": "0",
+            "%BAKE_BRICK%": "0",
+            "%NEAR%": repr(float(self.quality["near"])),
+            "%SURFACE%": repr(float(self.quality["surface"])),
+            "%NORMAL_SAMPLES%": str(self.quality["normal_samples"]),
+            "%BOUNDS%": "1" if bounds else "0",
+            "%COUNT_STEPS%": "1" if count_steps else "0",
+            "%TRACE_STEP%": str(subsample),
+            "%CHECKERBOARD%": "1" if checkerboard else "0",
+            "%G_BUFFER%": self.sink_glsl(g_buffer_layout),
         })
 
-        if "u_maxsteps" in self.cs:
-            self.cs["u_maxsteps"].value = steps
+        self.uniforms = {
+            "u_maxsteps": steps,
+            "u_shadow_steps": self.quality["shadow_steps"] or steps,
+            "u_relaxation": relaxation,
+        }
+        if self.volume:
+            self.uniforms.update(self.volume.uniforms())
         self.set_caminfo(caminfo)
         self.set_lightinfo(lightinfo)
 
-        _buffer = np.zeros((self.W, self.H, 4))
-        _buffer = _buffer.astype(np.float32)
-        _buffer = _buffer.tobytes()
+        self.bounds = None
+        if bounds:
+            self.set_bounds(bounds)
+
+        self.steps = None
+        if count_steps:
+            self.steps = self.alloc_buffer("steps", self.W * self.H * 4)
 
-        self.depth = self.gl.buffer(_buffer)
-        self.color = self.gl.buffer(_buffer)
-        self.normal = self.gl.buffer(_buffer)
-        self.shadow = self.gl.buffer(_buffer)
+        self.alloc_outputs(g_buffer_layout)
 
-        self.g_buffer = GBuffer()
-        self.g_buffer.depth = self.depth
-        self.g_buffer.color = self.color
-        self.g_buffer.normal = self.normal
-        self.g_buffer.shadow = self.shadow
+        self.subsample = subsample
+        self.checkerboard = checkerboard
+        self.history = None
+        if self.reconstructs:
+            self.resolve_cs = self.get_cs("./gl/raymarch_resolve.glsl", {
+                "%TRACE_STEP%": str(subsample),
+                "%CHECKERBOARD%": "1" if checkerboard else "0",
+                "%G_BUFFER%": g_buffer_glsl("o", 0, g_buffer_layout),
+                "%HISTORY%": g_buffer_glsl("h", 4, g_buffer_layout),
+            })
+            self.history = self.alloc_g_buffer("history_", g_buffer_layout)
+            self.reset_history()
 
         self.time = 0
+        self.time_set = False
+
+    def sink_glsl(self, layout):
+        """ GLSL of store_o(i, depth, color, normal, shadow) at the end of raymarch.glsl """
+        return g_buffer_glsl("o", 0, layout)
+
+    def alloc_outputs(self, layout):
+        self.g_buffer = self.alloc_g_buffer("", layout)
+        self.depth = self.g_buffer.depth
+        self.color = self.g_buffer.color
+        self.normal = self.g_buffer.normal
+        self.shadow = self.g_buffer.shadow
+
+    def outputs(self):
+        """ buffers written by raymarch.glsl from binding 0 on """
+        return self.g_buffer.buffers()
+
+    def alloc_g_buffer(self, prefix, layout):
+        g_buffer = GBuffer()
+        g_buffer.owner = self
+        g_buffer.layout = layout
+        for part, nbytes in G_BUFFER_LAYOUTS[layout]:
+            setattr(g_buffer, part, self.alloc_buffer(prefix + part, self.W * self.H * nbytes))
+        return g_buffer
 
     def set_caminfo(self, caminfo=None):
         if not caminfo:
             caminfo = CameraInfo()
 
-        if "u_campos" in self.cs:
-            self.cs["u_campos"].value = caminfo.u_campos
-
-        if "u_camtarget" in self.cs:
-            self.cs["u_camtarget"].value = caminfo.u_camtarget
+        self.uniforms["u_campos"] = caminfo.u_campos
+        self.uniforms["u_camtarget"] = caminfo.u_camtarget
 
     def set_lightinfo(self, lightinfo=None):
         if not lightinfo:
             lightinfo = LightInfo()
 
-        if "u_lightpos" in self.cs:
-            self.cs["u_lightpos"].value = lightinfo.u_lightpos
+        self.uniforms["u_lightpos"] = lightinfo.u_lightpos
+
+    def set_time(self, time):
+        """ u_time of next frame, uniforms only. frames advance it by 0.1 otherwise """
+        self.time = time
+        self.time_set = True
+        self.uniforms["u_time"] = time
+        self.mark_dirty()
+
+    def advance_time(self):
+        """ u_time of a frame, 0.1 after the previous one unless set_time was called since """
+        if not self.time_set:
+            self.time += 0.1
+            self.uniforms["u_time"] = self.time
+        self.time_set = False
+
+    def set_bounds(self, bounds):
+        """ replace bounds given to in_node, see in_node """
+        if not bounds or len(bounds) > Raymarch.MAX_BOUNDS:
+            raise Exception("[Raymarch] 1 to {} bounds, got {}".format(
+                Raymarch.MAX_BOUNDS, len(bounds or ())))
+
+        data = Raymarch.pack_bounds(bounds)
+        self.bounds = self.alloc_buffer("bounds", data.nbytes)
+        self.bounds.write(data.tobytes())
+        self.uniforms["u_num_bounds"] = len(bounds)
+
+    @staticmethod
+    def pack_bounds(bounds):
+        """ two vec4 per bound, see raymarch.glsl """
+        data = []
+        for bound in bounds:
+            kind = bound[0]
+            if kind == "sphere":
+                center, radius = bound[1], bound[2]
+                data.append(tuple(center) + (radius,))
+                data.append((0.0, 0.0, 0.0, 0.0))
+            elif kind == "box":
+                data.append(tuple(bound[1]) + (0.0,))
+                data.append(tuple(bound[2]) + (1.0,))
+            else:
+                raise Exception("[Raymarch] unknown bound {}, should be sphere or box".format(kind))
+        return np.array(data, dtype=np.float32)
+
+    @property
+    def reconstructs(self):
+        """ traces a subset of pixels per frame """
+        return self.checkerboard or self.subsample > 1
+
+    @property
+    def traced_fraction(self):
+        if self.checkerboard:
+            return 0.5
+        return 1.0 / (self.subsample * self.subsample)
+
+    def reset_history(self):
+        """ forget previous frame, e.g. on camera cuts """
+        self.frame = 0
+        self.phase_traced = (0, 0)
+        self.prev_camera = None
+
+    def phase(self):
+        """ offset of pixels traced this frame, every pixel is traced once per cycle """
+        if self.checkerboard:
+            return (self.frame % 2, 0)
+        n = self.frame % (self.subsample * self.subsample)
+        return (n % self.subsample, n // self.subsample)
+
+    def trace_size(self):
+        """ invocations of the trace pass """
+        if self.checkerboard:
+            return (-(-self.W // 2), self.H)
+        return (-(-self.W // self.subsample), -(-self.H // self.subsample))
+
+    def traced_mask(self):
+        """ (W, H) bool of pixels traced by last out_node, laid out like step_counts """
+        if not self.reconstructs:
+            return np.ones((self.W, self.H), dtype=bool)
+
+        index = np.arange(self.W * self.H)
+        x, y = index % self.W, index // self.W
+        phase_x, phase_y = self.phase_traced
+        if self.checkerboard:
+            mask = (x + y + phase_x) % 2 == 0
+        else:
+            mask = ((x - phase_x) % self.subsample == 0) & ((y - phase_y) % self.subsample == 0)
+        return mask.reshape((self.W, self.H))
+
+    def step_words(self):
+        """ (W, H) o_steps of last out_node: step count, CAPPED_BIT when out of steps """
+        if self.steps is None:
+            raise Exception("[Raymarch] step counts need in_node(..., count_steps=True)")
+        data = np.frombuffer(self.steps.read(size=self.W * self.H * 4), dtype=np.uint32)
+        return data.reshape((self.W, self.H))
+
+    def step_counts(self):
+        """ (W, H) march steps per pixel of last out_node, needs count_steps """
+        return self.step_words() & ~np.uint32(Raymarch.CAPPED_BIT)
+
+    def capped_mask(self):
+        """ (W, H) bool of rays that ran out of steps before reaching a surface or FAR """
+        return (self.step_words() & np.uint32(Raymarch.CAPPED_BIT)) != 0
+
+    def steps_per_pixel(self):
+        """ mean march steps per traced pixel of last out_node """
+        return float(self.step_counts()[self.traced_mask()].mean())
+
+    def step_stats(self):
+        """ mean, p99 and max steps, and fraction of rays out of steps, over traced pixels """
+        words = self.step_words()[self.traced_mask()]
+        counts = words & ~np.uint32(Raymarch.CAPPED_BIT)
+        return {
+            "steps": self.uniforms["u_maxsteps"],
+            "mean": float(counts.mean()),
+            "p99": float(np.percentile(counts, 99)),
+            "max": int(counts.max()),
+            "capped": float(np.mean((words & np.uint32(Raymarch.CAPPED_BIT)) != 0)),
+        }
+
+    def step_heatmap(self):
+        """
+        (W, H, 4) image of last out_node's step counts, blue for few steps over
+        green to red at u_maxsteps, white where rays ran out of steps
+        """
+        x = np.clip(self.step_counts() / float(self.uniforms["u_maxsteps"]), 0.0, 1.0)
+        stops = np.linspace(0.0, 1.0, 3)
+        heatmap = np.ones((self.W, self.H, 4), dtype=np.float32)
+        for c, values in enumerate(((0.0, 0.0, 1.0), (0.0, 1.0, 0.0), (1.0, 0.0, 0.0))):
+            heatmap[..., c] = np.interp(x, stops, values)
+        heatmap[self.capped_mask(), :3] = 1.0
+        return heatmap
 
     def out_node(self):
-        self.time += 0.1
-        if "u_time" in self.cs:
-            self.cs["u_time"].value = self.time
+        """ g-buffer of next frame, see set_time """
+        self.advance_time()
+
+        if self.reconstructs:
+            return self.out_reconstructed()
+
+        self.trace()
+        return self.g_buffer
+
+    def trace(self, size=None):
+        for n, buffer in enumerate(self.outputs()):
+            buffer.bind_to_storage_buffer(n)
+        if self.steps is not None:
+            self.steps.bind_to_storage_buffer(4)
+        if self.bounds is not None:
+            self.bounds.bind_to_storage_buffer(5)
+        if self.volume:
+            self.volume.use()
+
+        self.dispatch(self.cs, self.uniforms, size)
+
+    def out_reconstructed(self):
+        """ trace this frame's pixels, resolve the rest from previous frame """
+        current, history = self.g_buffer.buffers(), self.history.buffers()
+        layout = G_BUFFER_LAYOUTS[self.g_buffer.layout]
+        for dst, src, (_, nbytes) in zip(history, current, layout):
+            self.gl.copy_buffer(dst, src, self.W * self.H * nbytes)
+
+        self.phase_traced = self.phase()
+        self.uniforms["u_phase"] = self.phase_traced
+        self.trace(self.trace_size())
 
-        self.depth.bind_to_storage_buffer(0)
-        self.color.bind_to_storage_buffer(1)
-        self.normal.bind_to_storage_buffer(2)
-        self.shadow.bind_to_storage_buffer(3)
+        camera = (self.uniforms["u_campos"], look_matrix(self.uniforms["u_campos"], self.uniforms["u_camtarget"]))
+        uniforms = {
+            "u_phase": self.phase_traced,
+            "u_campos": camera[0],
+            "u_look": camera[1],
+            "u_history": 0 if self.prev_camera is None else 1,
+        }
+        if self.prev_camera is not None:
+            uniforms["u_prev_campos"], uniforms["u_prev_look"] = self.prev_camera
 
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-        self.cs.run(gx, gy)
+        for n, buffer in enumerate(current):
+            buffer.bind_to_storage_buffer(n)
+        for n, buffer in enumerate(history):
+            buffer.bind_to_storage_buffer(4 + n)
+        self.dispatch(self.resolve_cs, uniforms)
 
+        self.prev_camera = camera
+        self.frame += 1
         return self.g_buffer
 
 
+class LitRaymarch(Raymarch):
+    """ Raymarch and DeferredLight in one pass, lit color is the only output """
+
+    SINK_GLSL = """
+uniform float u_shadow_intensity;
+
+vec3 BXDF(float depth, vec3 color, vec3 normal, float shadow)
+{
+%BXDF%
+}
+
+layout(binding=0) buffer out_lit
+{
+    vec4 o_lit[];
+};
+
+void store_o(int i, float depth, vec3 color, vec3 normal, float shadow)
+{
+    o_lit[i] = vec4(BXDF(depth, color, normal, shadow), 1.0);
+}
+"""
+
+    @Base.in_node_wrapper
+    def in_node(self, in_node, distance_field, bxdf, lightinfo=None, caminfo=None, steps=None, **options):
+        """ options of Raymarch.in_node, except reconstruction and layouts of a g-buffer """
+        if options.get("subsample", 1) != 1 or options.get("checkerboard") or "g_buffer_layout" in options:
+            raise Exception(
+                "[LitRaymarch] subsample, checkerboard and g_buffer_layout need a g-buffer, "
+                "use Raymarch and DeferredLight")
+
+        self.bxdf = bxdf
+        Raymarch.in_node(self, in_node, distance_field, lightinfo, caminfo, steps, **options)
+
+    def sink_glsl(self, layout):
+        return LitRaymarch.SINK_GLSL.replace("%BXDF%", self.bxdf)
+
+    def alloc_outputs(self, layout):
+        self.g_buffer = None
+        self.lit = self.alloc_buffer("lit")
+
+    def outputs(self):
+        return (self.lit,)
+
+    def set_lightinfo(self, lightinfo=None):
+        if not lightinfo:
+            lightinfo = LightInfo()
+
+        self.uniforms["u_lightpos"] = lightinfo.u_lightpos
+        self.uniforms["u_shadow_intensity"] = lightinfo.u_shadow_intensity
+
+    def out_texture(self):
+        self.advance_time()
+        self.trace()
+        return self.as_texture(self.lit)
+
+    @Base.out_node_wrapper
+    def out_node(self):
+        return self.out_texture()
+
+
+class BakeSDF(Base):
+    """ samples a Raymarch distance field into an SDFVolume, out_node bakes or loads it """
+
+    # part of cache file names, changes when baked volumes change meaning
+    VERSION = 1
+
+    @Base.in_node_wrapper
+    def in_node(self, in_node, distance_field, box_min, box_max, resolution=64, brick_size=None,
+                time=0.0, cache_dir=None):
+        """
+        box_min, box_max: corners of the sampled box, all surfaces should be inside
+        resolution: samples per axis, int or (x, y, z)
+        brick_size: cells per brick edge of a sparse volume, resolution - 1 must be a multiple of it
+        time: u_time of distance field
+        cache_dir: folder of baked volumes, later jobs baking the same field load them
+        """
+
+        if self.backend == "numpy":
+            raise ValueError("[BakeSDF] GLSL distance field needs gl backend")
+
+        samples = np.broadcast_to(np.asarray(resolution, dtype=np.int64), (3,))
+        if samples.min() < 2:
+            raise Exception("[BakeSDF] resolution {} should be at least 2".format(resolution))
+        if brick_size and np.any((samples - 1) % brick_size):
+            raise Exception("[BakeSDF] resolution - 1 of {} should be a multiple of brick_size {}".format(
+                resolution, brick_size))
+
+        self.distance_field = distance_field
+        self.box_min = tuple(float(x) for x in box_min)
+        self.box_max = tuple(float(x) for x in box_max)
+        self.samples = tuple(int(x) for x in samples)
+        self.brick_size = brick_size or 0
+        self.time = time
+        self.cache_dir = cache_dir
+
+        self.cell = tuple(float(x) for x in np.subtract(self.box_max, self.box_min) / (samples - 1))
+        self.uniforms = {"u_time": time, "u_bake_min": self.box_min, "u_bake_cell": self.cell}
+
+        def inject(brick):
+            return {
+                "%DIST_FIELD%": distance_field,
+                "%VOLUME%": "",
+                "%BAKE%": "1",
+                "%BAKE_BRICK%": str(brick),
+                "%NEAR%": "0.001",
+                "%SURFACE%": "0.0001",
+                "%NORMAL_SAMPLES%": "6",
+                "%BOUNDS%": "0",
+                "%COUNT_STEPS%": "0",
+                "%TRACE_STEP%": "1",
+                "%CHECKERBOARD%": "0",
+                "%G_BUFFER%": "",
+            }
+
+        self.cs = self.get_cs("./gl/raymarch.glsl", inject(0))
+        self.brick_cs = self.get_cs("./gl/raymarch.glsl", inject(self.brick_size)) if brick_size else None
+
+    def cache_path(self):
+        key = hashlib.sha256(repr((
+            BakeSDF.VERSION, self.distance_field, self.box_min, self.box_max,
+            self.samples, self.brick_size, self.time)).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, "sdf_{}.npz".format(key))
+
+    def out_node(self):
+        """ SDFVolume, loaded from cache_dir when baked before """
+        if self.cache_dir is None:
+            return self.bake()
+
+        path = self.cache_path()
+        if os.path.exists(path):
+            return SDFVolume.load(self.gl, path)
+
+        volume = self.bake()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        volume.save(path)
+        return volume
+
+    def bake(self):
+        if not self.brick_size:
+            texture = self.gl.texture3d(self.samples, 4, dtype="f4")
+            texture.write(self.sample(self.cs, "volume", self.samples))
+            return SDFVolume(self.box_min, self.box_max, self.samples, texture)
+
+        # distance at brick centers picks the bricks near the surface
+        brick = self.brick_size
+        num_bricks = tuple((n - 1) // brick for n in self.samples)
+        count = int(np.prod(num_bricks))
+        centers = self.sample(self.cs, "centers", num_bricks, {
+            "u_bake_stride": float(brick), "u_bake_offset": brick / 2.0})
+        distance = np.frombuffer(centers.read(size=count * 16), dtype=np.float32)[0::4]
+
+        # trilinear samples of a brick also need its neighbours within a cell or so
+        reach = 0.5 * brick * float(np.linalg.norm(self.cell)) + 2.0 * max(self.cell)
+        occupied = np.nonzero(np.abs(distance) < reach)[0]
+
+        # atlas of about cubic slot grid, table entries of occupied bricks point at their slot
+        side = max(int(math.ceil(len(occupied) ** (1.0 / 3.0))), 1)
+        slots = (side, side, max(int(math.ceil(len(occupied) / (side * side))), 1))
+        n = np.arange(len(occupied))
+        slot_xyz = np.stack((n % side, n // side % side, n // (side * side)), axis=-1)
+
+        table = np.zeros((count, 4), dtype=np.float32)
+        table[:, 0] = -1.0
+        table[:, 3] = distance
+        table[occupied, :3] = slot_xyz * (brick + 1)
+        table[occupied, 3] = 0.0
+
+        grid_xyz = np.stack((occupied % num_bricks[0], occupied // num_bricks[0] % num_bricks[1],
+                             occupied // (num_bricks[0] * num_bricks[1])), axis=-1)
+        slot_data = np.zeros((max(len(occupied), 1), 4), dtype=np.int32)
+        slot_data[:len(occupied), :3] = grid_xyz
+        slot_buffer = self.alloc_buffer("slots", slot_data.nbytes)
+        slot_buffer.write(slot_data.tobytes())
+        slot_buffer.bind_to_storage_buffer(1)
+
+        atlas = tuple(x * (brick + 1) for x in slots)
+        texture = self.gl.texture3d(atlas, 4, dtype="f4")
+        texture.write(self.sample(self.brick_cs, "volume", atlas, {
+            "u_num_slots": len(occupied), "u_bake_slots": slots}))
+        return SDFVolume(
+            self.box_min, self.box_max, self.samples, texture, brick,
+            self.gl.buffer(table.tobytes()), num_bricks)
+
+    def sample(self, cs, name, size, uniforms=None):
+        """ buffer of (distance, color) of size (x, y, z) texels, x fastest """
+        buffer = self.alloc_buffer(name, int(np.prod(size)) * 16)
+        buffer.bind_to_storage_buffer(0)
+
+        for k, v in dict(self.uniforms, u_bake_size=tuple(size), **(uniforms or {})).items():
+            if k in cs:
+                cs[k].value = v
+        cs.run(math.ceil(size[0] / 32), math.ceil(size[1] / 32), size[2])
+        return buffer
+
+
 class DeferredLight(Base):
+    """
+    lights a Raymarch g-buffer with bxdf for lightinfo, and for each of
+    lights (PointLight list) reaching the pixel. with cull, a pass over
+    32x32 pixel tiles keeps the lights reaching the tile's depth range, up to
+    max_tile_lights, so pixels only loop over those.
+    """
+
+    HALO = None
+
+    # pixels per tile side, workgroup size of light_cull.glsl
+    TILE = 32
 
     @Base.in_node_wrapper
-    def in_node(self, in_node, bxdf, g_buffer, lightinfo=None, caminfo=None):
-        cs_post_path = "./gl/raymarch_post.glsl"
-        self.cs = self.get_cs(cs_post_path, {
-            "%BXDF%": bxdf
-        })
+    def in_node(self, in_node, bxdf, g_buffer, lightinfo=None, caminfo=None,
+                lights=None, cull=True, max_tile_lights=128):
+        if self.batch > 1:
+            raise ValueError("[DeferredLight] batched lighting is not implemented")
+        if lights is not None and self.backend == "numpy":
+            raise ValueError("[DeferredLight] point lights are not implemented on numpy backend")
+        self.channels, self.precision = storage.DEFAULT_FORMAT
+
+        # GLSL source on gl backend, python callable on numpy backend
+        self.bxdf = bxdf
+
+        # point lights are compiled in when given at in_node
+        self.multi_light = lights is not None
+        self.cull = cull
+        self.max_tile_lights = max_tile_lights
+
+        # compiled for the layout of g_buffer
+        self.cs = None
+        self.cull_cs = None
+        self.layout = None
+        self.uniforms = {}
 
-        _buffer = np.zeros((self.W, self.H, 4))
-        _buffer = _buffer.astype(np.float32)
-        _buffer = _buffer.tobytes()
-        self.post_out = self.gl.buffer(_buffer)
+        self.post_out = self.alloc_buffer("post_out")
         self.set_g_buffer(g_buffer)
         self.set_lightinfo(lightinfo)
         self.set_caminfo(caminfo)
+        if self.multi_light:
+            self.tiles = self.alloc_buffer("tiles", self.num_tiles * (max_tile_lights + 1) * 4)
+            self.set_lights(lights)
 
     def set_lightinfo(self, lightinfo):
         if not lightinfo:
             lightinfo = LightInfo()
-        if "u_lightpos" in self.cs:
-            self.cs["u_lightpos"].value = lightinfo.u_lightpos
-        if "u_shadow_intensity" in self.cs:
-            self.cs["u_shadow_intensity"].value = lightinfo.u_shadow_intensity
+
+        self.uniforms["u_lightpos"] = lightinfo.u_lightpos
+        self.uniforms["u_shadow_intensity"] = lightinfo.u_shadow_intensity
 
     def set_caminfo(self, caminfo=None):
         if not caminfo:
             caminfo = CameraInfo()
 
-        if "u_campos" in self.cs:
-            self.cs["u_campos"].value = caminfo.u_campos
+        self.uniforms["u_campos"] = caminfo.u_campos
+        self.uniforms["u_camtarget"] = caminfo.u_camtarget
+        self.uniforms["u_look"] = look_matrix(caminfo.u_campos, caminfo.u_camtarget)
+
+    def set_lights(self, lights):
+        """ replace point lights, node must have been given lights at in_node """
+        if not self.multi_light:
+            raise Exception("[DeferredLight] node was created without lights")
+
+        data = DeferredLight.pack_lights(lights)
+        # an empty storage buffer can't be bound
+        self.lights = self.alloc_buffer("lights", max(data.nbytes, 32))
+        self.lights.write(data.tobytes())
+        self.uniforms["u_num_lights"] = len(lights)
+
+    @staticmethod
+    def pack_lights(lights):
+        """ two vec4 per light, see light_cull.glsl """
+        data = []
+        for light in lights:
+            data.append(tuple(light.position) + (light.radius,))
+            data.append(tuple(light.color) + (0.0,))
+        return np.array(data, dtype=np.float32).reshape(-1, 4)
 
-        if "u_camtarget" in self.cs:
-            self.cs["u_camtarget"].value = caminfo.u_camtarget
+    @property
+    def num_tiles(self):
+        return math.ceil(self.W / DeferredLight.TILE) * math.ceil(self.H / DeferredLight.TILE)
+
+    def tile_stats(self):
+        """ lights per tile after last cull: mean, max, and tiles over max_tile_lights """
+        counts = np.frombuffer(self.tiles.read(size=self.num_tiles * (self.max_tile_lights + 1) * 4), dtype=np.uint32)
+        counts = counts.reshape(self.num_tiles, self.max_tile_lights + 1)[:, 0]
+        return {
+            "tiles": self.num_tiles,
+            "lights": self.uniforms["u_num_lights"],
+            "mean": float(np.mean(counts)),
+            "max": int(np.max(counts)),
+            "overflow": int(np.sum(counts > self.max_tile_lights)),
+        }
 
     def set_g_buffer(self, g_buffer):
-        _buffer = np.zeros((self.W, self.H, 4))
-        _buffer = _buffer.astype(np.float32)
-        _buffer = _buffer.tobytes()
+        if not g_buffer and self.backend == "numpy":
+            g_buffer = GBuffer()
+            g_buffer.depth = np.zeros((self.W, self.H), dtype=np.float32)
+            g_buffer.color = np.zeros((self.W, self.H, 4), dtype=np.float32)
+            g_buffer.normal = np.zeros((self.W, self.H, 4), dtype=np.float32)
+            g_buffer.shadow = np.zeros((self.W, self.H), dtype=np.float32)
 
         if not g_buffer:
             g_buffer = GBuffer()
-            g_buffer.depth = self.gl.buffer(_buffer)
-            g_buffer.color = self.gl.buffer(_buffer)
-            g_buffer.normal = self.gl.buffer(_buffer)
-            g_buffer.shadow = self.gl.buffer(_buffer)
+            scalar_bytes = self.W * self.H * 4
+            g_buffer.depth = self.alloc_buffer("empty_depth", scalar_bytes)
+            g_buffer.color = self.alloc_buffer("empty_color")
+            g_buffer.normal = self.alloc_buffer("empty_normal")
+            g_buffer.shadow = self.alloc_buffer("empty_shadow", scalar_bytes)
+            for _buffer in (g_buffer.depth, g_buffer.color, g_buffer.normal, g_buffer.shadow):
+                _buffer.clear()
+
+        if g_buffer.layout != self.layout:
+            self.layout = g_buffer.layout
+            self.cs = self.get_cs("./gl/raymarch_post.glsl", {
+                "%BXDF%": self.bxdf,
+                "%G_BUFFER%": g_buffer_glsl("i", 1, g_buffer.layout),
+                "%LIGHTS%": "1" if self.multi_light else "0",
+                "%CULL%": "1" if self.cull else "0",
+                "%MAX_TILE_LIGHTS%": str(self.max_tile_lights),
+            })
+            if self.multi_light and self.cull:
+                self.cull_cs = self.get_cs("./gl/light_cull.glsl", {
+                    "%G_BUFFER%": g_buffer_glsl("i", 1, g_buffer.layout),
+                    "%MAX_TILE_LIGHTS%": str(self.max_tile_lights),
+                })
 
+        self.g_buffer = g_buffer
         self.in_depth = g_buffer.depth
         self.in_color = g_buffer.color
         self.in_normal = g_buffer.normal
         self.in_shadow = g_buffer.shadow
 
-    @Base.out_node_wrapper
-    def out_node(self):
+    def out_texture(self):
         self.post_out.bind_to_storage_buffer(0)
-        self.in_depth.bind_to_storage_buffer(1)
-        self.in_color.bind_to_storage_buffer(2)
-        self.in_normal.bind_to_storage_buffer(3)
-        self.in_shadow.bind_to_storage_buffer(4)
+        for n, buffer in enumerate(self.g_buffer.buffers(), 1):
+            buffer.bind_to_storage_buffer(n)
 
-        gx, gy = math.ceil(self.W / 32), math.ceil(self.H / 32)
-        self.cs.run(gx, gy)
+        if self.multi_light:
+            self.lights.bind_to_storage_buffer(6)
+            self.tiles.bind_to_storage_buffer(7)
+            if self.cull:
+                self.dispatch(self.cull_cs, self.uniforms)
+
+        self.dispatch(self.cs, self.uniforms)
+        return self.as_texture(self.post_out)
+
+    @Base.out_node_wrapper
+    def out_node(self):
+        return self.out_texture()
 
-        return self.post_out.read()
+    def out_numpy(self):
+        out = self.alloc_array()
+        return numpy_backend.deferred_light(
+            self.bxdf, self.in_depth, self.in_color, self.in_normal, self.in_shadow,
+            self.uniforms, out)
@@ -0,0 +1,153 @@
+"""
+process_pool module
+
+runs graph jobs on worker processes, each with its own GL context (or numpy
+backend) and warm shader cache. results come back through
+multiprocessing.shared_memory instead of pickled arrays.
+
+build functions are pickled by reference, so they have to be importable
+module-level functions: build(init, *params) -> node.
+"""
+
+import multiprocessing as mp
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import shader_cache
+from .context import ContextPool
+from .op_base import Base, Init
+
+
+class _Worker(object):
+    """ per process settings, set up by _init_worker """
+
+    backend = "gl"
+
+
+def _init_worker(backend, context_args, cache_dir, warmup_specs):
+    _Worker.backend = backend
+    Base.CONTEXTS = ContextPool(context_args=context_args)
+    if backend != "gl":
+        return
+
+    if cache_dir:
+        shader_cache.enable_disk_cache(cache_dir)
+
+    # recorded specializations when cache_dir is given, before first job
+    if cache_dir or warmup_specs:
+        shader_cache.warmup(warmup_specs)
+
+
+def _run_job(job):
+    index, build, size, params = job
+
+    start = time.perf_counter()
+    init = Init(size=size, backend=_Worker.backend)
+    data = np.ascontiguousarray(build(init, *params).out_node())
+
+    # parent copies result out and unlinks the segment
+    segment = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+    np.ndarray(data.shape, data.dtype, buffer=segment.buf)[...] = data
+    segment.close()
+
+    return {
+        "index": index,
+        "pid": os.getpid(),
+        "name": segment.name,
+        "shape": data.shape,
+        "dtype": data.dtype.str,
+        "seconds": time.perf_counter() - start,
+        "pixels": size[0] * size[1],
+    }
+
+
+def _collect(result):
+    """ result array of job, frees its shared memory """
+    segment = shared_memory.SharedMemory(name=result["name"])
+    try:
+        data = np.ndarray(result["shape"], np.dtype(result["dtype"]), buffer=segment.buf).copy()
+    finally:
+        segment.close()
+        segment.unlink()
+    return data
+
+
+class ProcessPool(object):
+    """
+    processes: worker count, defaults to cpu count.
+    max_jobs_per_worker: recycle a worker after that many jobs, None keeps them.
+    context_args: see ContextPool, e.g. {"backend": "egl"} on headless machines.
+    cache_dir / warmup_specs: shader disk cache and specs compiled on worker start,
+    see shader_cache.warmup.
+    """
+
+    def __init__(self, processes=None, backend="gl", max_jobs_per_worker=None,
+                 context_args=None, cache_dir=None, warmup_specs=None):
+        super(ProcessPool, self).__init__()
+
+        if backend not in Base.BACKENDS:
+            raise Exception("backend {} is not one of {}".format(backend, Base.BACKENDS))
+
+        self.processes = processes or os.cpu_count()
+        self.backend = backend
+        self.max_jobs_per_worker = max_jobs_per_worker
+
+        # GL contexts don't survive fork, workers always start fresh
+        self.pool = mp.get_context("spawn").Pool(
+            self.processes, _init_worker,
+            (backend, context_args, cache_dir, warmup_specs),
+            maxtasksperchild=max_jobs_per_worker)
+
+        # pid -> {"jobs", "seconds", "pixels"}
+        self.workers = {}
+
+    def imap(self, build, params, size=(512, 512)):
+        """ yields result of build(init, *p).out_node() for p in params, in order """
+        jobs = [(i, build, size, tuple(p)) for i, p in enumerate(params)]
+        results = self.pool.imap(_run_job, jobs)
+        try:
+            for result in results:
+                self.record(result)
+                yield _collect(result)
+        finally:
+            # free segments of results nobody asked for, if iteration stopped early
+            while True:
+                try:
+                    _collect(next(results))
+                except StopIteration:
+                    break
+                except Exception:
+                    # failed jobs leave no segment behind
+                    continue
+
+    def map(self, build, params, size=(512, 512)):
+        return list(self.imap(build, params, size))
+
+    def record(self, result):
+        worker = self.workers.setdefault(result["pid"], {"jobs": 0, "seconds": 0.0, "pixels": 0})
+        worker["jobs"] += 1
+        worker["seconds"] += result["seconds"]
+        worker["pixels"] += result["pixels"]
+
+    def stats(self):
+        """ per worker pid: jobs, busy seconds, jobs and megapixels per busy second """
+        stats = {}
+        for pid, worker in self.workers.items():
+            seconds = max(worker["seconds"], 1e-9)
+            stats[pid] = dict(worker)
+            stats[pid]["jobs_per_second"] = worker["jobs"] / seconds
+            stats[pid]["mpix_per_second"] = worker["pixels"] / seconds / 1e6
+        return stats
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
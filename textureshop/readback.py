@@ -0,0 +1,182 @@
+"""
+readback module
+
+non-blocking readback. results are copied on GPU into a ring of staging
+buffers and read back later, so the next frame / tile is dispatched while
+previous ones are still in flight, and disk writes run on a worker thread.
+
+moderngl exposes no sync objects, so instead of polling a fence a staging
+buffer is read only when the ring wraps around to it (or its result is
+asked for), when depth - 1 more submissions are already queued behind it.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from . import storage
+from .op_base import Base, TextureHandle
+from .op_quantize import Quantize
+
+
+def _source(value):
+    """ (buffer, nbytes, decode) of node, TextureHandle or Quantize node """
+    if isinstance(value, Quantize):
+        return value.out_buffer(), value.nbytes, value.decode
+
+    if isinstance(value, Base):
+        value = value.texture()
+
+    if isinstance(value, TextureHandle):
+        shape, precision = value.shape, value.precision
+        return value.buffer, value.nbytes, lambda data: storage.from_bytes(data, shape, precision)
+
+    raise NotImplementedError("[Readback] can't read back {}".format(type(value)))
+
+
+class Readback(object):
+    """ future of one submitted readback """
+
+    def __init__(self, queue, slot, nbytes, decode, callback=None):
+        super(Readback, self).__init__()
+
+        self.queue = queue
+        self.slot = slot
+        self.nbytes = nbytes
+        self.decode = decode
+        self.callback = callback
+
+        self.data = None
+        self.is_done = False
+
+        # concurrent.futures.Future of callback, once data is read
+        self.callback_future = None
+
+    def done(self):
+        return self.is_done
+
+    def result(self):
+        """ numpy data, blocks on GPU only if it's not read back yet """
+        if not self.is_done:
+            self.queue.resolve(self)
+        return self.data
+
+    def wait(self):
+        """ data, after callback finished """
+        data = self.result()
+        if self.callback_future is not None:
+            self.callback_future.result()
+        return data
+
+
+class ReadbackQueue(object):
+    """
+    ring of depth staging buffers, depth=2 for double buffering.
+    callback(data) of each readback runs on a worker thread, in submission order.
+    workers=0 runs callbacks inline instead, more workers would reorder them.
+    submit and result must be called from the thread owning the GL context.
+    """
+
+    def __init__(self, gl=None, depth=2, workers=1):
+        super(ReadbackQueue, self).__init__()
+
+        if depth < 1:
+            raise Exception("[Readback] depth should be at least 1")
+        if workers not in (0, 1):
+            raise Exception("[Readback] workers should be 0 (inline callbacks) or 1, not {}".format(workers))
+
+        self.gl = gl or Base.CONTEXTS.current()
+        self.depth = depth
+        self.staging = [None] * depth
+        self.pending = deque()
+        self.next_slot = 0
+
+        # no workers: callbacks run inline when data is read
+        self.executor = ThreadPoolExecutor(1) if workers else None
+
+        self.submitted = 0
+        self.resolved = 0
+
+        # readbacks resolved because the ring wrapped, not asked for
+        self.wraps = 0
+
+    def submit(self, value, callback=None) -> Readback:
+        """ queue readback of node (runs it), TextureHandle or Quantize node """
+        buffer, nbytes, decode = _source(value)
+
+        slot = self.next_slot
+        for readback in self.pending:
+            if readback.slot == slot:
+                # ring is full, oldest one frees the slot
+                self.wraps += 1
+                self.resolve(readback)
+                break
+
+        staging = self.staging[slot]
+        if staging is None or staging.size < nbytes:
+            if staging is not None:
+                staging.release()
+            staging = self.gl.buffer(reserve=nbytes)
+            self.staging[slot] = staging
+
+        # ordered after the dispatch writing buffer, before the next one
+        self.gl.copy_buffer(staging, buffer, nbytes)
+
+        readback = Readback(self, slot, nbytes, decode, callback)
+        self.pending.append(readback)
+        self.next_slot = (slot + 1) % self.depth
+        self.submitted += 1
+        return readback
+
+    def resolve(self, readback):
+        """ read back pending readbacks up to given one, in submission order """
+        while self.pending:
+            first = self.pending.popleft()
+            data = self.staging[first.slot].read(size=first.nbytes)
+            first.data = first.decode(data)
+            first.is_done = True
+            self.resolved += 1
+
+            if first.callback is not None:
+                if self.executor:
+                    first.callback_future = self.executor.submit(first.callback, first.data)
+                else:
+                    first.callback(first.data)
+
+            if first is readback:
+                break
+
+    def drain(self):
+        """ read back everything pending and wait for callbacks """
+        last = None
+        if self.pending:
+            last = self.pending[-1]
+            self.resolve(last)
+
+        if self.executor:
+            # single queue of callbacks, an empty job waits for the ones before it
+            self.executor.submit(lambda: None).result()
+        return last
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "submitted": self.submitted,
+            "resolved": self.resolved,
+            "pending": len(self.pending),
+            "wraps": self.wraps,
+        }
+
+    def close(self):
+        self.drain()
+        if self.executor:
+            self.executor.shutdown()
+        for staging in self.staging:
+            if staging is not None:
+                staging.release()
+        self.staging = [None] * self.depth
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
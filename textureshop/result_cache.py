@@ -0,0 +1,224 @@
+"""
+result_cache module
+
+opt-in content addressed cache of node outputs. a node's key hashes its op,
+shader specialization, uniforms, size, storage format and the keys of its
+inputs (see Base.cache_key), so graphs sharing a subtree, or re-run with
+only downstream changes, skip the upstream dispatches.
+
+two levels: LRU of GPU buffer copies per context, bounded in bytes, and an
+optional on-disk store of raw buffer bytes with byte budget eviction.
+"""
+
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+from . import storage
+from .op_base import Base, BufferPool, TextureHandle
+
+
+class _Entry(object):
+    """ cached GPU copy, buffer goes back to the pool once evicted and unused """
+
+    def __init__(self, gl, buffer, nbytes):
+        super(_Entry, self).__init__()
+
+        self.buffer = buffer
+        self.nbytes = nbytes
+        weakref.finalize(self, BufferPool.of(gl).release, buffer)
+
+
+class DiskStore(object):
+    """ raw buffer bytes as <key>.bin files, least recently used removed past budget """
+
+    def __init__(self, directory, budget):
+        super(DiskStore, self).__init__()
+
+        self.directory = os.path.abspath(directory)
+        self.budget = budget
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.evictions = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, "{}.bin".format(key))
+
+    def files(self):
+        """ [(mtime, size, path)] of stored entries """
+        files = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".bin"):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # removed by another process
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    @property
+    def nbytes(self):
+        return sum(size for _, size, _ in self.files())
+
+    def load(self, key, nbytes):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            return None
+
+        if len(data) != nbytes:
+            return None
+
+        # mtime orders eviction
+        os.utime(path)
+        return data
+
+    def store(self, key, data):
+        if len(data) > self.budget:
+            return
+
+        # written whole or not at all, other processes may share the folder
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        files = sorted(self.files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.budget:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        for _, _, path in self.files():
+            os.remove(path)
+
+
+class ResultCache(object):
+    """
+    memory_bytes: GPU bytes kept per process, over all contexts.
+    directory / disk_bytes: on-disk store, off when directory is None.
+    """
+
+    def __init__(self, memory_bytes=256 << 20, directory=None, disk_bytes=1 << 30):
+        super(ResultCache, self).__init__()
+
+        self.memory_bytes = memory_bytes
+        self.disk = DiskStore(directory, disk_bytes) if directory else None
+
+        # (gl, key) -> _Entry
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def node_nbytes(node):
+        return storage.buffer_nbytes(node.batch * node.W * node.H, node.channels, node.precision)
+
+    @staticmethod
+    def handle(node, entry):
+        return TextureHandle(
+            node.gl, entry.buffer, (node.W, node.H), owner=entry, layers=node.batch,
+            channels=node.channels, precision=node.precision)
+
+    def get(self, node, key):
+        """ TextureHandle of cached output of node, None on miss """
+        with self.lock:
+            entry = self.entries.get((node.gl, key))
+            if entry is not None:
+                self.entries.move_to_end((node.gl, key))
+                self.hits += 1
+                return ResultCache.handle(node, entry)
+
+        nbytes = ResultCache.node_nbytes(node)
+        data = self.disk.load(key, nbytes) if self.disk else None
+        if data is None:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        buffer = BufferPool.of(node.gl).acquire(nbytes)
+        buffer.write(data)
+        entry = self.insert(node.gl, key, _Entry(node.gl, buffer, nbytes))
+        with self.lock:
+            self.disk_hits += 1
+        return ResultCache.handle(node, entry)
+
+    def put(self, node, key, handle):
+        """ keep a GPU copy of handle, node keeps writing into its own buffer """
+        nbytes = handle.nbytes
+        if nbytes <= self.memory_bytes:
+            buffer = BufferPool.of(node.gl).acquire(nbytes)
+            node.gl.copy_buffer(buffer, handle.buffer, nbytes)
+            self.insert(node.gl, key, _Entry(node.gl, buffer, nbytes))
+
+        if self.disk:
+            self.disk.store(key, handle.buffer.read(size=nbytes))
+
+    def insert(self, gl, key, entry):
+        with self.lock:
+            old = self.entries.pop((gl, key), None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+
+            self.entries[(gl, key)] = entry
+            self.nbytes += entry.nbytes
+
+            # evicted buffers are released once handles reading them are gone
+            while self.nbytes > self.memory_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+        return entry
+
+    def clear(self, disk=False):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+        if disk and self.disk:
+            self.disk.clear()
+
+    def stats(self):
+        stats = {
+            "entries": len(self.entries),
+            "bytes": self.nbytes,
+            "memory_bytes": self.memory_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+        if self.disk:
+            stats["disk_bytes"] = self.disk.nbytes
+            stats["disk_evictions"] = self.disk.evictions
+        return stats
+
+
+def enable_result_cache(memory_bytes=256 << 20, directory=None, disk_bytes=1 << 30):
+    """ cache node outputs from now on, inputs uploaded before aren't content hashed """
+    Base.RESULT_CACHE = ResultCache(memory_bytes, directory, disk_bytes)
+    return Base.RESULT_CACHE
+
+
+def disable_result_cache():
+    Base.RESULT_CACHE = None
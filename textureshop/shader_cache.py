@@ -0,0 +1,211 @@
+"""
+shader_cache module
+
+opt-in persistent shader cache and warm-up.
+
+moderngl does not expose program binaries, so binaries are left to the
+driver's own disk cache (pointed at the same directory), while this module
+stores preprocessed sources and the set of specializations used so a cold
+worker can compile them all before its first job.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future
+
+from .op_base import Base, Init, preprocess_cs
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "textureshop", "shaders")
+
+
+def renderer_string(gl):
+    info = gl.info
+    return "{}|{}|{}".format(
+        info.get("GL_VENDOR"), info.get("GL_RENDERER"), info.get("GL_VERSION"))
+
+
+def _relpath(cs_path):
+    # keep entries valid when package is installed elsewhere
+    dirpath = os.path.dirname(os.path.realpath(__file__))
+    if cs_path.startswith(dirpath):
+        return "./" + os.path.relpath(cs_path, dirpath)
+    return cs_path
+
+
+class ShaderDiskCache(object):
+    """ preprocessed shader sources, keyed by source hash + renderer """
+
+    def __init__(self, directory):
+        super(ShaderDiskCache, self).__init__()
+
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(source, renderer):
+        h = hashlib.sha256()
+        h.update(renderer.encode("utf-8"))
+        h.update(b"\0")
+        h.update(source.encode("utf-8"))
+        return h.hexdigest()
+
+    def store(self, gl, cs_path, inject, source):
+        renderer = renderer_string(gl)
+        key = ShaderDiskCache.make_key(source, renderer)
+        path = os.path.join(self.directory, "{}.json".format(key))
+        if os.path.exists(path):
+            return key
+
+        entry = {
+            "renderer": renderer,
+            "cs_path": _relpath(cs_path),
+            "inject": inject,
+            "source": source,
+        }
+
+        # write then rename, so concurrent workers never see partial entries
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        with self.lock:
+            with open(tmp_path, "w") as fp:
+                json.dump(entry, fp)
+            os.replace(tmp_path, path)
+        return key
+
+    def entries(self, renderer=None):
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(".json"):
+                continue
+
+            try:
+                with open(os.path.join(self.directory, filename), "r") as fp:
+                    entry = json.load(fp)
+            except (OSError, ValueError):
+                continue
+
+            if renderer and entry.get("renderer") != renderer:
+                continue
+            yield entry
+
+    def clear(self):
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".json"):
+                os.remove(os.path.join(self.directory, filename))
+
+
+def enable_disk_cache(directory=None):
+    """
+    enable on-disk shader cache under directory.
+    call before the first GL context is created, so the driver picks up
+    its binary cache location too.
+    """
+
+    directory = directory or os.environ.get("TEXTURESHOP_SHADER_CACHE", DEFAULT_CACHE_DIR)
+    directory = os.path.abspath(directory)
+
+    # driver binary caches: mesa, nvidia
+    driver_dir = os.path.join(directory, "driver")
+    os.environ.setdefault("MESA_SHADER_CACHE_DIR", driver_dir)
+    os.environ.setdefault("__GL_SHADER_DISK_CACHE", "1")
+    os.environ.setdefault("__GL_SHADER_DISK_CACHE_PATH", driver_dir)
+
+    Base.DISK_CACHE = ShaderDiskCache(directory)
+    return Base.DISK_CACHE
+
+
+def disable_disk_cache():
+    Base.DISK_CACHE = None
+
+
+def op_spec(op):
+    """ (cs_path, inject) of given spec, or of MathOp/MixOp subclass """
+    if isinstance(op, tuple):
+        return op
+
+    if callable(getattr(op, "cs_spec", None)):
+        return op.cs_spec()
+
+    # e.g. Raymarch, LitRaymarch and DeferredLight shaders depend on distance field and bxdf
+    raise TypeError(
+        "[ShaderCache] {} has no cs_spec, its shaders depend on in_node arguments. "
+        "pass (cs_path, inject) specs, or warm up from the disk cache".format(op))
+
+
+def _cached_specs(gl):
+    if not Base.DISK_CACHE:
+        return []
+
+    specs = []
+    for entry in Base.DISK_CACHE.entries(renderer_string(gl)):
+        cs_path = entry["cs_path"]
+        if not os.path.isabs(cs_path):
+            dirpath = os.path.dirname(os.path.realpath(__file__))
+            cs_path = os.path.join(dirpath, cs_path.replace("./", ""))
+
+        # source file changed since entry was written
+        if not os.path.exists(cs_path):
+            continue
+        if preprocess_cs(cs_path, entry["inject"])[1] != entry["source"]:
+            continue
+        specs.append((cs_path, entry["inject"]))
+    return specs
+
+
+def _warmup_background(specs, future):
+    # worker thread gets its own context from Base.CONTEXTS: populates driver
+    # disk cache and the preprocessed source cache without touching caller's context.
+    # the context is not released, see ContextPool.shutdown
+    try:
+        gl = Base.CONTEXTS.current()
+        if specs is None:
+            specs = _cached_specs(gl)
+
+        for cs_path, inject in specs:
+            cs_path, source = preprocess_cs(cs_path, inject)
+            cs = gl.compute_shader(source)
+            if Base.DISK_CACHE:
+                Base.DISK_CACHE.store(gl, cs_path, inject, source)
+            cs.release()
+    except BaseException as e:
+        future.set_exception(e)
+        return
+    future.set_result(len(specs))
+
+
+def warmup(specs=None, gl=None, background=False):
+    """
+    precompile shader specializations.
+
+    specs: list of (cs_path, inject) or MathOp/MixOp subclasses,
+           defaults to every specialization recorded in disk cache.
+           ops without cs_spec, like Raymarch, raise TypeError.
+    gl: context to compile into, defaults to shared context.
+    background: compile on worker thread with its own context from Base.CONTEXTS
+                and return a Future of the number of compiled specs, its result()
+                re-raises errors of the worker. programs land in driver's disk cache,
+                so later compiles on gl are fast.
+    """
+
+    if background:
+        gl_specs = None
+        if specs is not None:
+            gl_specs = [op_spec(x) for x in specs]
+
+        future = Future()
+        future.set_running_or_notify_cancel()
+        thread = threading.Thread(target=_warmup_background, args=(gl_specs, future), daemon=True)
+        thread.start()
+        return future
+
+    init = Init(gl=gl)
+    if specs is None:
+        specs = _cached_specs(init.gl)
+
+    programs = []
+    for spec in specs:
+        cs_path, inject = op_spec(spec)
+        programs.append(init.get_cs(cs_path, inject))
+    return programs
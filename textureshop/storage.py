@@ -0,0 +1,159 @@
+"""
+storage module
+
+compact storage of node buffers: 1, 2 or 4 channels of float32 or float16.
+shaders read and write buffers through generated load_<name>(i) and
+store_<name>(i, v) functions, always working on vec4 values:
+1 channel loads as vec4(x, x, x, 1), 2 channels as vec4(x, y, 0, 1).
+"""
+
+import hashlib
+
+import numpy as np
+
+
+CHANNELS = (1, 2, 4)
+PRECISIONS = ("f32", "f16")
+
+DEFAULT_FORMAT = (4, "f32")
+
+_F32_TYPES = {1: "float", 2: "vec2", 4: "vec4"}
+
+
+def check_format(channels, precision):
+    if channels not in CHANNELS:
+        raise Exception("[Storage] channels should be one of {}, got {}".format(CHANNELS, channels))
+    if precision not in PRECISIONS:
+        raise Exception("[Storage] precision should be one of {}, got {}".format(PRECISIONS, precision))
+
+
+def format_of(value):
+    """ (channels, precision) of node or TextureHandle, default for anything else """
+    channels = getattr(value, "channels", None)
+    precision = getattr(value, "precision", None)
+    if channels is None or precision is None:
+        return DEFAULT_FORMAT
+    return (channels, precision)
+
+
+def pixel_bytes(channels, precision):
+    return channels * (4 if precision == "f32" else 2)
+
+
+def buffer_nbytes(pixels, channels, precision):
+    # f16 single channel packs 2 pixels per word
+    nbytes = pixels * pixel_bytes(channels, precision)
+    return (nbytes + 3) // 4 * 4
+
+
+def _load_f32(name, channels):
+    if channels == 1:
+        return "float x = {}_col[i]; return vec4(x, x, x, 1.0);".format(name)
+    if channels == 2:
+        return "return vec4({}_col[i], 0.0, 1.0);".format(name)
+    return "return {}_col[i];".format(name)
+
+
+def _store_f32(name, channels):
+    swizzle = {1: ".x", 2: ".xy", 4: ""}[channels]
+    return "{}_col[i] = v{};".format(name, swizzle)
+
+
+def _load_f16(name, channels):
+    if channels == 1:
+        return "float x = unpackHalf2x16({}_col[i >> 1])[i & 1]; return vec4(x, x, x, 1.0);".format(name)
+    if channels == 2:
+        return "return vec4(unpackHalf2x16({}_col[i]), 0.0, 1.0);".format(name)
+    return "return vec4(unpackHalf2x16({0}_col[i * 2]), unpackHalf2x16({0}_col[i * 2 + 1]));".format(name)
+
+
+def _store_f16(name, channels):
+    if channels == 1:
+        # neighbour pixel shares the word, only touch own half
+        return (
+            "uint shift = uint(i & 1) * 16u; "
+            "atomicAnd({0}_col[i >> 1], ~(0xffffu << shift)); "
+            "atomicOr({0}_col[i >> 1], (packHalf2x16(vec2(v.x, 0.0)) & 0xffffu) << shift);"
+        ).format(name)
+    if channels == 2:
+        return "{}_col[i] = packHalf2x16(v.xy);".format(name)
+    return "{0}_col[i * 2] = packHalf2x16(v.xy); {0}_col[i * 2 + 1] = packHalf2x16(v.zw);".format(name)
+
+
+def buffer_glsl(name, binding, channels=4, precision="f32"):
+    """ SSBO declaration of <name>_col with its load / store functions """
+    check_format(channels, precision)
+
+    if precision == "f32":
+        element = _F32_TYPES[channels]
+        load, store = _load_f32(name, channels), _store_f32(name, channels)
+    else:
+        element = "uint"
+        load, store = _load_f16(name, channels), _store_f16(name, channels)
+
+    return "\n".join((
+        "layout(binding={}) buffer {}_buffer".format(binding, name),
+        "{",
+        "    {} {}_col[];".format(element, name),
+        "};",
+        "",
+        "vec4 load_{}(int i) {{ {} }}".format(name, load),
+        "void store_{}(int i, vec4 v) {{ {} }}".format(name, store),
+        "",
+    ))
+
+
+def roundtrip_glsl(expr, channels, precision):
+    """ expr as it would load back after a store, for fused intermediates """
+    if precision == "f16":
+        expr = "_half({})".format(expr)
+    if channels == 1:
+        return "vec4(vec3(({}).x), 1.0)".format(expr)
+    if channels == 2:
+        return "vec4(({}).xy, 0.0, 1.0)".format(expr)
+    return expr
+
+
+# numpy side, arrays are (..., channels) float32
+
+def expand(data):
+    """ (..., 1 | 2) data loaded as (..., 4), like load_<name> """
+    data = np.asarray(data, dtype=np.float32)
+    if data.ndim == 0 or data.shape[-1] == 4:
+        return data
+
+    ones = np.ones(data.shape[:-1] + (1,), dtype=np.float32)
+    if data.shape[-1] == 1:
+        return np.concatenate((data, data, data, ones), axis=-1)
+    zeros = np.zeros(data.shape[:-1] + (1,), dtype=np.float32)
+    return np.concatenate((data, zeros, ones), axis=-1)
+
+
+def compact(data, channels, precision):
+    """ (..., 4) data as stored in given format, like store_<name> """
+    data = np.asarray(data, dtype=np.float32)[..., :channels]
+    if precision == "f16":
+        data = data.astype(np.float16).astype(np.float32)
+    return data
+
+
+def from_bytes(data, shape, precision):
+    """ float32 array of shape from buffer bytes """
+    dtype = "f4" if precision == "f32" else "f2"
+    count = int(np.prod(shape))
+    data = np.frombuffer(data, dtype=dtype, count=count)
+    return data.astype(np.float32).reshape(shape)
+
+
+def to_bytes(data, precision):
+    dtype = np.float32 if precision == "f32" else np.float16
+    return np.asarray(data, dtype=dtype).tobytes()
+
+
+def digest(data, precision="f32"):
+    """ content hash of data as stored in given precision """
+    data = np.ascontiguousarray(data, dtype=np.float32 if precision == "f32" else np.float16)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(data.shape).encode("utf-8"))
+    h.update(memoryview(data).cast("B"))
+    return h.hexdigest()
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+
+import imageio as ii
+import moderngl as mg
+import numpy as np
+
+from ..animation import AnimationRenderer, orbit
+from ..op_base import Init
+from ..op_quantize import quantize
+from ..op_raymarch import Raymarch, LitRaymarch, DeferredLight
+
+
+GL = mg.create_standalone_context()
+init = Init(size=(64, 48), gl=GL)
+
+DISTANCE_FIELD = """
+    float d = sphere(p - vec3(sin(u_time), 0.0, 0.0), 2.0);
+    if (w_need_color)
+    {
+        w_color = vec3(0.8, 0.3, 0.2);
+    }
+    return d;
+"""
+
+BXDF = """
+    return color * max(dot(normal, normalize(u_lightpos)), 0.0) * mix(1.0, shadow, u_shadow_intensity);
+"""
+
+
+class AnimationTest(unittest.TestCase):
+
+    def test_png_sequence(self):
+        print("[+] Testing pipelined animation against serial render")
+
+        raymarch_node = Raymarch().in_node(init, DISTANCE_FIELD)
+        light_node = DeferredLight().in_node(init, BXDF, raymarch_node.out_node())
+        renderer = AnimationRenderer(raymarch_node, light_node, queue_size=2)
+
+        path = orbit(radius=6.0, height=3.0)
+        frames = 6
+        with tempfile.TemporaryDirectory() as folder:
+            pattern = os.path.join(folder, "frames", "{:03d}.png")
+            stats = renderer.render(pattern, (0.0, 3.0), frames, path)
+            self.assertEqual(stats["frames"], frames)
+            self.assertGreater(stats["fps"], 0.0)
+
+            for i in range(frames):
+                u = i / frames
+                renderer.frame(3.0 * u, path(u))
+                expected = quantize(light_node, flip=True)
+                written = np.asarray(ii.imread(pattern.format(i)))
+                np.testing.assert_array_equal(written, expected)
+
+    def test_lit_raymarch(self):
+        print("[+] Testing single pass animation against two passes")
+
+        raymarch_node = Raymarch().in_node(init, DISTANCE_FIELD)
+        light_node = DeferredLight().in_node(init, BXDF, raymarch_node.out_node())
+        lit_node = LitRaymarch().in_node(init, DISTANCE_FIELD, BXDF)
+
+        class ListWriter(list):
+            append_data = list.append
+
+        path = orbit(radius=6.0, height=3.0)
+        frames = ListWriter()
+        stats = AnimationRenderer(lit_node).render(frames, (0.0, 3.0), 4, path)
+        self.assertEqual(stats["frames"], 4)
+
+        renderer = AnimationRenderer(raymarch_node, light_node)
+        for i, written in enumerate(frames):
+            renderer.frame(3.0 * i / 4, path(i / 4))
+            expected = quantize(light_node, flip=True)
+            np.testing.assert_allclose(written, expected, atol=1)
+
+    def test_encoder_error(self):
+        print("[+] Testing animation encoder error reaches caller")
+
+        raymarch_node = Raymarch().in_node(init, DISTANCE_FIELD)
+        light_node = DeferredLight().in_node(init, BXDF, raymarch_node.out_node())
+        renderer = AnimationRenderer(raymarch_node, light_node, queue_size=1)
+
+        class BrokenWriter(object):
+            def append_data(self, data):
+                raise IOError("disk full")
+
+        with self.assertRaises(IOError):
+            renderer.render(BrokenWriter(), frames=8)
@@ -0,0 +1,123 @@
+import time
+import unittest
+
+import moderngl as mg
+import numpy as np
+
+from ..op_base import Init, Stack
+from ..op_fusion import Fused
+from ..op_math import Add, Multiply, Clamp, Sin
+from ..op_mix import Mix, Rotate
+from ..op_noise import FBMNoise, Gradient
+
+
+GL = mg.create_standalone_context()
+BATCH = 8
+init = Init(size=(32, 32), gl=GL)
+init_batch = Init(size=(32, 32), gl=GL, batch=BATCH)
+init_np = Init(size=(32, 32), backend="numpy", batch=BATCH)
+
+
+class BatchTest(unittest.TestCase):
+
+    def test_math_stack(self):
+        print("[+] Testing batched math over stacked inputs")
+
+        images = np.random.uniform(0.0, 1.0, (BATCH, 32, 32, 4))
+        factors = [x / BATCH for x in range(BATCH)]
+
+        for batch_init in (init_batch, init_np):
+            mult = Multiply().in_node(batch_init, images, Stack(factors))
+            out = Sin().in_node(batch_init, mult).out_node()
+            self.assertEqual(out.shape, (BATCH, 32, 32, 4))
+
+            for n in range(BATCH):
+                single = Multiply().in_node(init, images[n], factors[n])
+                single = Sin().in_node(init, single).out_node()
+                assert np.all(np.isclose(out[n], single, atol=1e-5))
+
+    def test_shared_input(self):
+        print("[+] Testing single image broadcast over batch")
+
+        image = np.random.uniform(0.0, 1.0, (32, 32, 4))
+        offsets = Stack([(x, 0.0, 0.0, 0.0) for x in range(BATCH)])
+
+        add = Add().in_node(init_batch, image, offsets)
+        clamp = Clamp().in_node(init_batch, add, 0.0, 2.0)
+        mix = Mix().in_node(init_batch, clamp, 0.0, Stack([0.5] * BATCH))
+
+        fused = Fused().in_node(init_batch, mix)
+        for out in (mix.out_node(), fused.out_node()):
+            for n in range(BATCH):
+                expected = np.clip(image + (n, 0, 0, 0), 0.0, 2.0) * 0.5
+                assert np.all(np.isclose(out[n], expected, atol=1e-5))
+
+    def test_rotate(self):
+        print("[+] Testing batched rotate")
+
+        images = np.random.uniform(0.0, 1.0, (BATCH, 32, 32, 4))
+        out = Rotate().in_node(init_batch, images, 0.5).out_node()
+        out_np = Rotate().in_node(init_np, images, 0.5).out_node()
+        for n in range(BATCH):
+            single = Rotate().in_node(init, images[n], 0.5).out_node()
+            assert np.all(out[n] == single)
+            assert np.all(np.isclose(out_np[n], single, atol=1e-5))
+
+    def test_gradient(self):
+        print("[+] Testing per layer gradient types")
+
+        types = [x % 6 for x in range(BATCH)]
+        out = Gradient().in_node(init_batch, types).out_node()
+        out_np = Gradient().in_node(init_np, types).out_node()
+        for n, grad_type in enumerate(types):
+            single = Gradient().in_node(init, grad_type).out_node()
+            assert np.all(np.isclose(out[n], single, atol=1e-6))
+            assert np.all(np.isclose(out_np[n], single, atol=1e-5))
+
+        with self.assertRaises(Exception):
+            Gradient().in_node(init_batch, [0, 1])
+
+    def test_fbm_octaves(self):
+        print("[+] Testing per layer fbm octaves")
+
+        noise = np.random.uniform(0.0, 1.0, (32, 32, 4))
+        octaves = list(range(1, BATCH + 1))
+        out = FBMNoise().in_node(init_batch, noise, octaves).out_node()
+        out_np = FBMNoise().in_node(init_np, noise, octaves).out_node()
+        for n, num_octaves in enumerate(octaves):
+            single = FBMNoise().in_node(init, noise, num_octaves).out_node()
+            assert np.all(np.isclose(out[n], single, atol=1e-6))
+            assert np.all(np.isclose(out_np[n], single, atol=1e-2))
+
+    def test_throughput(self):
+        print("[+] Testing batched throughput against per variant chains")
+
+        count = 64
+        init_wide = Init(size=(32, 32), gl=GL, batch=count)
+        noise = np.random.uniform(0.0, 1.0, (32, 32, 4))
+        octaves = [1 + x % 8 for x in range(count)]
+
+        def run_single():
+            return [FBMNoise().in_node(init, noise, x).out_node() for x in octaves]
+
+        def run_batch():
+            return FBMNoise().in_node(init_wide, noise, octaves).out_node()
+
+        run_single(), run_batch()
+
+        start = time.perf_counter()
+        single = run_single()
+        single_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch = run_batch()
+        batch_time = time.perf_counter() - start
+
+        print("\t[+][+] {} variants: {:.4f}s single, {:.4f}s batched".format(
+            count, single_time, batch_time))
+        assert np.all(np.isclose(np.stack(single), batch, atol=1e-6))
+        self.assertLess(batch_time, single_time)
+
+
+if __name__ == "__main__":
+    unittest.main()
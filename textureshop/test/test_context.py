@@ -0,0 +1,84 @@
+import contextlib
+import io
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from .. import context
+from ..context import ContextPool
+from ..op_base import Init
+from ..op_math import Add, Multiply
+from ..op_mix import Mix
+
+
+SIZE = (96, 80)
+images = [np.random.uniform(0.0, 1.0, (SIZE[0], SIZE[1], 4)).astype(np.float32) for _ in range(6)]
+
+
+def render(i, repeat=1):
+    # Init gets the context of the worker thread it runs on
+    init = Init(size=SIZE)
+    for _ in range(repeat):
+        added = Add().in_node(init, images[i], float(i))
+        scaled = Multiply().in_node(init, added, 0.5)
+        result = Mix().in_node(init, scaled, images[i], 0.25).out_node()
+    return threading.get_ident(), init.gl, result
+
+
+class ContextPoolTest(unittest.TestCase):
+
+    def test_thread_affinity(self):
+        print("[+] Testing context pool gives each thread its own context")
+
+        pool = ContextPool(size=2)
+        gl = pool.current()
+        self.assertIs(pool.current(), gl)
+
+        # new contexts are logged, not printed to stdout
+        other = []
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out), self.assertLogs(context.logger, "DEBUG"):
+            thread = threading.Thread(target=lambda: other.append(ContextPool(capture=False).create()))
+            thread.start()
+            thread.join()
+        self.assertIsNot(other[0], gl)
+        self.assertEqual(out.getvalue(), "")
+
+    def test_concurrent_graphs(self):
+        print("[+] Testing independent graphs on context pool")
+
+        pool = ContextPool(size=3)
+        results = pool.map(render, range(len(images)))
+
+        contexts = {}
+        for i, (ident, gl, result) in enumerate(results):
+            # a worker thread always keeps the same context
+            self.assertIs(contexts.setdefault(ident, gl), gl)
+
+            expected = ((images[i] + i) * 0.5) * 0.75 + images[i] * 0.25
+            np.testing.assert_allclose(result, expected, atol=1e-5)
+
+        self.assertLessEqual(len(contexts), 3)
+        self.assertEqual(len(set(map(id, contexts.values()))), len(contexts))
+
+        pool.shutdown()
+        self.assertEqual(pool.stats()["workers"], 0)
+
+    def test_throughput(self):
+        print("[+] Testing context pool throughput")
+
+        serial = ContextPool(size=1)
+        parallel = ContextPool(size=3)
+        for pool in (serial, parallel):
+            # create contexts and programs before timing
+            pool.map(render, range(3))
+
+        timings = []
+        for pool in (serial, parallel):
+            start = time.perf_counter()
+            pool.map(lambda i: render(i, 10), range(len(images)))
+            timings.append(time.perf_counter() - start)
+            pool.shutdown()
+        print("    1 context {:.3f}s, 3 contexts {:.3f}s".format(*timings))
@@ -0,0 +1,152 @@
+import os
+import tempfile
+import unittest
+
+import imageio as ii
+import moderngl as mg
+import numpy as np
+
+from ..cli import main
+from ..graph import Graph
+from ..op_base import Init
+from ..op_math import Add, Multiply
+from ..op_mix import Mix
+from ..op_noise import Gradient
+from ..util import npwrite
+
+
+GL = mg.create_standalone_context()
+SIZE = (40, 32)
+init = Init(size=SIZE, gl=GL)
+
+image = np.random.uniform(0.0, 1.0, (SIZE[0], SIZE[1], 4)).astype(np.float32)
+
+RAYMARCH_GRAPH = {
+    "size": [48, 48],
+    "nodes": {
+        "rm": {"op": "Raymarch", "args": {
+            "distance_field": "if (w_need_color) { w_color = vec3(1.0); } return sphere(p, 2.0);",
+            "caminfo": {"camera": {"u_campos": [0.0, 2.0, -6.0]}},
+            "steps": 24,
+        }},
+        "lit": {"op": "DeferredLight", "args": {
+            "bxdf": "return color * max(dot(normal, normalize(u_lightpos)), 0.0);",
+            "g_buffer": {"g_buffer": "rm"},
+            "lightinfo": {"light": {"u_lightpos": [2.0, 4.0, -3.0]}},
+            "caminfo": {"camera": {"u_campos": [0.0, 2.0, -6.0]}},
+        }},
+    },
+    "output": "lit",
+}
+
+
+def build_graph():
+    graph = Graph({"size": list(SIZE)})
+    grad = graph.add("grad", "Gradient", Gradient.GRAD_RAD_IN)
+    added = graph.add("added", "Add", grad, {"npy": "image.npy"})
+    graph.add("out", "Mix", in_a=added, in_b=0.25, in_c=[0.5, 0.5, 0.5, 0.5])
+    return graph
+
+
+class GraphTest(unittest.TestCase):
+
+    def test_graph_matches_code(self):
+        print("[+] Testing JSON graph against python graph")
+
+        with tempfile.TemporaryDirectory() as folder:
+            np.save(os.path.join(folder, "image.npy"), image)
+            graph = Graph.from_json(build_graph().to_json(), folder)
+            result = graph.render(init)
+
+        grad = Gradient().in_node(init, Gradient.GRAD_RAD_IN)
+        added = Add().in_node(init, grad, image)
+        expected = Mix().in_node(init, added, 0.25, (0.5, 0.5, 0.5, 0.5)).out_node()
+        np.testing.assert_allclose(result, expected, atol=1e-6)
+
+    def test_image_argument(self):
+        print("[+] Testing JSON graph image argument")
+
+        with tempfile.TemporaryDirectory() as folder:
+            npwrite(os.path.join(folder, "in.png"), image)
+            graph = Graph({"size": list(SIZE), "nodes": {
+                "out": {"op": "Multiply", "args": [{"image": "in.png"}, 1.0]},
+            }, "output": "out"}, folder)
+            result = graph.render(init)
+
+        np.testing.assert_allclose(result, image, atol=1.0 / 255.0 + 1e-6)
+
+    def test_raymarch_graph(self):
+        print("[+] Testing JSON graph with raymarch")
+
+        graph = Graph(RAYMARCH_GRAPH)
+        result = graph.render(graph.init())
+        self.assertEqual(result.shape, (48, 48, 4))
+        self.assertGreater(result[..., :3].max(), 0.0)
+
+        spec = dict(RAYMARCH_GRAPH, nodes=dict(RAYMARCH_GRAPH["nodes"]))
+        spec["nodes"]["lit"] = dict(spec["nodes"]["lit"], args=dict(spec["nodes"]["lit"]["args"], lights={
+            "point_lights": [{"position": [0.0, 0.0, -2.5], "color": [1.0, 0.5, 0.0], "radius": 2.0}]}))
+        lit = Graph(spec).render(graph.init())
+        self.assertGreater(lit[..., 0].sum(), result[..., 0].sum())
+
+        spec = dict(RAYMARCH_GRAPH, nodes=dict(RAYMARCH_GRAPH["nodes"]))
+        spec["nodes"]["bake"] = {"op": "BakeSDF", "args": {
+            "distance_field": spec["nodes"]["rm"]["args"]["distance_field"],
+            "box_min": [-2.5, -2.5, -2.5], "box_max": [2.5, 2.5, 2.5], "resolution": 33,
+        }}
+        spec["nodes"]["rm"] = dict(spec["nodes"]["rm"], args=dict(spec["nodes"]["rm"]["args"], distance_field={
+            "sdf": "bake"}))
+        baked = Graph(spec).render(graph.init())
+        self.assertLess(np.abs(baked - result).mean(), 0.01)
+
+    def test_errors(self):
+        print("[+] Testing JSON graph errors")
+
+        broken = {
+            "unknown op": {"a": {"op": "Blur", "args": []}},
+            "unknown node": {"a": {"op": "OneMinus", "args": [{"node": "b"}]}},
+            "cycle": {
+                "a": {"op": "OneMinus", "args": [{"node": "b"}]},
+                "b": {"op": "OneMinus", "args": [{"node": "a"}]},
+            },
+        }
+        for message, nodes in broken.items():
+            graph = Graph({"size": list(SIZE), "nodes": nodes, "output": "a"})
+            with self.assertRaises(Exception, msg=message):
+                graph.render(init)
+
+    def test_cli(self):
+        print("[+] Testing textureshop render")
+
+        with tempfile.TemporaryDirectory() as folder:
+            np.save(os.path.join(folder, "image.npy"), image)
+            build_graph().save(os.path.join(folder, "first.json"))
+            Graph(RAYMARCH_GRAPH).save(os.path.join(folder, "second.json"))
+
+            out_dir = os.path.join(folder, "out")
+            paths = [os.path.join(folder, name) for name in ("first.json", "second.json")]
+            self.assertEqual(main(["render", "-o", out_dir] + paths), 0)
+
+            self.assertEqual(np.asarray(ii.imread(os.path.join(out_dir, "first.png"))).shape, (40, 32, 4))
+            self.assertTrue(os.path.exists(os.path.join(out_dir, "second.png")))
+
+            self.assertEqual(main(["render", "--npy", "-o", out_dir, paths[0]]), 0)
+            result = np.load(os.path.join(out_dir, "first.npy"))
+            np.testing.assert_allclose(result, Graph.load(paths[0]).render(init), atol=1e-6)
+
+            self.assertEqual(main(["render", "-o", out_dir, os.path.join(folder, "missing.json")]), 1)
+
+            # single channel output is written as grayscale
+            Graph({
+                "size": [16, 16], "channels": 1, "output": "g",
+                "nodes": {"g": {"op": "Gradient", "args": {"grad_type": 4}}},
+            }).save(os.path.join(folder, "gray.json"))
+            self.assertEqual(main(["render", "-o", out_dir, os.path.join(folder, "gray.json")]), 0)
+            self.assertEqual(np.asarray(ii.imread(os.path.join(out_dir, "gray.png"))).shape, (16, 16))
+
+            # g-buffer of a Raymarch output is no image
+            Graph(dict(RAYMARCH_GRAPH, output="rm")).save(os.path.join(folder, "g_buffer.json"))
+            with self.assertRaises(ValueError):
+                Graph.load(os.path.join(folder, "g_buffer.json")).render(init)
+            self.assertEqual(main(["render", "-o", out_dir, os.path.join(folder, "g_buffer.json")]), 1)
+            self.assertFalse(os.path.exists(os.path.join(out_dir, "g_buffer.png")))
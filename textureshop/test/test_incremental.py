@@ -0,0 +1,138 @@
+import time
+import unittest
+from unittest import mock
+
+import moderngl as mg
+import numpy as np
+
+from ..op_base import Base, Init
+from ..op_math import Add, Multiply, Clamp
+from ..op_mix import Mix, Rotate
+from ..op_noise import FBMNoise, Gradient
+
+
+GL = mg.create_standalone_context()
+SIZE = (64, 48)
+init = Init(size=SIZE, gl=GL)
+
+noise = np.random.uniform(0.0, 1.0, (32, 32, 4)).astype(np.float32)
+image = np.random.uniform(0.0, 1.0, (SIZE[0], SIZE[1], 4)).astype(np.float32)
+
+
+def build(max_value=0.75, z=0.5, octaves=4, scale=0.5):
+    fbm = FBMNoise().in_node(init, noise, octaves)
+    grad = Gradient().in_node(init, Gradient.GRAD_RAD_OUT)
+    clamp = Clamp().in_node(init, Add().in_node(init, fbm, grad), 0.0, max_value)
+    rotate = Rotate().in_node(init, clamp, z)
+    out = Mix().in_node(init, rotate, image, scale)
+    return {"fbm": fbm, "grad": grad, "clamp": clamp, "rotate": rotate, "out": out}
+
+
+def counting(name):
+    """ patch Base method, calls still go through """
+    return mock.patch.object(Base, name, autospec=True, side_effect=getattr(Base, name))
+
+
+class IncrementalTest(unittest.TestCase):
+
+    def test_clean_graph(self):
+        print("[+] Testing clean graph is not dispatched again")
+
+        nodes = build()
+        first = nodes["out"].out_node()
+        self.assertFalse(any(node.dirty for node in nodes.values()))
+
+        with counting("dispatch") as dispatch:
+            np.testing.assert_array_equal(nodes["out"].out_node(), first)
+        dispatch.assert_not_called()
+
+    def test_uniform_changes(self):
+        print("[+] Testing uniform changes re-run dirty nodes only")
+
+        nodes = build()
+        nodes["out"].out_node()
+        misses = Base.PROGRAM_CACHE.stats()["misses"]
+
+        with counting("dispatch") as dispatch, counting("get_cs") as get_cs:
+            nodes["clamp"].set_range(max_value=0.5)
+            self.assertFalse(nodes["fbm"].dirty)
+            self.assertTrue(nodes["rotate"].dirty)
+            result = nodes["out"].out_node()
+        get_cs.assert_not_called()
+        self.assertEqual([type(c[0][0]) for c in dispatch.call_args_list], [Clamp, Rotate, Mix])
+        np.testing.assert_allclose(result, build(max_value=0.5)["out"].out_node(), atol=1e-6)
+
+        with counting("dispatch") as dispatch, counting("get_cs") as get_cs:
+            nodes["rotate"].set_angle(1.25)
+            result = nodes["out"].out_node()
+        get_cs.assert_not_called()
+        self.assertEqual(dispatch.call_count, 2)
+        np.testing.assert_allclose(result, build(max_value=0.5, z=1.25)["out"].out_node(), atol=1e-6)
+
+        with counting("get_cs") as get_cs:
+            nodes["fbm"].set_octaves(6)
+            nodes["out"].set_input("c", 0.25)
+            result = nodes["out"].out_node()
+        get_cs.assert_not_called()
+        expected = build(max_value=0.5, z=1.25, octaves=6, scale=0.25)["out"].out_node()
+        np.testing.assert_allclose(result, expected, atol=1e-6)
+
+        self.assertEqual(Base.PROGRAM_CACHE.stats()["misses"], misses)
+
+    def test_input_changes(self):
+        print("[+] Testing input changes respecialize")
+
+        nodes = build()
+        nodes["out"].out_node()
+
+        # constant replaced by a node goes through the program cache
+        nodes["out"].set_input("c", nodes["grad"])
+        expected = Mix().in_node(init, nodes["rotate"], image, nodes["grad"]).out_node()
+        np.testing.assert_allclose(nodes["out"].out_node(), expected, atol=1e-6)
+
+        # extra uniforms survive respecialization
+        nodes["clamp"].set_input("a", image)
+        clamp = Clamp().in_node(init, image, 0.0, 0.75)
+        np.testing.assert_allclose(nodes["clamp"].out_node(), clamp.out_node(), atol=1e-6)
+
+        with self.assertRaises(Exception):
+            nodes["clamp"].set_input("c", 1.0)
+
+    def test_volatile_input(self):
+        print("[+] Testing nodes reading volatile nodes stay dirty")
+
+        class Volatile(Add):
+            CACHEABLE = False
+
+        volatile = Volatile().in_node(init, image, 0.5)
+        out = Multiply().in_node(init, volatile, 2.0)
+        out.out_node()
+        self.assertTrue(volatile.dirty)
+        self.assertTrue(out.dirty)
+
+        with counting("dispatch") as dispatch:
+            out.out_node()
+        self.assertEqual(dispatch.call_count, 2)
+
+    def test_latency(self):
+        print("[+] Testing incremental update latency")
+
+        node = FBMNoise().in_node(init, noise, 4)
+        chain = []
+        for n in range(100):
+            node = Add().in_node(init, node, 0.001)
+            chain.append(node)
+        chain[-1].out_node()
+
+        start = time.perf_counter()
+        chain[-3].set_input("b", 0.002)
+        chain[-1].texture()
+        incremental = time.perf_counter() - start
+
+        start = time.perf_counter()
+        chain[0].set_input("b", 0.002)
+        chain[-1].texture()
+        full = time.perf_counter() - start
+        print("[+] 100 node graph, last nodes {:.2f} ms, whole chain {:.2f} ms".format(
+            incremental * 1000.0, full * 1000.0))
+        self.assertFalse(chain[-1].dirty)
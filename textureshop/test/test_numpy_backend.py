@@ -0,0 +1,134 @@
+import unittest
+
+import moderngl as mg
+import numpy as np
+
+from ..op_base import Init
+from ..op_fusion import Fused
+from ..op_math import Num, Add, Multiply, Divide, Clamp, OneMinus, Sin, Cos, Tan, Asin, Acos, Atan2, SinH, CosH, TanH, Power, Log_Natural, Log_2
+from ..op_mix import Mix, Smoothstep, Rotate
+from ..op_noise import FBMNoise, Gradient
+from ..op_raymarch import DeferredLight, GBuffer
+
+
+GL = mg.create_standalone_context()
+init_gl = Init(size=(32, 32), gl=GL)
+init_np = Init(size=(32, 32), backend="numpy")
+
+
+def both(node_type, *args, **kargs):
+    gl_out = node_type().in_node(init_gl, *args, **kargs).out_node()
+    np_out = node_type().in_node(init_np, *args, **kargs).out_node()
+    return gl_out, np_out
+
+
+class NumpyBackendTest(unittest.TestCase):
+
+    def test_no_context(self):
+        print("[+] Testing numpy backend without GL")
+
+        self.assertIsNone(init_np.gl)
+        add = Add().in_node(init_np, 0.25, 0.5)
+        self.assertIsNone(add.cs)
+
+        out = add.out_node()
+        self.assertIsInstance(out, np.ndarray)
+        self.assertEqual(out.shape, (32, 32, 4))
+        assert np.all(np.isclose(out, 0.75))
+
+    def test_math(self):
+        print("[+] Testing numpy math ops against GL")
+
+        PATIENCE = 1e-4
+
+        in_a = np.random.uniform(0.1, 0.9, (32, 32, 4))
+        in_b = np.random.uniform(0.1, 0.9, (32, 32, 4))
+
+        for node_type in (Add, Multiply, Divide, Atan2, Power):
+            gl_out, np_out = both(node_type, in_a, in_b)
+            assert np.all(np.isclose(gl_out, np_out, atol=PATIENCE)), node_type.__name__
+
+        for node_type in (OneMinus, Sin, Cos, Tan, SinH, CosH, TanH, Log_Natural, Log_2):
+            gl_out, np_out = both(node_type, in_a)
+            assert np.all(np.isclose(gl_out, np_out, atol=PATIENCE)), node_type.__name__
+
+        # some drivers have low precision arc functions
+        for node_type in (Asin, Acos):
+            gl_out, np_out = both(node_type, in_a)
+            assert np.all(np.isclose(gl_out, np_out, atol=1e-3)), node_type.__name__
+
+        gl_out, np_out = both(Clamp, in_a, 0.3, 0.6)
+        assert np.all(np.isclose(gl_out, np_out, atol=PATIENCE))
+
+        gl_out, np_out = both(Add, in_a, (0.1, 0.2, 0.3, 0.4))
+        assert np.all(np.isclose(gl_out, np_out, atol=PATIENCE))
+
+    def test_mix(self):
+        print("[+] Testing numpy mix ops against GL")
+
+        PATIENCE = 1e-4
+
+        in_a = np.random.uniform(0.0, 0.4, (32, 32, 4))
+        in_b = np.random.uniform(0.6, 1.0, (32, 32, 4))
+        in_c = np.random.uniform(0.0, 1.0, (32, 32, 4))
+
+        for node_type in (Mix, Smoothstep):
+            gl_out, np_out = both(node_type, in_a, in_b, in_c)
+            assert np.all(np.isclose(gl_out, np_out, atol=PATIENCE)), node_type.__name__
+
+        gl_out, np_out = both(Rotate, in_a, 0.5)
+        assert np.all(np.isclose(gl_out, np_out, atol=PATIENCE))
+
+    def test_chain(self):
+        print("[+] Testing numpy node chains and fused graph")
+
+        in_a = np.random.uniform(0.0, 1.0, (32, 32, 4))
+        outputs = []
+        for init in (init_gl, init_np):
+            add = Add().in_node(init, in_a, Num(value=0.5))
+            clamp = Clamp().in_node(init, add, 0.0, 1.0)
+            mix = Mix().in_node(init, clamp, 0.0, 0.5)
+            outputs.append(Fused().in_node(init, mix).out_node())
+        assert np.all(np.isclose(outputs[0], outputs[1], atol=1e-5))
+
+    def test_gradient(self):
+        print("[+] Testing numpy gradient against GL")
+
+        for grad_type in range(6):
+            gl_out, np_out = both(Gradient, grad_type)
+            assert np.all(np.isclose(gl_out, np_out, atol=1e-5)), grad_type
+
+    def test_fbm(self):
+        print("[+] Testing numpy fbm noise against GL")
+
+        noise = np.random.uniform(0.0, 1.0, (32, 32, 4))
+        gl_out, np_out = both(FBMNoise, noise)
+
+        # hardware bilinear weights are low precision
+        assert np.all(np.isclose(gl_out, np_out, atol=1e-2))
+
+    def test_deferred_light(self):
+        print("[+] Testing numpy deferred light")
+
+        g_buffer = GBuffer()
+        g_buffer.depth = np.ones((32, 32), dtype=np.float32)
+        g_buffer.color = np.ones((32, 32, 4), dtype=np.float32) * 0.5
+        g_buffer.normal = np.zeros((32, 32, 4), dtype=np.float32)
+        g_buffer.normal[..., 1] = 1.0
+        g_buffer.shadow = np.ones((32, 32), dtype=np.float32)
+
+        def bxdf(depth, color, normal, shadow, uniforms):
+            light = np.array(uniforms["u_lightpos"], dtype=np.float32)
+            light /= np.linalg.norm(light)
+            ndl = np.maximum(np.sum(normal * light, axis=-1), 0.0)
+            return color * (ndl * shadow)[..., None]
+
+        out = DeferredLight().in_node(init_np, bxdf, g_buffer).out_node()
+        self.assertEqual(out.shape, (32, 32, 4))
+        assert np.all(out[..., 3] == 1.0)
+        assert np.all(np.isclose(out[..., 0], out[0, 0, 0]))
+        self.assertGreater(out[0, 0, 0], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import gc
+import unittest
+
+import moderngl as mg
+import numpy as np
+
+from ..op_base import Base, Init, ProgramCache, BufferPool
+from ..op_math import Add, Multiply, Clamp
+from ..op_noise import Gradient
+
+
+GL = mg.create_standalone_context()
+init = Init(size=(4, 4), gl=GL)
+
+
+class ProgramCacheTest(unittest.TestCase):
+
+    def test_program_reuse(self):
+        print("[+] Testing compiled program cache")
+
+        add_a = Add().in_node(init, 0.1, 0.2)
+        hits = Base.PROGRAM_CACHE.hits
+        add_b = Add().in_node(init, 0.3, 0.4)
+
+        self.assertIs(add_a.cs, add_b.cs)
+        self.assertEqual(Base.PROGRAM_CACHE.hits, hits + 1)
+
+        assert np.all(np.isclose(add_a.out_node(), 0.3))
+        assert np.all(np.isclose(add_b.out_node(), 0.7))
+
+    def test_sizes_share_program(self):
+        print("[+] Testing shared program over different sizes")
+
+        init_small = Init(size=(4, 4), gl=GL)
+        init_large = Init(size=(64, 64), gl=GL)
+
+        small = Gradient().in_node(init_small, Gradient.GRAD_HOR_LEFT)
+        large = Gradient().in_node(init_large, Gradient.GRAD_HOR_LEFT)
+        self.assertIs(small.cs, large.cs)
+
+        # run in both orders so stale size uniforms would show up
+        out_large = large.out_node()
+        out_small = small.out_node()
+        self.assertAlmostEqual(float(out_small[0, 2, 0]), 0.5)
+        self.assertAlmostEqual(float(out_large[0, 32, 0]), 0.5)
+
+    def test_lru_eviction(self):
+        print("[+] Testing program cache eviction")
+
+        cache = ProgramCache(capacity=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+        stats = cache.stats()
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["hits"], 3)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_eviction_release(self):
+        print("[+] Testing evicted programs are released once unused")
+
+        cache, Base.PROGRAM_CACHE = Base.PROGRAM_CACHE, ProgramCache(capacity=1)
+        try:
+            data = np.ones((4, 4, 4))
+            add = Add().in_node(init, data, data)
+            clamp = Clamp().in_node(init, data, 0.0, 1.0)
+            self.assertEqual(Base.PROGRAM_CACHE.stats()["retired"], 1)
+
+            # still held by add
+            Multiply().in_node(init, data, data)
+            stats = Base.PROGRAM_CACHE.stats()
+            self.assertEqual((stats["releases"], stats["retired"]), (0, 2))
+            np.testing.assert_allclose(add.out_node(), 2.0)
+
+            # programs of clamp and the dropped multiply are unused, add's is still held here
+            program = add.cs
+            del add, clamp
+            gc.collect()
+            Add().in_node(init, data, 0.5)
+            stats = Base.PROGRAM_CACHE.stats()
+            self.assertEqual((stats["releases"], stats["retired"]), (2, 1))
+
+            del program
+            gc.collect()
+            Clamp().in_node(init, data, 0.0, 1.0)
+            stats = Base.PROGRAM_CACHE.stats()
+            self.assertEqual((stats["releases"], stats["retired"]), (4, 0))
+        finally:
+            Base.PROGRAM_CACHE = cache
+
+
+class BufferPoolTest(unittest.TestCase):
+
+    def test_size_class(self):
+        print("[+] Testing buffer pool size classes")
+
+        self.assertEqual(BufferPool.size_class(1), BufferPool.MIN_SIZE)
+        self.assertEqual(BufferPool.size_class(4096), 4096)
+        self.assertEqual(BufferPool.size_class(4097), 4096 + 1024)
+        for nbytes in (300, 1000, 5000, 123457):
+            size = BufferPool.size_class(nbytes)
+            assert nbytes <= size <= nbytes * 1.25 + 1
+
+    def test_steady_state(self):
+        print("[+] Testing pooled buffers are recycled")
+
+        pool = BufferPool.of(GL)
+
+        def render():
+            add = Add().in_node(init, 0.25, 0.5)
+            mult = Multiply().in_node(init, add, 2.0)
+            clamp = Clamp().in_node(init, mult, 0.0, 1.0)
+            return clamp.out_node()
+
+        # first run fills the pool, nodes are collected on return
+        assert np.all(np.isclose(render(), 1.0))
+        allocations = pool.stats()["allocations"]
+
+        for _ in range(10):
+            assert np.all(np.isclose(render(), 1.0))
+
+        stats = pool.stats()
+        self.assertEqual(stats["allocations"], allocations)
+        self.assertGreater(stats["reuses"], 0)
+
+    def test_release(self):
+        print("[+] Testing explicit node release")
+
+        pool = BufferPool.of(GL)
+        add = Add().in_node(init, 0.25, 0.5)
+        in_use = pool.stats()["in_use"]
+
+        add.release()
+        self.assertEqual(pool.stats()["in_use"], in_use - 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
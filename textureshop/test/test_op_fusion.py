@@ -0,0 +1,84 @@
+import unittest
+
+import moderngl as mg
+import numpy as np
+
+from ..op_base import Init
+from ..op_fusion import Fused
+from ..op_math import Add, Multiply, Clamp, Sin, Power
+from ..op_mix import Mix, Smoothstep
+from ..op_noise import Gradient
+
+
+GL = mg.create_standalone_context()
+init = Init(size=(4, 4), gl=GL)
+
+
+class FusionTest(unittest.TestCase):
+
+    def test_chain(self):
+        print("[+] Testing fused add -> multiply -> clamp -> mix")
+
+        PATIENCE = 1e-5
+
+        in_a = np.random.uniform(0.0, 1.0, (4, 4, 4))
+        in_b = np.random.uniform(0.0, 1.0, (4, 4, 4))
+
+        add = Add().in_node(init, in_a, in_b)
+        mult = Multiply().in_node(init, add, 0.75)
+        clamp = Clamp().in_node(init, mult, 0.1, 0.9)
+        mix = Mix().in_node(init, clamp, in_b, 0.25)
+
+        fused = Fused().in_node(init, mix)
+        self.assertEqual(fused.num_fused, 4)
+
+        out = fused.out_node()
+        assert np.all(np.isclose(out, mix.out_node(), atol=PATIENCE))
+
+        np_out = np.clip((in_a + in_b) * 0.75, 0.1, 0.9)
+        np_out = np_out * 0.75 + in_b * 0.25
+        assert np.all(np.isclose(out, np_out, atol=PATIENCE))
+
+    def test_dag(self):
+        print("[+] Testing fused DAG with shared nodes")
+
+        PATIENCE = 1e-5
+
+        in_a = np.random.uniform(0.0, 1.0, (4, 4, 4))
+
+        sin = Sin().in_node(init, in_a)
+        power = Power().in_node(init, sin, 2.0)
+        smooth = Smoothstep().in_node(init, sin, 1.0, power)
+
+        fused = Fused().in_node(init, smooth)
+        self.assertEqual(fused.num_fused, 3)
+
+        out = fused.out_node()
+        assert np.all(np.isclose(out, smooth.out_node(), atol=PATIENCE))
+
+    def test_changes(self):
+        print("[+] Testing fused node follows changes of fused nodes")
+
+        in_a = np.random.uniform(0.0, 1.0, (4, 4, 4))
+
+        grad = Gradient().in_node(init, Gradient.GRAD_RAD_OUT)
+        add = Add().in_node(init, grad, in_a)
+        clamp = Clamp().in_node(init, add, 0.0, 0.75)
+        mult = Multiply().in_node(init, clamp, 0.5)
+        fused = Fused().in_node(init, mult)
+        np.testing.assert_allclose(fused.out_node(), mult.out_node(), atol=1e-5)
+
+        clamp.set_range(0.0, 0.6)
+        np.testing.assert_allclose(fused.out_node(), mult.out_node(), atol=1e-5)
+
+        grad.in_node(init, Gradient.GRAD_RAD_IN)
+        np.testing.assert_allclose(fused.out_node(), mult.out_node(), atol=1e-5)
+
+        # constant replaced by a node changes the fused program
+        mult.set_input("b", grad)
+        self.assertEqual(len(fused.inputs()), 2)
+        np.testing.assert_allclose(fused.out_node(), mult.out_node(), atol=1e-5)
+
+
+if __name__ == "__main__":
+    unittest.main()
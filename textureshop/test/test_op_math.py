@@ -259,5 +259,31 @@ class OperationTest(unittest.TestCase):
         assert np.all(np.isclose(log2_b, np.log2(22.23)))
 
 
+class ConstantTest(unittest.TestCase):
+
+    def test_uniform_broadcast(self):
+        print("[+] Testing scalar/vec4 constants as uniforms")
+
+        add = Add().in_node(init, 0.25, (0.0, 0.1, 0.2, 0.3))
+        self.assertEqual(add.in_a, (0.25, 0.25, 0.25, 0.25))
+        self.assertEqual(add.uniforms["u_b"], (0.0, 0.1, 0.2, 0.3))
+
+        out = add.out_node()
+        assert np.all(np.isclose(out[0, 0], [0.25, 0.35, 0.45, 0.55]))
+
+    def test_num_lazy(self):
+        print("[+] Testing Num as lazy constant")
+
+        num = Num(value=0.5)
+        mult = Multiply().in_node(init, num, 3.0)
+        self.assertEqual(mult.in_a, (0.5, 0.5, 0.5, 0.5))
+        self.assertEqual(mult.out_node()[0, 0, 0], np.float32(1.5))
+
+        # mixing constant and image inputs
+        image = np.multiply(np.ones((1, 1, 4)), 2.0)
+        mult = Multiply().in_node(init, image, num)
+        self.assertEqual(mult.out_node()[0, 0, 0], np.float32(1.0))
+
+
 if __name__ == "__main__":
     unittest.main()
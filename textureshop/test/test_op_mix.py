@@ -3,7 +3,8 @@ import unittest
 import moderngl as mg
 import numpy as np
 
-from ..op_base import Init
+from ..op_base import Init, TextureHandle
+from ..op_math import Add, Multiply, Clamp
 from ..op_mix import Mix, Smoothstep, Rotate
 from ..op_noise import FBMNoise, Gradient
 from .. util import npwrite
@@ -42,6 +43,28 @@ class OperationTest(unittest.TestCase):
         np_smoothstep_a = numpy_smoothstep(in_a, in_b, in_c)
         assert np.all(np.isclose(smoothstep_a, np_smoothstep_a, atol=PATIENCE))
 
+    def test_gpu_resident_chain(self):
+        print("[+] Testing add -> multiply -> clamp -> mix on GPU")
+
+        in_a = np.multiply(np.ones((2, 2, 4)), 0.4)
+
+        add = Add().in_node(init, in_a, 0.2)
+        mult = Multiply().in_node(init, add, 2.0)
+        clamp = Clamp().in_node(init, mult, 0.0, 1.0)
+        mix = Mix().in_node(init, clamp, 0.0, 0.5)
+
+        handle = mix.out_texture()
+        self.assertIsInstance(handle, TextureHandle)
+        self.assertEqual(handle.shape, (2, 2, 4))
+
+        # upstream outputs stay on GPU as handles too
+        self.assertIsInstance(clamp.out_texture(), TextureHandle)
+
+        out = np.asarray(handle)
+        assert np.all(np.isclose(out, 0.5))
+        assert np.isclose(handle[0, 0, 0], 0.5)
+        assert np.all(np.isclose(mix.out_node(), out))
+
     def test_rotate(self):
         print("[+] Testing rotate.. (requires Gradient to be already working)")
 
@@ -46,6 +46,46 @@ class NoiseTest(unittest.TestCase):
         ii.imwrite("fbm_a.png", debug_fbm_a)
         print("\t[+][+] output fbm_a.png generated.")
 
+    def test_noisetex(self):
+        print("[+] Testing FBM noise texture reuse")
+
+        def released(texture):
+            return isinstance(texture.mglo, mg.InvalidObject)
+
+        noise = np.random.uniform(0.0, 1.0, (init.W, init.H, 4)).astype(np.float32)
+        fbm = FBMNoise().in_node(init, noise)
+        first = fbm.out_node()
+        texture = fbm.u_noise_tex
+
+        # same size is written into the node's texture
+        fbm.set_noisetex(1.0 - noise)
+        self.assertIs(fbm.u_noise_tex, texture)
+        assert not np.allclose(fbm.out_node(), first)
+        fbm.set_noisetex(noise)
+        np.testing.assert_allclose(fbm.out_node(), first, atol=1e-6)
+
+        fbm.set_noisetex(noise[:128, :128])
+        assert released(texture)
+
+        # textures of the caller are never released
+        given = GL.texture((init.W, init.H), 4, noise.tobytes(), dtype="f4")
+        texture = fbm.u_noise_tex
+        fbm.set_noisetex(given)
+        assert released(texture)
+        np.testing.assert_allclose(fbm.out_node(), first, atol=1e-6)
+        fbm.set_noisetex(noise)
+        assert not released(given)
+        given.release()
+
+    def test_compact_noisetex(self):
+        print("[+] Testing FBM noise from 1 channel and f16 nodes")
+
+        for channels, precision in ((1, "f32"), (4, "f16"), (1, "f16")):
+            grad = Gradient(channels=channels, precision=precision).in_node(init, Gradient.GRAD_RAD_OUT)
+            from_node = FBMNoise().in_node(init, grad).out_node()
+            from_array = FBMNoise().in_node(init, grad.out_node()).out_node()
+            np.testing.assert_allclose(from_node, from_array, atol=1e-6, err_msg=str((channels, precision)))
+
     def test_gaussian_blur(self):
         # TODO: write test
         print("Gaussian Blur test case not exists")
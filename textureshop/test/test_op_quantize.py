@@ -0,0 +1,118 @@
+import os
+import tempfile
+import unittest
+
+import imageio as ii
+import moderngl as mg
+import numpy as np
+
+from ..op_base import Init
+from ..op_math import Multiply
+from ..op_quantize import Quantize, quantize
+from ..util import npwrite
+
+
+GL = mg.create_standalone_context()
+init = Init(size=(40, 24), gl=GL)
+
+
+class QuantizeTest(unittest.TestCase):
+
+    def test_formats(self):
+        print("[+] Testing GPU quantize against CPU")
+
+        data = np.random.uniform(-0.2, 1.2, (40, 24, 4)).astype(np.float32)
+        node = Multiply().in_node(init, data, 1.0)
+
+        cases = (
+            ("rgba8", None), ("rgb8", "bgr"), ("r8", "a"),
+            ("rg16", None), ("r16", "g"), ("rgba16", None))
+        for fmt, channels in cases:
+            for flip in (False, True):
+                gpu = Quantize().in_node(init, node, fmt, channels, flip).out_node()
+                cpu = quantize(data, fmt, channels, flip)
+                self.assertEqual(gpu.dtype, cpu.dtype)
+                self.assertEqual(gpu.shape, cpu.shape)
+                assert np.all(gpu == cpu), (fmt, channels, flip)
+
+        with self.assertRaises(Exception):
+            Quantize().in_node(init, node, "rg8", "rgb")
+
+    def test_packed_readback(self):
+        print("[+] Testing only packed bytes are read back")
+
+        data = np.random.uniform(0.0, 1.0, (40, 24, 4)).astype(np.float32)
+        node = Quantize().in_node(init, data, "r8")
+        self.assertEqual(len(node.out_bytes()), 40 * 24)
+        self.assertEqual(node.select, [0])
+        self.assertEqual(node.channels, init.channels)
+
+        # same bytes as former CPU serialization
+        expected = np.multiply(data[::-1], 255.0).astype(np.uint8)
+        out = quantize(Multiply().in_node(init, data, 1.0).out_texture(), flip=True)
+        assert np.all(out == expected)
+
+    def test_batch(self):
+        print("[+] Testing batched quantize")
+
+        init_batch = Init(size=(40, 24), gl=GL, batch=3)
+        data = np.random.uniform(0.0, 1.0, (3, 40, 24, 4)).astype(np.float32)
+        node = Multiply().in_node(init_batch, data, 1.0)
+        out = quantize(node, "rg8", flip=True)
+        self.assertEqual(out.shape, (3, 40, 24, 2))
+        for n in range(3):
+            assert np.all(out[n] == quantize(data[n], "rg8", flip=True))
+
+    def test_npwrite(self):
+        print("[+] Testing npwrite from node")
+
+        data = np.random.uniform(0.0, 1.0, (40, 24, 4)).astype(np.float32)
+        node = Multiply().in_node(init, data, 1.0)
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "out.png")
+            npwrite(path, node)
+            assert np.all(ii.imread(path) == quantize(data, flip=True))
+
+            npwrite(path, node, "r8", "g")
+            assert np.all(ii.imread(path) == quantize(data, "r8", "g", flip=True)[..., 0])
+
+    def test_npwrite_arrays(self):
+        print("[+] Testing npwrite from 2D, 1 and 3 channel arrays")
+
+        data = np.random.uniform(0.0, 1.0, (40, 24, 4)).astype(np.float32)
+        expected = quantize(data, flip=True)
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "out.png")
+            npwrite(path, data[..., 0])
+            assert np.all(ii.imread(path) == expected[..., 0])
+
+            npwrite(path, data[..., :1])
+            assert np.all(ii.imread(path) == expected[..., 0])
+
+            npwrite(path, data[..., :3])
+            assert np.all(ii.imread(path) == expected[..., :3])
+
+        # rgba of 1 channel is rrr1 like a shader loads it, 3 channels get opaque alpha
+        rgba = quantize(data[..., :1])
+        assert np.all(rgba[..., :3] == quantize(data, "r8")) and np.all(rgba[..., 3] == 255)
+        assert np.all(quantize(data[..., :3])[..., 3] == 255)
+
+    def test_npwrite_single_channel_node(self):
+        print("[+] Testing npwrite from single channel node")
+
+        data = np.random.uniform(0.0, 1.0, (40, 24, 4)).astype(np.float32)
+        node = Multiply(channels=1).in_node(init, data, 1.0)
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "out.png")
+            npwrite(path, node.out_node())
+            assert np.all(ii.imread(path) == quantize(data, "r8", flip=True)[..., 0])
+
+            npwrite(path, node)
+            assert np.all(ii.imread(path)[..., 0] == quantize(data, "r8", flip=True)[..., 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
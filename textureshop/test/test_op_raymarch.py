@@ -1,15 +1,445 @@
 import math
+import os
+import tempfile
+import time
 import unittest
+from unittest import mock
 
 import imageio as ii
+import numpy as np
 
 from ..op_base import Init
-from ..op_raymarch import Raymarch, DeferredLight, LightInfo, CameraInfo
-from ..util import npappend
+from ..op_quantize import Quantize
+from ..op_raymarch import (
+    Raymarch, LitRaymarch, DeferredLight, BakeSDF, LightInfo, CameraInfo, PointLight, look_matrix)
+from ..readback import ReadbackQueue
+
+
+SPHERES_DF = """
+float d = FAR;
+if (bound_hit(0)) { d = min(d, sphere(p - vec3(-3.0, 0.0, 0.0), 1.0)); }
+if (bound_hit(1)) { d = min(d, sphere(p - vec3(3.0, 0.0, 0.0), 1.0)); }
+if (bound_hit(2)) { d = min(d, box(p - vec3(0.0, 0.0, 4.0), vec3(1.0))); }
+if (w_need_color) { w_color = vec3(1.0); }
+return d;
+"""
+
+SPHERES_BOUNDS = [
+    ("sphere", (-3.0, 0.0, 0.0), 1.05),
+    ("sphere", (3.0, 0.0, 0.0), 1.05),
+    ("box", (-1.05, -1.05, 2.95), (1.05, 1.05, 5.05)),
+]
+
+# costly to evaluate per step
+BUMPY_DF = """
+float d = sphere(p, 1.5);
+for (int k = 1; k <= 24; k++)
+{
+    float f = float(k) * 1.7;
+    d += sin(p.x * f) * sin(p.y * f) * sin(p.z * f) * 0.03 / float(k);
+}
+if (w_need_color) { w_color = vec3(1.0, 0.5, 0.2); }
+return d * 0.8;
+"""
+
+
+SIMPLE_BXDF = "return color * (0.2 + max(dot(normal, normalize(u_lightpos)), 0.0)) * mix(1.0, shadow, 0.5);"
+
+
+def orbit_camera(t):
+    caminfo = CameraInfo()
+    caminfo.u_campos = (math.sin(t) * 5.0, 2.0, -math.cos(t) * 5.0)
+    return caminfo
+
+
+def depth_of(node):
+    data = np.frombuffer(node.depth.read(size=node.W * node.H * 4), dtype=np.float32)
+    return data.reshape((node.W, node.H))
 
 
 class RaymarchTest(unittest.TestCase):
 
+    def test_accelerated(self):
+        print("[+] Testing accelerated sphere tracing")
+
+        init = Init((128, 128))
+        caminfo = CameraInfo()
+        caminfo.u_campos = (0.0, 2.0, -4.0)
+
+        plain = Raymarch().in_node(init, SPHERES_DF, caminfo=caminfo, steps=96, count_steps=True)
+        fast = Raymarch().in_node(
+            init, SPHERES_DF, caminfo=caminfo, steps=96, relaxation=1.6,
+            bounds=SPHERES_BOUNDS, count_steps=True)
+        plain.out_node()
+        fast.out_node()
+
+        # grazing rays running out of steps count as hits on plain tracing
+        converged = plain.step_counts() < 96
+        expected, depth = depth_of(plain)[converged], depth_of(fast)[converged]
+        hit = expected < 50.0
+        self.assertGreater(hit.mean(), 0.05)
+        np.testing.assert_array_equal(depth < 50.0, hit)
+        np.testing.assert_allclose(depth[hit], expected[hit], atol=1e-2)
+
+        relaxed = Raymarch().in_node(init, SPHERES_DF, caminfo=caminfo, steps=96, relaxation=1.6)
+        relaxed.out_node()
+        np.testing.assert_array_equal(depth_of(relaxed)[converged] < 50.0, hit)
+
+        plain_steps, fast_steps = plain.steps_per_pixel(), fast.steps_per_pixel()
+        print("[+] steps per pixel: plain {:.1f}, accelerated {:.1f}".format(plain_steps, fast_steps))
+        self.assertLess(fast_steps, plain_steps)
+
+        with self.assertRaises(Exception):
+            Raymarch().in_node(init, SPHERES_DF, relaxation=2.0)
+        with self.assertRaises(Exception):
+            Raymarch().in_node(init, SPHERES_DF, bounds=[("cone", (0.0, 0.0, 0.0), 1.0)])
+        with self.assertRaises(Exception):
+            plain.set_bounds([])
+        with self.assertRaises(Exception):
+            Raymarch().in_node(init, SPHERES_DF).step_counts()
+
+    def test_reconstruct(self):
+        print("[+] Testing reduced raymarch with temporal reprojection")
+
+        init = Init((256, 256))
+        for options in ({"subsample": 2}, {"checkerboard": True}):
+            full = Raymarch().in_node(init, SPHERES_DF, steps=96)
+            fast = Raymarch().in_node(init, SPHERES_DF, steps=96, count_steps=True, **options)
+            full_light = DeferredLight().in_node(init, SIMPLE_BXDF, full.g_buffer)
+            fast_light = DeferredLight().in_node(init, SIMPLE_BXDF, fast.g_buffer)
+
+            # moving camera, reprojected pixels stay close to a full trace
+            for i in range(8):
+                caminfo = orbit_camera(i * 0.05)
+                for node in (full, fast, full_light, fast_light):
+                    node.set_caminfo(caminfo)
+                full.out_node()
+                fast.out_node()
+                error = np.abs(full_light.out_node() - fast_light.out_node())[..., :3].max(-1)
+                self.assertLess(error.mean(), 0.01)
+                self.assertLess((error > 0.1).mean(), 0.02)
+            self.assertEqual(fast.traced_mask().mean(), fast.traced_fraction)
+
+            # still camera converges to the full trace once every pixel was traced
+            for i in range(4):
+                fast.out_node()
+            np.testing.assert_allclose(fast_light.out_node(), full_light.out_node(), atol=1e-5)
+
+        with self.assertRaises(Exception):
+            Raymarch().in_node(init, SPHERES_DF, subsample=2, checkerboard=True)
+
+        # same frame rate comparison as test_raymarch scene size
+        init = Init((512, 512))
+        for options in ({}, {"subsample": 2}, {"checkerboard": True}):
+            node = Raymarch().in_node(init, SPHERES_DF, steps=96, **options)
+            node.out_node()
+            depth_of(node)
+            start = time.perf_counter()
+            for i in range(20):
+                node.set_caminfo(orbit_camera(i * 0.05))
+                node.out_node()
+            depth_of(node)
+            print("[+] {} {:.1f} fps".format(options or "full", 20 / (time.perf_counter() - start)))
+
+    def test_packed_g_buffer(self):
+        print("[+] Testing packed g-buffer")
+
+        init = Init((128, 128))
+        caminfo = orbit_camera(0.3)
+        nodes = {
+            layout: Raymarch().in_node(init, SPHERES_DF, caminfo=caminfo, steps=96, g_buffer_layout=layout)
+            for layout in ("float", "packed")}
+        lights = {
+            layout: DeferredLight().in_node(init, SIMPLE_BXDF, node.out_node(), caminfo=caminfo)
+            for layout, node in nodes.items()}
+
+        expected, packed = nodes["float"].g_buffer.read(), nodes["packed"].g_buffer.read()
+        hit = expected["depth"] < 50.0
+        self.assertGreater(hit.mean(), 0.05)
+        np.testing.assert_array_equal(packed["depth"], expected["depth"])
+        np.testing.assert_allclose(packed["color"], expected["color"], atol=0.5 / 255.0 + 1e-6)
+        np.testing.assert_allclose(packed["shadow"], expected["shadow"], atol=0.5 / 255.0 + 1e-6)
+        np.testing.assert_allclose(packed["normal"][hit], expected["normal"][hit], atol=1e-3)
+
+        error = np.abs(lights["packed"].out_node() - lights["float"].out_node())[hit]
+        self.assertLess(error.max(), 0.01)
+
+        pixels = 128 * 128
+        for layout, pixel_bytes in (("float", 40), ("packed", 12)):
+            g_buffer = nodes[layout].g_buffer
+            self.assertEqual(len(g_buffer.buffers()), 4 if layout == "float" else 3)
+            self.assertGreaterEqual(sum(x.size for x in g_buffer.buffers()), pixels * pixel_bytes)
+            self.assertLess(sum(x.size for x in g_buffer.buffers()), pixels * pixel_bytes * 1.3)
+
+        # reconstruction reads and writes through the same layout
+        fast = Raymarch().in_node(
+            init, SPHERES_DF, caminfo=caminfo, steps=96, subsample=2, g_buffer_layout="packed")
+        for i in range(4):
+            fast.out_node()
+        np.testing.assert_allclose(fast.g_buffer.read()["depth"], expected["depth"], rtol=1e-5)
+
+        with self.assertRaises(Exception):
+            Raymarch().in_node(init, SPHERES_DF, g_buffer_layout="half")
+
+    def test_fused(self):
+        print("[+] Testing single pass raymarch and lighting")
+
+        init = Init((256, 256))
+        caminfo = orbit_camera(0.3)
+        raymarch = Raymarch().in_node(init, SPHERES_DF, caminfo=caminfo, steps=96, bounds=SPHERES_BOUNDS)
+        raymarch.set_time(1.0)
+        light = DeferredLight().in_node(init, SIMPLE_BXDF, raymarch.out_node(), caminfo=caminfo)
+        lit = LitRaymarch().in_node(init, SPHERES_DF, SIMPLE_BXDF, caminfo=caminfo, steps=96, bounds=SPHERES_BOUNDS)
+        lit.set_time(1.0)
+        np.testing.assert_allclose(lit.out_node(), light.out_node(), atol=1e-5)
+        self.assertIsNone(lit.g_buffer)
+
+        # frames advance time unless it is set
+        lit.out_node()
+        self.assertAlmostEqual(lit.uniforms["u_time"], 1.1)
+        for node in (lit, raymarch):
+            node.set_time(3.0)
+            self.assertTrue(node.dirty)
+            node.out_node()
+            self.assertEqual(node.uniforms["u_time"], 3.0)
+
+        def timed(render):
+            render()
+            start = time.perf_counter()
+            for i in range(10):
+                data = render()
+            return (time.perf_counter() - start) / 10 * 1000.0, data
+
+        multi_ms, _ = timed(lambda: (raymarch.out_node(), light.out_node())[1])
+        fused_ms, _ = timed(lit.out_node)
+        print("[+] raymarch + light {:.1f} ms, single pass {:.1f} ms".format(multi_ms, fused_ms))
+
+        for options in ({"subsample": 2}, {"checkerboard": True}, {"g_buffer_layout": "packed"}):
+            with self.assertRaises(Exception):
+                LitRaymarch().in_node(init, SPHERES_DF, SIMPLE_BXDF, **options)
+
+    def test_point_lights(self):
+        print("[+] Testing tiled point light culling")
+
+        init = Init((256, 256))
+        caminfo = orbit_camera(0.3)
+        raymarch = Raymarch().in_node(init, SPHERES_DF, caminfo=caminfo, steps=96, bounds=SPHERES_BOUNDS)
+        g_buffer = raymarch.out_node()
+
+        rng = np.random.RandomState(7)
+        lights = [
+            PointLight(rng.uniform((-5.0, -1.5, -2.0), (5.0, 1.5, 6.0)), rng.uniform(0.2, 1.0, 3), 1.5)
+            for k in range(256)]
+        culled = DeferredLight().in_node(init, SIMPLE_BXDF, g_buffer, caminfo=caminfo, lights=lights)
+        brute = DeferredLight().in_node(init, SIMPLE_BXDF, g_buffer, caminfo=caminfo, lights=lights, cull=False)
+        expected = brute.out_node()
+        np.testing.assert_allclose(culled.out_node(), expected, atol=1e-4)
+
+        # point lights add to the lightinfo term
+        single = DeferredLight().in_node(init, SIMPLE_BXDF, g_buffer, caminfo=caminfo).out_node()
+        self.assertGreater(np.mean(expected[..., :3] - single[..., :3]), 0.01)
+        self.assertGreaterEqual((expected - single).min(), -1e-5)
+        empty = DeferredLight().in_node(init, SIMPLE_BXDF, g_buffer, caminfo=caminfo, lights=[])
+        np.testing.assert_allclose(empty.out_node(), single, atol=1e-6)
+
+        stats = culled.tile_stats()
+        print("[+] {lights} lights, per tile mean {mean:.1f} max {max}".format(**stats))
+        self.assertEqual(stats["overflow"], 0)
+        self.assertLess(stats["mean"], len(lights) / 8)
+
+        # lights can move per frame
+        moved = [PointLight(np.add(x.position, (0.0, 0.5, 0.0)), x.color, x.radius) for x in lights]
+        culled.set_lights(moved)
+        brute.set_lights(moved)
+        np.testing.assert_allclose(culled.out_node(), brute.out_node(), atol=1e-4)
+
+        def timed(node):
+            node.out_node()
+            start = time.perf_counter()
+            for i in range(5):
+                node.out_node()
+            return (time.perf_counter() - start) / 5 * 1000.0
+
+        print("[+] all lights per pixel {:.1f} ms, tiled {:.1f} ms".format(timed(brute), timed(culled)))
+
+        with self.assertRaises(Exception):
+            DeferredLight().in_node(init, SIMPLE_BXDF, g_buffer).set_lights(lights)
+
+    def test_point_lights_edge(self):
+        print("[+] Testing point lights on image not a multiple of tile size")
+
+        # spheres reach the left edge, which the threads past the right edge wrapped onto
+        init = Init((40, 24))
+        caminfo = orbit_camera(4.0)
+        g_buffer = Raymarch().in_node(init, SPHERES_DF, caminfo=caminfo, steps=96).out_node()
+        light = PointLight((-2.0, 1.5, -1.0), (1.0, 0.8, 0.6), 4.0)
+
+        single = DeferredLight().in_node(init, SIMPLE_BXDF, g_buffer, caminfo=caminfo).out_node()
+        culled = DeferredLight().in_node(init, SIMPLE_BXDF, g_buffer, caminfo=caminfo, lights=[light])
+        brute = DeferredLight().in_node(init, SIMPLE_BXDF, g_buffer, caminfo=caminfo, lights=[light], cull=False)
+
+        # SIMPLE_BXDF of the light alone, pixel i at x = i % W, y = i // W
+        W, H = init.W, init.H
+        g = {k: v.reshape((W * H, -1)) for k, v in g_buffer.read().items()}
+        i = np.arange(W * H)
+        uv = np.stack((i % W / W, i // W / H), axis=-1)
+        r = np.concatenate(((uv - 0.5) * 2.0, np.ones((W * H, 1))), axis=-1)
+        r = r / np.linalg.norm(r, axis=-1, keepdims=True)
+        P = caminfo.u_campos + r @ np.reshape(look_matrix(caminfo.u_campos, caminfo.u_camtarget), (3, 3)) * g["depth"]
+        to_light = light.position - P
+        d = np.linalg.norm(to_light, axis=-1, keepdims=True)
+        window = np.clip(1.0 - (d / light.radius) ** 4, 0.0, 1.0)
+        lit = np.maximum(np.sum(g["normal"] * to_light / d, axis=-1, keepdims=True), 0.0)
+        term = g["color"] * (0.2 + lit) * np.multiply(light.color, window * window / (d * d + 1.0))
+        term[g["depth"][:, 0] >= 50.0] = 0.0
+
+        self.assertGreater(term.max(), 0.05)
+        for node in (culled, brute):
+            out = node.out_node().reshape((W * H, 4))
+            np.testing.assert_allclose(out[:, :3] - single.reshape((W * H, 4))[:, :3], term, atol=1e-3)
+
+    def test_edge(self):
+        print("[+] Testing raymarch on image not a multiple of tile size")
+
+        # sphere covers the left edge only, which the threads past the right edge wrapped onto
+        df = "if (w_need_color) { w_color = vec3(1.0); } return sphere(p - vec3(4.0, 0.0, 0.0), 3.0);"
+        init = Init((40, 24))
+        caminfo = CameraInfo()
+        depth = Raymarch().in_node(init, df, caminfo=caminfo, steps=96).out_node().read()["depth"]
+
+        # ray sphere intersection, pixel i at x = i % W, y = i // W
+        W, H = init.W, init.H
+        i = np.arange(W * H)
+        uv = np.stack((i % W / W, i // W / H), axis=-1)
+        r = np.concatenate(((uv - 0.5) * 2.0, np.ones((W * H, 1))), axis=-1)
+        r = r / np.linalg.norm(r, axis=-1, keepdims=True)
+        r = r @ np.reshape(look_matrix(caminfo.u_campos, caminfo.u_camtarget), (3, 3))
+        oc = np.subtract(caminfo.u_campos, (4.0, 0.0, 0.0))
+        b = r @ oc
+        disc = b * b - (oc @ oc - 9.0)
+        expected = -b - np.sqrt(np.maximum(disc, 0.0))
+
+        # silhouettes depend on march steps
+        depth = depth.reshape(-1)
+        hit, miss = disc > 0.2, disc < -0.2
+        self.assertGreater(np.sum(hit[::W]), H / 2)
+        np.testing.assert_allclose(depth[hit], expected[hit], atol=1e-2)
+        self.assertTrue(np.all(depth[miss] >= 50.0))
+
+    def test_unsupported(self):
+        print("[+] Testing unsupported backend and batch raise ValueError")
+
+        init_np = Init((32, 32), backend="numpy")
+        init_batch = Init((32, 32), batch=2)
+        with self.assertRaises(ValueError):
+            Raymarch().in_node(init_np, SPHERES_DF)
+        with self.assertRaises(ValueError):
+            Raymarch().in_node(init_batch, SPHERES_DF)
+        with self.assertRaises(ValueError):
+            BakeSDF().in_node(init_np, SPHERES_DF, (-4.0, -2.0, -2.0), (4.0, 2.0, 6.0))
+        with self.assertRaises(ValueError):
+            DeferredLight().in_node(init_batch, SIMPLE_BXDF, None)
+        with self.assertRaises(ValueError):
+            DeferredLight().in_node(init_np, SIMPLE_BXDF, None, lights=[PointLight()])
+
+    def test_sdf_volume(self):
+        print("[+] Testing baked distance field volume")
+
+        init = Init((256, 256))
+        caminfo = orbit_camera(0.3)
+        analytic = Raymarch().in_node(init, BUMPY_DF, caminfo=caminfo, steps=64)
+        expected = analytic.out_node().read()
+
+        def timed(node):
+            node.out_node()
+            start = time.perf_counter()
+            for i in range(3):
+                node.out_node()
+            depth_of(node)
+            return (time.perf_counter() - start) / 3 * 1000.0
+
+        volumes = {}
+        for brick_size in (None, 8):
+            start = time.perf_counter()
+            volume = BakeSDF().in_node(init, BUMPY_DF, (-2.0, -2.0, -2.0), (2.0, 2.0, 2.0), 97, brick_size).out_node()
+            bake_ms = (time.perf_counter() - start) * 1000.0
+            volumes[brick_size] = volume
+
+            node = Raymarch().in_node(init, volume, caminfo=caminfo, steps=64)
+            result = node.out_node().read()
+            hit, volume_hit = expected["depth"] < 50.0, result["depth"] < 50.0
+            self.assertGreater(hit.mean(), 0.05)
+            self.assertLess((hit != volume_hit).mean(), 0.005)
+            both = hit & volume_hit
+            self.assertLess(np.median(np.abs(result["depth"] - expected["depth"])[both]), 0.005)
+            # grazing rays out of steps may stop in empty bricks, which have no color
+            color_error = np.abs(result["color"][both] - expected["color"][both]).max(-1)
+            self.assertLess((color_error > 1e-5).mean(), 0.005)
+
+            print("[+] {} volume: bake {:.1f} ms, {:.1f} MB, trace {:.1f} ms, analytic {:.1f} ms".format(
+                "brick" if brick_size else "dense", bake_ms, volume.nbytes / 1e6, timed(node), timed(analytic)))
+        self.assertLess(volumes[8].nbytes, volumes[None].nbytes)
+
+        # later jobs load the baked volume
+        with tempfile.TemporaryDirectory() as folder:
+            for brick_size in (None, 8):
+                bake = BakeSDF().in_node(init, BUMPY_DF, (-2.0, -2.0, -2.0), (2.0, 2.0, 2.0), 97, brick_size,
+                                         cache_dir=folder)
+                baked = Raymarch().in_node(init, bake.out_node(), caminfo=caminfo, steps=64)
+                with mock.patch.object(BakeSDF, "bake") as baking:
+                    loaded = Raymarch().in_node(init, bake.out_node(), caminfo=caminfo, steps=64)
+                baking.assert_not_called()
+                np.testing.assert_array_equal(
+                    loaded.out_node().read()["depth"], baked.out_node().read()["depth"])
+            self.assertEqual(len([x for x in os.listdir(folder) if x.endswith(".npz")]), 2)
+
+        with self.assertRaises(Exception):
+            BakeSDF().in_node(init, BUMPY_DF, (-2.0, -2.0, -2.0), (2.0, 2.0, 2.0), 96, 8)
+
+    def test_quality(self):
+        print("[+] Testing step statistics and quality presets")
+
+        init = Init((256, 256))
+        caminfo = orbit_camera(0.3)
+        nodes = {
+            quality: Raymarch().in_node(init, BUMPY_DF, caminfo=caminfo, quality=quality, count_steps=True)
+            for quality in (None, "draft", "preview", "final")}
+
+        depths = {}
+        for quality, node in nodes.items():
+            node.out_node()
+            start = time.perf_counter()
+            depths[quality] = node.out_node().read()["depth"]
+            frame_ms = (time.perf_counter() - start) * 1000.0
+
+            stats = node.step_stats()
+            print("[+] {}: {:.1f} ms, steps mean {mean:.1f} p99 {p99:.0f} of {steps}, capped {capped:.3f}".format(
+                quality or "default", frame_ms, **stats))
+            self.assertAlmostEqual(stats["mean"], node.steps_per_pixel(), places=4)
+            self.assertLessEqual(stats["p99"], stats["steps"])
+            self.assertAlmostEqual(stats["capped"], node.capped_mask().mean())
+            self.assertTrue(np.all(node.step_counts()[node.capped_mask()] == stats["steps"]))
+
+            heatmap = node.step_heatmap()
+            self.assertEqual(heatmap.shape, (256, 256, 4))
+            self.assertTrue(np.all((heatmap >= 0.0) & (heatmap <= 1.0)))
+            np.testing.assert_array_equal(heatmap[node.capped_mask()], 1.0)
+
+        # cheaper presets find the same surfaces
+        hit = depths["final"] < 50.0
+        for quality in ("draft", "preview"):
+            self.assertLess(((depths[quality] < 50.0) != hit).mean(), 0.02)
+
+        self.assertEqual(nodes[None].uniforms["u_maxsteps"], 32)
+        self.assertEqual(nodes[None].uniforms["u_shadow_steps"], 32)
+        self.assertEqual(nodes["draft"].uniforms["u_shadow_steps"], 8)
+        self.assertLessEqual(nodes["final"].step_stats()["capped"], nodes["draft"].step_stats()["capped"])
+
+        node = Raymarch().in_node(init, BUMPY_DF, steps=40, quality="draft")
+        self.assertEqual(node.uniforms["u_maxsteps"], 40)
+        with self.assertRaises(Exception):
+            Raymarch().in_node(init, BUMPY_DF, quality="best")
+
     def test_raymarch(self):
         dff = """
         float d = FAR;
@@ -111,6 +541,11 @@ class RaymarchTest(unittest.TestCase):
         light_node = DeferredLight().in_node(init, bxdf, raymarch_node.out_node(), lightinfo, caminfo)
         output_writer = ii.get_writer("raymarched.mp4", fps=30)
 
+        # rgba8 frames packed on GPU, read back a frame late and encoded on a worker
+        frame_node = Quantize().in_node(init, light_node, "rgba8", flip=True)
+        queue = ReadbackQueue(depth=2)
+
+        start = time.perf_counter()
         for i in range(120):
             t = i * 0.052
             x = math.cos(t) * 7.0
@@ -123,11 +558,13 @@ class RaymarchTest(unittest.TestCase):
             # do raymarch
             g_buffer = raymarch_node.out_node()
 
-            # do lighting
+            # do lighting and record
             light_node.set_g_buffer(g_buffer)
-            output = light_node.out_node()
-
-            # record
-            npappend(output_writer, output)
+            queue.submit(frame_node, output_writer.append_data)
 
+        queue.close()
         output_writer.close()
+
+        elapsed = time.perf_counter() - start
+        print("[+] Raymarch: 120 frames, {:.2f} fps".format(120 / elapsed))
+        self.assertEqual(queue.stats()["resolved"], 120)
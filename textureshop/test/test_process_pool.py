@@ -0,0 +1,72 @@
+import unittest
+
+import numpy as np
+
+from ..op_math import Add, Multiply
+from ..op_noise import Gradient
+from ..process_pool import ProcessPool
+
+
+# no context at module level, workers import this module to find build functions
+SIZE = (64, 48)
+
+
+def build(init, value, grad_type):
+    grad = Gradient().in_node(init, grad_type)
+    return Multiply().in_node(init, Add().in_node(init, grad, value), 0.5)
+
+
+def expected(value, grad_type):
+    from ..op_base import Init
+    init = Init(size=SIZE, backend="numpy")
+    return build(init, value, grad_type).out_node()
+
+
+def fail(init):
+    raise ValueError("broken graph")
+
+
+PARAMS = [(i * 0.1, grad_type) for i, grad_type in enumerate(
+    (Gradient.GRAD_HOR_LEFT, Gradient.GRAD_VER_UP, Gradient.GRAD_RAD_IN, Gradient.GRAD_RAD_OUT) * 2)]
+
+
+class ProcessPoolTest(unittest.TestCase):
+
+    def test_numpy_workers(self):
+        print("[+] Testing process pool on numpy backend")
+
+        with ProcessPool(2, "numpy", max_jobs_per_worker=3) as pool:
+            results = pool.map(build, PARAMS, SIZE)
+
+        for params, result in zip(PARAMS, results):
+            np.testing.assert_allclose(result, expected(*params), atol=1e-6)
+
+        stats = pool.stats()
+        self.assertEqual(sum(worker["jobs"] for worker in stats.values()), len(PARAMS))
+
+        # 8 jobs, at most 3 per worker
+        self.assertGreaterEqual(len(stats), 3)
+        for worker in stats.values():
+            self.assertLessEqual(worker["jobs"], 3)
+            self.assertGreater(worker["mpix_per_second"], 0.0)
+
+    def test_gl_workers(self):
+        print("[+] Testing process pool on gl backend")
+
+        with ProcessPool(2, "gl") as pool:
+            try:
+                results = pool.map(build, PARAMS[:4], SIZE)
+            except Exception as e:
+                if "[ContextPool]" not in str(e):
+                    raise
+                self.skipTest("no standalone GL context in worker process: {}".format(e))
+
+        for params, result in zip(PARAMS, results):
+            np.testing.assert_allclose(result, expected(*params), atol=1e-5)
+
+    def test_job_error(self):
+        print("[+] Testing process pool job error reaches caller")
+
+        with ProcessPool(1, "numpy") as pool:
+            with self.assertRaises(ValueError):
+                pool.map(fail, [()], SIZE)
@@ -0,0 +1,118 @@
+import time
+import unittest
+
+import moderngl as mg
+import numpy as np
+
+from ..op_base import Init
+from ..op_math import Add, Multiply
+from ..op_quantize import Quantize
+from ..op_raymarch import Raymarch, DeferredLight, CameraInfo
+from ..readback import ReadbackQueue
+
+
+GL = mg.create_standalone_context()
+init = Init(size=(48, 32), gl=GL)
+
+image = np.random.uniform(0.0, 1.0, (48, 32, 4)).astype(np.float32)
+
+DISTANCE_FIELD = """
+    float d = sphere(p - vec3(sin(u_time), 0.0, 0.0), 2.0);
+    if (w_need_color)
+    {
+        w_color = vec3(0.8, 0.3, 0.2);
+    }
+    return d;
+"""
+
+BXDF = """
+    return color * max(dot(normal, normalize(u_lightpos)), 0.0) * mix(1.0, shadow, u_shadow_intensity);
+"""
+
+
+class ReadbackTest(unittest.TestCase):
+
+    def test_ring(self):
+        print("[+] Testing async readback against sync readback")
+
+        for depth in (1, 2, 3):
+            node = Add().in_node(init, image, 0.0)
+            queue = ReadbackQueue(GL, depth=depth)
+
+            # node reuses its output buffer, each readback keeps its own frame
+            readbacks = []
+            for i in range(7):
+                node.set_inputs(image, float(i))
+                readbacks.append(queue.submit(node))
+                self.assertLessEqual(queue.stats()["pending"], depth)
+
+            self.assertEqual(queue.stats()["wraps"], 7 - depth)
+            for i, readback in enumerate(readbacks):
+                np.testing.assert_allclose(readback.result(), image + i, atol=1e-6)
+
+            self.assertTrue(all(readback.done() for readback in readbacks))
+            queue.close()
+
+    def test_callbacks(self):
+        print("[+] Testing async readback callbacks run in order")
+
+        node = Quantize().in_node(init, Multiply().in_node(init, image, 1.0), "rgb8", flip=True)
+        expected = node.out_node()
+
+        frames = []
+        with ReadbackQueue(GL, depth=2) as queue:
+            last = None
+            for i in range(5):
+                last = queue.submit(node, lambda data, i=i: frames.append((i, data)))
+            np.testing.assert_array_equal(last.wait(), expected)
+
+        self.assertEqual([i for i, _ in frames], list(range(5)))
+        for _, frame in frames:
+            self.assertEqual(frame.dtype, np.uint8)
+            np.testing.assert_array_equal(frame, expected)
+
+        # callbacks of several workers would run out of order
+        with self.assertRaises(Exception):
+            ReadbackQueue(GL, workers=2)
+
+    def test_raymarch_loop(self):
+        print("[+] Testing async readback of raymarch animation")
+
+        rm_init = Init((160, 160), gl=GL)
+        caminfo = CameraInfo()
+        raymarch_node = Raymarch().in_node(rm_init, DISTANCE_FIELD, None, caminfo, 24)
+        light_node = DeferredLight().in_node(rm_init, BXDF, raymarch_node.out_node(), None, caminfo)
+        frame_node = Quantize().in_node(rm_init, light_node, "rgba8", flip=True)
+
+        def encode(frame):
+            # stands in for the video encoder
+            frame.astype(np.float32).mean()
+
+        frames = 24
+
+        def run(async_readback):
+            raymarch_node.set_time(0.0)
+            results = []
+            queue = ReadbackQueue(GL, depth=2 if async_readback else 1, workers=1 if async_readback else 0)
+
+            start = time.perf_counter()
+            for i in range(frames):
+                caminfo.u_campos = (np.cos(i * 0.1) * 7.0, 5.0, np.sin(i * 0.1) * 7.0)
+                raymarch_node.set_caminfo(caminfo)
+                raymarch_node.out_node()
+
+                readback = queue.submit(frame_node, encode)
+                results.append(readback)
+                if not async_readback:
+                    readback.result()
+
+            queue.close()
+            elapsed = time.perf_counter() - start
+            return elapsed, [readback.result() for readback in results]
+
+        sync_time, sync_frames = run(False)
+        async_time, async_frames = run(True)
+        print("    sync {:.1f} fps, async {:.1f} fps".format(frames / sync_time, frames / async_time))
+
+        for sync_frame, async_frame in zip(sync_frames, async_frames):
+            np.testing.assert_array_equal(sync_frame, async_frame)
@@ -0,0 +1,118 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import moderngl as mg
+import numpy as np
+
+from ..op_base import Base, Init
+from ..op_math import Add, Multiply, Clamp
+from ..op_noise import FBMNoise, Gradient
+from ..result_cache import enable_result_cache, disable_result_cache
+
+
+GL = mg.create_standalone_context()
+SIZE = (64, 48)
+init = Init(size=SIZE, gl=GL)
+
+noise = np.random.uniform(0.0, 1.0, (32, 32, 4)).astype(np.float32)
+image = np.random.uniform(0.0, 1.0, (SIZE[0], SIZE[1], 4)).astype(np.float32)
+
+
+def build(scale, octaves=4):
+    fbm = FBMNoise().in_node(init, noise, octaves)
+    grad = Gradient().in_node(init, Gradient.GRAD_RAD_OUT)
+    added = Add().in_node(init, Add().in_node(init, fbm, grad), image)
+    return Multiply().in_node(init, added, scale)
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def tearDown(self):
+        disable_result_cache()
+
+    def test_downstream_change(self):
+        print("[+] Testing result cache skips upstream work")
+
+        expected = [build(scale).out_node() for scale in (0.5, 0.25)]
+
+        cache = enable_result_cache()
+        np.testing.assert_array_equal(build(0.5).out_node(), expected[0])
+        self.assertEqual(cache.stats()["hits"], 0)
+
+        # only the last node differs, noise and gradient are not dispatched again
+        with mock.patch.object(FBMNoise, "out_texture") as fbm, \
+                mock.patch.object(Gradient, "out_texture") as grad:
+            np.testing.assert_array_equal(build(0.25).out_node(), expected[1])
+        fbm.assert_not_called()
+        grad.assert_not_called()
+        self.assertEqual(cache.stats()["hits"], 1)
+
+        # same graph again, root itself is cached
+        np.testing.assert_array_equal(build(0.25).out_node(), expected[1])
+        self.assertEqual(cache.stats()["hits"], 2)
+
+    def test_keys(self):
+        print("[+] Testing result cache keys")
+
+        enable_result_cache()
+        self.assertEqual(build(0.5).cache_key(), build(0.5).cache_key())
+        self.assertNotEqual(build(0.5).cache_key(), build(0.25).cache_key())
+        self.assertNotEqual(build(0.5, 4).cache_key(), build(0.5, 5).cache_key())
+
+        clamp = Clamp().in_node(init, image, 0.0, 1.0)
+        other = Clamp().in_node(init, image, 0.0, 0.5)
+        self.assertNotEqual(clamp.cache_key(), other.cache_key())
+
+        changed = image.copy()
+        changed[0, 0, 0] += 1.0
+        self.assertNotEqual(clamp.cache_key(), Clamp().in_node(init, changed, 0.0, 1.0).cache_key())
+
+        # different random noise per node
+        self.assertNotEqual(FBMNoise().in_node(init).cache_key(), FBMNoise().in_node(init).cache_key())
+
+    def test_memory_budget(self):
+        print("[+] Testing result cache memory budget")
+
+        nbytes = SIZE[0] * SIZE[1] * 16
+        cache = enable_result_cache(memory_bytes=nbytes * 2)
+        for scale in (0.1, 0.2, 0.3):
+            build(scale).out_node()
+
+        stats = cache.stats()
+        self.assertLessEqual(stats["bytes"], nbytes * 2)
+        self.assertGreater(stats["evictions"], 0)
+
+    def test_disk(self):
+        print("[+] Testing result cache on disk")
+
+        expected = build(0.5).out_node()
+        with tempfile.TemporaryDirectory() as folder:
+            enable_result_cache(directory=folder)
+            build(0.5).out_node()
+
+            # fresh process memory, entries come back from disk
+            cache = enable_result_cache(directory=folder)
+            with mock.patch.object(Multiply, "out_texture") as multiply:
+                np.testing.assert_array_equal(build(0.5).out_node(), expected)
+            multiply.assert_not_called()
+            self.assertEqual(cache.stats()["disk_hits"], 1)
+
+            nbytes = SIZE[0] * SIZE[1] * 16
+            cache = enable_result_cache(memory_bytes=0, directory=folder, disk_bytes=nbytes * 3)
+            for scale in (0.1, 0.2, 0.3, 0.4):
+                build(scale).out_node()
+            self.assertLessEqual(cache.disk.nbytes, nbytes * 3)
+            self.assertGreater(cache.stats()["disk_evictions"], 0)
+            self.assertEqual(len([x for x in os.listdir(folder) if x.endswith(".tmp")]), 0)
+
+    def test_disabled(self):
+        print("[+] Testing nodes without result cache")
+
+        self.assertIsNone(Base.RESULT_CACHE)
+        node = build(0.5)
+        self.assertIsNone(node.texture().digest)
+
+        # uploads aren't hashed while the cache is off
+        self.assertIsNone(Add().in_node(init, image, 1.0).in_a.digest)
@@ -0,0 +1,86 @@
+import tempfile
+import unittest
+
+import moderngl as mg
+import numpy as np
+
+from ..context import ContextPool
+from ..op_base import Base, Init
+from ..op_math import Add, Sin
+from ..op_noise import Gradient
+from ..op_raymarch import Raymarch, LitRaymarch, DeferredLight
+from ..shader_cache import enable_disk_cache, disable_disk_cache, warmup
+
+
+GL = mg.create_standalone_context()
+init = Init(size=(4, 4), gl=GL)
+
+
+class ShaderCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.disk_cache = enable_disk_cache(self.tempdir.name)
+        Base.PROGRAM_CACHE.clear()
+
+    def tearDown(self):
+        disable_disk_cache()
+        self.tempdir.cleanup()
+
+    def test_disk_entries(self):
+        print("[+] Testing on-disk shader cache entries")
+
+        Add().in_node(init, 0.1, 0.2)
+        Gradient().in_node(init, Gradient.GRAD_RAD_IN)
+
+        entries = list(self.disk_cache.entries())
+        self.assertEqual(len(entries), 2)
+        injects = [e["inject"] for e in entries]
+        self.assertIn("_add", [x.get("%CALC%") for x in injects])
+        self.assertIn("_radial_in_grid", [x.get("%TYPE%") for x in injects])
+
+    def test_warmup(self):
+        print("[+] Testing warmup from declared ops and from disk cache")
+
+        programs = warmup([Add, Sin], gl=GL)
+        self.assertEqual(len(programs), 2)
+
+        # first real job hits warmed program
+        hits = Base.PROGRAM_CACHE.hits
+        in_a = np.ones((4, 4, 4))
+        Add().in_node(init, in_a, in_a)
+        self.assertEqual(Base.PROGRAM_CACHE.hits, hits + 1)
+
+        # cold start: replay everything recorded on disk
+        Base.PROGRAM_CACHE.clear()
+        programs = warmup(gl=GL)
+        self.assertEqual(len(programs), 2)
+
+        # raymarch shaders need their distance field
+        for op in (Raymarch, LitRaymarch, DeferredLight):
+            with self.assertRaises(TypeError):
+                warmup([op], gl=GL)
+            with self.assertRaises(TypeError):
+                warmup([op], background=True)
+
+    def test_background_warmup(self):
+        print("[+] Testing background warmup")
+
+        future = warmup([Add, Sin], background=True)
+        self.assertEqual(future.result(), 2)
+        self.assertEqual(len(list(self.disk_cache.entries())), 2)
+
+        # worker context comes from Base.CONTEXTS, its errors reach the caller
+        contexts, Base.CONTEXTS = Base.CONTEXTS, ContextPool(capture=False, context_args={"backend": "missing"})
+        try:
+            with self.assertRaises(Exception):
+                warmup([Add], background=True).result()
+        finally:
+            Base.CONTEXTS = contexts
+
+        with self.assertRaises(OSError):
+            warmup([("./gl/missing.glsl", {})], background=True).result()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+
+import moderngl as mg
+import numpy as np
+
+from ..op_base import Init
+from ..op_fusion import Fused
+from ..op_math import Add, Multiply, OneMinus
+from ..op_mix import Mix
+from ..op_noise import FBMNoise, Gradient
+from .. import storage
+
+
+GL = mg.create_standalone_context()
+init = Init(size=(48, 40), gl=GL)
+init_np = Init(size=(48, 40), backend="numpy")
+
+FORMATS = [(c, p) for c in storage.CHANNELS for p in storage.PRECISIONS]
+
+
+def tolerance(precision):
+    return 1e-6 if precision == "f32" else 1e-3
+
+
+class StorageTest(unittest.TestCase):
+
+    def test_generators(self):
+        print("[+] Testing compact generator outputs")
+
+        noise = np.random.uniform(0.0, 1.0, (64, 64, 4))
+        full_fbm = FBMNoise().in_node(init, noise).out_node()
+        full_grad = Gradient().in_node(init, Gradient.GRAD_RAD_OUT).out_node()
+
+        for channels, precision in FORMATS:
+            fbm = FBMNoise(channels=channels, precision=precision).in_node(init, noise)
+            grad = Gradient(channels=channels, precision=precision).in_node(init, Gradient.GRAD_RAD_OUT)
+
+            handle = fbm.out_texture()
+            self.assertEqual(handle.nbytes, 48 * 40 * storage.pixel_bytes(channels, precision))
+
+            atol = tolerance(precision)
+            for full, out in ((full_fbm, handle.read()), (full_grad, grad.out_node())):
+                self.assertEqual(out.shape, (48, 40, channels))
+                assert np.all(np.isclose(out, full[..., :channels], atol=atol)), (channels, precision)
+
+    def test_compact_inputs(self):
+        print("[+] Testing compact buffers as inputs")
+
+        for channels, precision in FORMATS:
+            mask = Gradient(channels=channels, precision=precision).in_node(init, Gradient.GRAD_VER_UP)
+            out = Multiply().in_node(init, mask, (1.0, 2.0, 3.0, 4.0)).out_node()
+
+            expected = storage.expand(mask.out_node()) * (1.0, 2.0, 3.0, 4.0)
+            assert np.all(np.isclose(out, expected, atol=1e-5)), (channels, precision)
+
+        # (W, H) arrays are single channel inputs
+        data = np.random.uniform(0.0, 1.0, (48, 40))
+        out = OneMinus(channels=1).in_node(init, data).out_node()
+        assert np.all(np.isclose(out[..., 0], 1.0 - data, atol=1e-6))
+
+    def test_fused_and_numpy(self):
+        print("[+] Testing compact formats through fusion and numpy backend")
+
+        data = np.random.uniform(0.0, 1.0, (48, 40, 4))
+
+        def build(init):
+            mask = Gradient(channels=1, precision="f16").in_node(init, Gradient.GRAD_RAD_IN)
+            added = Add(channels=2, precision="f16").in_node(init, data, mask)
+            return Mix(channels=1).in_node(init, added, 1.0, 0.25)
+
+        unfused = build(init).out_node()
+        fused = Fused().in_node(init, build(init)).out_node()
+        on_numpy = build(init_np).out_node()
+
+        self.assertEqual(unfused.shape, (48, 40, 1))
+        assert np.all(np.isclose(fused, unfused, atol=1e-5))
+        assert np.all(np.isclose(on_numpy, unfused, atol=1e-3))
+
+    def test_bad_format(self):
+        print("[+] Testing unsupported storage formats")
+
+        with self.assertRaises(Exception):
+            Gradient(channels=3).in_node(init)
+        with self.assertRaises(Exception):
+            Init(size=(4, 4), gl=GL, precision="f64")
+
+
+if __name__ == "__main__":
+    unittest.main()
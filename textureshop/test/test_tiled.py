@@ -0,0 +1,109 @@
+import os
+import tempfile
+import unittest
+
+import moderngl as mg
+import numpy as np
+
+from ..op_base import Init
+from ..op_math import Add, Multiply
+from ..op_mix import Mix, Rotate
+from ..op_noise import FBMNoise, Gradient
+from ..tiled import TiledRenderer, graph_halo
+
+
+GL = mg.create_standalone_context()
+SIZE = (100, 90)
+init = Init(size=SIZE, gl=GL)
+
+noise = np.random.uniform(0.0, 1.0, (64, 64, 4)).astype(np.float32)
+noise_tex = GL.texture((64, 64), 4, noise.tobytes(), dtype="f4")
+image = np.random.uniform(0.0, 1.0, (SIZE[0], SIZE[1], 4)).astype(np.float32)
+
+
+class Wide(Add):
+    """ pretends to read neighbours, like a blur would """
+
+    HALO = 3
+
+
+def build(init, wide=False):
+    tex = noise_tex if init.backend == "gl" else noise
+    fbm = FBMNoise().in_node(init, tex, 4)
+    grad = Gradient().in_node(init, Gradient.GRAD_RAD_IN)
+    node_type = Wide if wide else Add
+    added = node_type().in_node(init, init.crop(image), grad)
+    return Mix().in_node(init, added, fbm, 0.5)
+
+
+class TiledTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "out.raw")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_tiles_match_full(self):
+        print("[+] Testing tiled render into memmap")
+
+        full = build(init).out_node()
+
+        renderer = TiledRenderer(build, SIZE, tile_size=(48, 40), gl=GL)
+        out = renderer.render(self.path)
+        self.assertIsInstance(out, np.memmap)
+        self.assertEqual(renderer.tiles_rendered, 9)
+        self.assertEqual(renderer.halo, 0)
+        self.assertEqual(renderer.peak_tile_bytes, 48 * 40 * 16)
+        assert np.all(np.isclose(out, full, atol=1e-5))
+
+        # raw file holds the same pixels
+        raw = np.fromfile(self.path, dtype=np.float32).reshape(full.shape)
+        assert np.all(np.isclose(raw, full, atol=1e-5))
+
+    def test_halo(self):
+        print("[+] Testing tiles with halo")
+
+        node = build(init, wide=True)
+        self.assertEqual(graph_halo(node), 3)
+        full = node.out_node()
+
+        renderer = TiledRenderer(lambda x: build(x, True), SIZE, tile_size=(32, 32), gl=GL)
+        out = renderer.render(np.zeros(full.shape, dtype=np.float32))
+        self.assertEqual(renderer.halo, 3)
+        self.assertEqual(renderer.peak_tile_bytes, 38 * 38 * 16)
+        assert np.all(np.isclose(out, full, atol=1e-5))
+
+    def test_numpy_backend(self):
+        print("[+] Testing tiled render on numpy backend")
+
+        full = build(Init(size=SIZE, backend="numpy")).out_node()
+        renderer = TiledRenderer(build, SIZE, tile_size=(64, 64), backend="numpy")
+        out = renderer.render(self.path)
+        assert np.all(np.isclose(out, full, atol=1e-5))
+
+    def test_compact_output(self):
+        print("[+] Testing tiled render of single channel graph")
+
+        def build_mask(init):
+            return Gradient(channels=1).in_node(init, Gradient.GRAD_RAD_OUT)
+
+        full = build_mask(init).out_node()
+        out = TiledRenderer(build_mask, SIZE, tile_size=(64, 64), gl=GL).render(self.path)
+        self.assertEqual(out.shape, (SIZE[0], SIZE[1], 1))
+        assert np.all(np.isclose(out, full, atol=1e-6))
+
+    def test_whole_image_ops(self):
+        print("[+] Testing ops needing whole image are refused")
+
+        def build_rotate(init):
+            return Rotate().in_node(init, Multiply().in_node(init, init.crop(image), 2.0), 0.3)
+
+        renderer = TiledRenderer(build_rotate, SIZE, tile_size=(32, 32), gl=GL)
+        with self.assertRaises(Exception):
+            renderer.render(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
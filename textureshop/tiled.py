@@ -0,0 +1,128 @@
+"""
+tiled module
+
+renders node graphs larger than memory tile by tile,
+streaming finished tiles into a memory-mapped output.
+"""
+
+import numpy as np
+
+from .op_base import Base, Init
+
+
+def graph_halo(node):
+    """ apron in pixels a tile of node needs around it, None if whole image is needed """
+    if node.HALO is None:
+        return None
+
+    halo = 0
+    for in_x in node.inputs():
+        if not isinstance(in_x, Base):
+            continue
+
+        in_halo = graph_halo(in_x)
+        if in_halo is None:
+            return None
+        halo = max(halo, in_halo)
+    return node.HALO + halo
+
+
+def open_output(out, size, channels=4):
+    """ (W, H, channels) float32 np.memmap at path out, or out itself if it's an array """
+    shape = (size[0], size[1], channels)
+    if isinstance(out, np.ndarray):
+        if out.shape != shape or out.dtype != np.float32:
+            raise Exception(
+                "[Tiled] output should be float32 of shape {}, got {} {}".format(
+                    shape, out.dtype, out.shape))
+        return out
+
+    # raw float32 file, no header
+    return np.memmap(out, dtype=np.float32, mode="w+", shape=shape)
+
+
+class TiledRenderer(object):
+    """
+    build(init) -> node makes the graph for one tile, from given Init.
+    init covers the tile plus halo, use init.crop(data) for full size
+    numpy inputs and shared textures for noise, so tiles line up.
+    """
+
+    def __init__(self, build, size, tile_size=(1024, 1024), gl=None, backend="gl", halo=None):
+        super(TiledRenderer, self).__init__()
+
+        self.build = build
+        self.W, self.H = size[0], size[1]
+        self.tile_W, self.tile_H = tile_size[0], tile_size[1]
+        self.gl = gl
+        self.backend = backend
+
+        # found from the graph on first render when not given
+        self.halo = halo
+
+        self.tiles_rendered = 0
+        self.peak_tile_bytes = 0
+
+    def tiles(self):
+        """ (x, y, w, h) of each tile, row by row """
+        for y in range(0, self.H, self.tile_H):
+            for x in range(0, self.W, self.tile_W):
+                w = min(self.tile_W, self.W - x)
+                h = min(self.tile_H, self.H - y)
+                yield (x, y, w, h)
+
+    def tile_init(self, x, y, w, h, halo=0):
+        init = Init(size=(w + halo * 2, h + halo * 2), gl=self.gl, backend=self.backend)
+        init.set_region((x - halo, y - halo), (self.W, self.H))
+
+        # later tiles share the context
+        self.gl = init.gl
+        return init
+
+    def find_halo(self):
+        x, y, w, h = next(self.tiles())
+        node = self.build(self.tile_init(x, y, w, h))
+
+        halo = graph_halo(node)
+        if halo is None:
+            raise Exception(
+                "[Tiled] {} needs the whole image, it can't be rendered in tiles".format(
+                    type(node).__name__))
+        return halo
+
+    def render_tile(self, x, y, w, h):
+        """ (h, w, channels) pixels of tile in row order """
+        halo = self.halo
+        node = self.build(self.tile_init(x, y, w, h, halo))
+
+        data = np.asarray(node.out_node(), dtype=np.float32)
+        self.peak_tile_bytes = max(self.peak_tile_bytes, data.nbytes)
+
+        data = data.reshape((h + halo * 2, w + halo * 2, data.shape[-1]))
+        return data[halo:halo + h, halo:halo + w]
+
+    def render(self, out):
+        """
+        render into out, a path of raw float32 file or (W, H, channels) array.
+        returns output as np.memmap / array, same layout as out_node.
+        """
+
+        if self.halo is None:
+            self.halo = self.find_halo()
+
+        output = None
+        for x, y, w, h in self.tiles():
+            tile = self.render_tile(x, y, w, h)
+            if output is None:
+                # channel count of graph's storage format
+                output = open_output(out, (self.W, self.H), tile.shape[-1])
+                rows = output.reshape((self.H, self.W, tile.shape[-1]))
+
+            rows[y:y + h, x:x + w] = tile
+            self.tiles_rendered += 1
+
+            if isinstance(output, np.memmap) and x + w == self.W:
+                # drop written pages of finished tile row
+                output.flush()
+
+        return output
@@ -18,32 +18,58 @@ def cpu_noise(w, h):
     return np.random.uniform(0.0, 1.0, (w, h, 4))
 
 
-def _serialize_data_for_output(data):
-    data = data[::-1]
-    data = np.multiply(data, 255.0)
-    data = data.astype(np.uint8)
+def _serialize_data_for_output(data, fmt="rgba8", channels=None):
+    """
+    flipped, clamped 8 bit pixels. nodes and TextureHandles are
+    quantized on GPU so only packed bytes are read back.
+    """
+
+    from .op_quantize import quantize
+
+    if isinstance(data, np.ndarray) and fmt == "rgba8" and channels is None:
+        # arrays keep their layout, (W, H) and (W, H, 1) as grayscale
+        count = 1 if data.ndim == 2 else data.shape[-1]
+        fmt = {1: "r8", 3: "rgb8"}.get(count, fmt)
+
+    data = quantize(data, fmt, channels, flip=True)
+    if data.shape[-1] == 1:
+        # single channel images are written as grayscale
+        data = data[..., 0]
     return data
 
 
-def npwrite(path, data: np.ndarray):
-    data = _serialize_data_for_output(data)
+def npwrite(path, data, fmt="rgba8", channels=None):
+    data = _serialize_data_for_output(data, fmt, channels)
     ii.imwrite(path, data)
 
 
-def npappend(writer, data: np.ndarray):
-    data = _serialize_data_for_output(data)
+def npappend(writer, data, fmt="rgba8", channels=None):
+    data = _serialize_data_for_output(data, fmt, channels)
     writer.append_data(data)
 
 
+def _value_to_constant(value):
+    """ vec4 tuple of scalar, vec4 or constant node input, None if not constant """
+    if callable(getattr(value, "constant", None)):
+        return value.constant()
+
+    if isinstance(value, (float, int)):
+        return (float(value),) * 4
+
+    if isinstance(value, (tuple, list, np.ndarray)) and np.shape(value) == (4,):
+        return tuple(float(x) for x in value)
+
+    return None
+
+
 def _value_to_ndarray(value, w: int, h: int):
     converted = None
-    if isinstance(value, (np.ndarray)):
+    if isinstance(value, (np.ndarray)) and value.shape != (4,):
         converted = value
 
-    elif isinstance(value, (float, int)):
-        value = float(value)
-        arr = np.ones((w, h, 4))
-        converted = np.multiply(arr, value)
+    elif _value_to_constant(value) is not None:
+        converted = np.empty((w, h, 4), dtype=np.float32)
+        converted[:] = _value_to_constant(value)
 
     else:
         raise NotADirectoryError(